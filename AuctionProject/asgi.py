@@ -23,6 +23,26 @@ django_asgi_app = get_asgi_application()
 from rooms.routing import websocket_urlpatterns as bid_url
 from notificationapp.routing import websocket_urlpatterns as notification_url
 from authen.middleware.token_auth import TokenAuthMiddlewareStack
+from main.journal import journal_option, start_journal
+from main.scheduler import closer_option, start_scheduler
+from dashboard.metrics import metrics_option, start_metrics
+from main.outbox import outbox_option, start_dispatcher
+
+# 4. Replay the bid journal, if bids are journaled, before serving any room
+if journal_option("PATH"):
+    start_journal()
+
+# 5. Close items at their deadline (and any that ended while we were down)
+if closer_option("AUTOSTART"):
+    start_scheduler()
+
+# 6. Keep the dashboard's counters in the database
+if metrics_option("AUTOSTART"):
+    start_metrics()
+
+# 7. Send the messages signal receivers left in the outbox
+if outbox_option("AUTOSTART"):
+    start_dispatcher()
 
 
 ws_urls = bid_url + notification_url
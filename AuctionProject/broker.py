@@ -0,0 +1,271 @@
+"""
+A small message broker that lets several Daphne processes on one host share
+channel-layer groups (``auction_item_{id}``, ``user_notifications_{id}``...).
+
+Workers connect over a Unix socket with ``AuctionProject.channel_layers.
+BrokerChannelLayer``. The broker keeps the group memberships and routes
+messages to the process that owns each channel. A ``group_send`` costs one
+frame per *process*, not one per member, and the members are listed in that
+frame. When a worker goes away, all of its channels leave their groups.
+A membership also lapses ``group_expiry`` seconds (sent by the worker in its
+``hello``) after its ``group_add``.
+
+Run it next to the workers::
+
+    python manage.py runbroker --path /tmp/auction-channels.sock
+
+Frames are a 4-byte big-endian length followed by a JSON object. Bytes values
+are wrapped as ``{"__bytes__": "<base64>"}``.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import time
+from collections import deque
+
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+DEFAULT_SOCKET_PATH = "/tmp/auction-channels.sock"
+
+
+def _encode_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"{type(value).__name__} can't be sent over the channel layer")
+
+
+def _decode_hook(obj):
+    if len(obj) == 1 and "__bytes__" in obj:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+
+def encode_frame(payload):
+    body = json.dumps(payload, default=_encode_default, separators=(",", ":")).encode()
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} limit")
+    return json.loads(await reader.readexactly(size), object_hook=_decode_hook)
+
+
+def channel_owner(channel):
+    """The process key of a specific channel ("specific.<key>!<id>"), else None."""
+    if "!" not in channel:
+        return None
+    return channel[: channel.index("!")].rsplit(".", 1)[-1]
+
+
+class _Client:
+    """One connected worker process."""
+
+    def __init__(self, writer, group_expiry):
+        self.writer = writer
+        self.group_expiry = group_expiry
+        self.keys = set()
+        self.listening = set()
+
+    def buffered(self):
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() if transport else 0
+
+
+class Broker:
+    def __init__(self, expiry=60, capacity=100, group_expiry=86400, max_client_buffer=8 * 1024 * 1024):
+        self.expiry = expiry
+        self.capacity = capacity
+        self.group_expiry = group_expiry
+        self.max_client_buffer = max_client_buffer
+
+        self.owners = {}      # process key -> _Client
+        self.listeners = {}   # plain channel name -> set of _Client
+        self.groups = {}      # group -> {channel: joined_at}
+        self.pending = {}     # plain channel name -> deque[(expires, message)]
+        self.stats = {"frames_in": 0, "frames_out": 0, "delivered": 0, "dropped": 0}
+
+    async def serve(self, path=DEFAULT_SOCKET_PATH):
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        os.chmod(path, 0o660)
+        return server
+
+    async def handle(self, reader, writer):
+        client = _Client(writer, self.group_expiry)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                self.stats["frames_in"] += 1
+                self.dispatch(client, frame)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.forget(client)
+            writer.close()
+
+    def dispatch(self, client, frame):
+        op = frame.get("op")
+        if op == "hello":
+            client.keys.add(frame["key"])
+            client.group_expiry = frame.get("group_expiry", client.group_expiry)
+            self.owners[frame["key"]] = client
+        elif op == "send":
+            delivered = self.route(frame["channel"], frame["message"])
+            if "id" in frame:
+                self.write(client, {"op": "ack", "id": frame["id"], "ok": delivered})
+        elif op == "listen":
+            self.listen(client, frame["channel"])
+        elif op == "group_add":
+            self.groups.setdefault(frame["group"], {})[frame["channel"]] = frame.get("joined_at", time.time())
+        elif op == "group_discard":
+            self.discard(frame["group"], frame["channel"])
+        elif op == "group_send":
+            self.group_send(frame["group"], frame["message"])
+        elif op == "batch":
+            # Several group operations coalesced by one client tick
+            for item in frame["items"]:
+                self.dispatch(client, item)
+        elif op == "flush":
+            self.listeners.clear()
+            self.groups.clear()
+            self.pending.clear()
+        elif op == "stats":
+            self.write(client, {"op": "ack", "id": frame["id"], "ok": True, "stats": self.snapshot()})
+
+    # Routing
+
+    def write(self, client, payload):
+        if client.buffered() > self.max_client_buffer:
+            # The process isn't reading; never let one slow worker grow the broker
+            self.stats["dropped"] += 1
+            return False
+        client.writer.write(encode_frame(payload))
+        self.stats["frames_out"] += 1
+        return True
+
+    def route(self, channel, message):
+        key = channel_owner(channel)
+        if key is not None:
+            client = self.owners.get(key)
+            if client is None:
+                self.stats["dropped"] += 1
+                return False
+            return self.deliver(client, [channel], message)
+
+        listeners = self.listeners.get(channel)
+        if listeners:
+            return self.deliver(next(iter(listeners)), [channel], message)
+
+        queue = self.pending.setdefault(channel, deque())
+        self._expire(queue)
+        if len(queue) >= self.capacity:
+            self.stats["dropped"] += 1
+            return False
+        queue.append((time.time() + self.expiry, message))
+        return True
+
+    def deliver(self, client, channels, message, group=None):
+        payload = {"op": "deliver", "channels": channels, "message": message}
+        if group is not None:
+            payload["group"] = group
+        if self.write(client, payload):
+            self.stats["delivered"] += len(channels)
+            return True
+        self.stats["dropped"] += len(channels) - 1
+        return False
+
+    def group_send(self, group, message):
+        members = self.groups.get(group)
+        if not members:
+            return
+        now = time.time()
+        by_client = {}
+        for channel, joined_at in list(members.items()):
+            key = channel_owner(channel)
+            client = self.owners.get(key) if key is not None else None
+            if joined_at + (client.group_expiry if client else self.group_expiry) < now:
+                self.discard(group, channel)
+                continue
+            if client is None:
+                self.route(channel, message)
+                continue
+            by_client.setdefault(client, []).append(channel)
+        for client, channels in by_client.items():
+            self.deliver(client, channels, message, group=group)
+
+    def listen(self, client, channel):
+        client.listening.add(channel)
+        self.listeners.setdefault(channel, set()).add(client)
+        queue = self.pending.pop(channel, None)
+        if queue:
+            self._expire(queue)
+            for _, message in queue:
+                self.deliver(client, [channel], message)
+
+    def discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                self.groups.pop(group, None)
+
+    def forget(self, client):
+        """A worker disconnected (or died): drop its channels from every group."""
+        for key in client.keys:
+            if self.owners.get(key) is client:
+                del self.owners[key]
+        if client.keys:
+            for group, members in list(self.groups.items()):
+                for channel in [c for c in members if channel_owner(c) in client.keys]:
+                    del members[channel]
+                if not members:
+                    del self.groups[group]
+        for channel in client.listening:
+            listeners = self.listeners.get(channel)
+            if listeners is not None:
+                listeners.discard(client)
+                if not listeners:
+                    del self.listeners[channel]
+
+    def _expire(self, queue):
+        now = time.time()
+        while queue and queue[0][0] < now:
+            queue.popleft()
+            self.stats["dropped"] += 1
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "processes": len(self.owners),
+            "groups": len(self.groups),
+            "members": sum(len(m) for m in self.groups.values()),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the channel-layer broker.")
+    parser.add_argument("--path", default=os.environ.get("CHANNEL_BROKER_SOCKET", DEFAULT_SOCKET_PATH))
+    args = parser.parse_args(argv)
+    run(args.path)
+
+
+def run(path):
+    async def serve():
+        server = await Broker().serve(path)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
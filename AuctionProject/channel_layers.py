@@ -0,0 +1,256 @@
+"""
+Channel layer backed by the project's Unix-socket broker (AuctionProject.broker).
+
+Each event loop of a worker process opens its own connection and registers a
+process key. Channels created by ``new_channel()`` carry that key, so the
+broker knows which process to route them to. The layer adds two things on
+top of the channel layer spec:
+
+* group operations issued in the same loop iteration are coalesced into a
+  single ``batch`` frame (a ``gather`` over many ``group_send`` calls becomes
+  one write);
+* per-channel *and* per-group capacities: a message delivered through a group
+  is checked against the capacity matching the group name, so a hot
+  ``auction_item_*`` room can't fill sockets past its own limit.
+
+A connection is closed with its loop: ``async_to_sync`` runs each call in a
+loop of its own, and the broker would otherwise keep one process entry per
+call. Group memberships expire ``group_expiry`` seconds after their
+``group_add``, at the broker.
+"""
+import asyncio
+import itertools
+import socket
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .broker import encode_frame, read_frame
+
+
+class _Connection:
+    """One broker connection, bound to the event loop that opened it."""
+
+    def __init__(self, layer, reader, writer, previous=None):
+        self.layer = layer
+        self.loop = asyncio.get_running_loop()
+        self.reader = reader
+        self.writer = writer
+        self.acks = {}
+        self.ids = itertools.count(1)
+        self.batch = []
+        self.batch_sent = None
+        self.closed = False
+
+        if previous is None:
+            self.key = uuid.uuid4().hex[:12]
+            self.queues = {}
+            # (group, channel) -> time of the group_add
+            self.memberships = {}
+        else:
+            # Same key and queues: channel names handed out before the broker
+            # restarted stay valid and waiting receivers keep their queues.
+            self.key = previous.key
+            self.queues = previous.queues
+            self.memberships = previous.memberships
+
+        self.reader_task = asyncio.ensure_future(self._read_loop())
+        self.write({"op": "hello", "key": self.key, "group_expiry": layer.group_expiry})
+        for (group, channel), joined_at in self.memberships.items():
+            self.write({"op": "group_add", "group": group, "channel": channel, "joined_at": joined_at})
+        for channel in self.queues:
+            if "!" not in channel:
+                self.write({"op": "listen", "channel": channel})
+
+    def write(self, payload):
+        self.writer.write(encode_frame(payload))
+
+    async def request(self, payload):
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.acks[request_id] = future
+        self.write({**payload, "id": request_id})
+        return await future
+
+    async def batched(self, payload):
+        """Queue a group operation; everything queued in this tick goes out as one frame."""
+        self.batch.append(payload)
+        if self.batch_sent is None:
+            self.batch_sent = asyncio.ensure_future(self._send_batch())
+        await asyncio.shield(self.batch_sent)
+
+    async def _send_batch(self):
+        await asyncio.sleep(0)
+        items, self.batch, self.batch_sent = self.batch, [], None
+        self.write(items[0] if len(items) == 1 else {"op": "batch", "items": items})
+        await self.writer.drain()
+
+    def queue(self, channel):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue()
+        return queue
+
+    async def _read_loop(self):
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                if frame["op"] == "deliver":
+                    self._deliver(frame)
+                elif frame["op"] == "ack":
+                    future = self.acks.pop(frame["id"], None)
+                    if future is not None and not future.done():
+                        future.set_result(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # Broker gone: reconnect in the background so receivers resume
+            asyncio.ensure_future(self.layer._reconnect(self))
+        finally:
+            # Also reached when the loop shuts down (asyncio.run cancels the task)
+            self.closed = True
+            self.writer.close()
+            for future in self.acks.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Channel broker connection lost"))
+
+    def _deliver(self, frame):
+        message = frame["message"]
+        expires = time.time() + self.layer.expiry
+        group = frame.get("group")
+        for channel in frame["channels"]:
+            queue = self.queue(channel)
+            capacity = self.layer.get_capacity(group or channel)
+            if queue.qsize() >= capacity:
+                self.layer.dropped += 1
+                continue
+            queue.put_nowait((expires, message))
+
+    def close(self):
+        self.closed = True
+        if self.loop.is_closed():
+            # Nothing runs on that loop any more: end the connection at the
+            # socket so the broker drops the process; the file descriptor
+            # goes with the transport
+            try:
+                self.writer.get_extra_info("socket").shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
+        self.reader_task.cancel()
+        self.writer.close()
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    """
+    CONFIG options:
+
+    * ``path``: the broker's Unix socket;
+    * ``expiry``/``capacity``/``group_expiry``: as for the other layers
+      (memberships are expired by the broker);
+    * ``channel_capacity``: ``{glob: capacity}`` matched against channel names
+      and, for group messages, against group names.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, path, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = path
+        self.group_expiry = group_expiry
+        self.dropped = 0
+        self._connections = {}
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is None or connection.closed:
+            # Connections of loops that are gone (async_to_sync threads) are useless
+            for other in [l for l in self._connections if l.is_closed()]:
+                self._connections.pop(other).close()
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            connection = self._connections[loop] = _Connection(self, reader, writer, previous=connection)
+        return connection
+
+    async def _reconnect(self, lost, delay=0.1, max_delay=5):
+        loop = asyncio.get_running_loop()
+        while self._connections.get(loop) is lost and lost.queues:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+                continue
+            self._connections[loop] = _Connection(self, reader, writer, previous=lost)
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        connection = await self._connection()
+        reply = await connection.request({"op": "send", "channel": channel, "message": message})
+        if not reply["ok"]:
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        connection = await self._connection()
+        if "!" not in channel and channel not in connection.queues:
+            connection.write({"op": "listen", "channel": channel})
+        queue = connection.queue(channel)
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires >= time.time():
+                    return message
+        finally:
+            if queue.empty() and channel in connection.queues and not queue._getters:
+                connection.queues.pop(channel, None)
+
+    async def new_channel(self, prefix="specific."):
+        connection = await self._connection()
+        return f"{prefix}.{connection.key}!{uuid.uuid4().hex[:12]}"
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        connection = await self._connection()
+        joined_at = connection.memberships[group, channel] = time.time()
+        await connection.batched({"op": "group_add", "group": group, "channel": channel, "joined_at": joined_at})
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        connection = await self._connection()
+        connection.memberships.pop((group, channel), None)
+        await connection.batched({"op": "group_discard", "group": group, "channel": channel})
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        connection = await self._connection()
+        await connection.batched({"op": "group_send", "group": group, "message": message})
+
+    # Flush extension
+
+    async def flush(self):
+        connection = await self._connection()
+        await connection.batched({"op": "flush"})
+        connection.queues.clear()
+        connection.memberships.clear()
+
+    async def stats(self):
+        """Broker counters (frames, deliveries, drops, processes, groups)."""
+        connection = await self._connection()
+        reply = await connection.request({"op": "stats"})
+        return {**reply["stats"], "dropped_locally": self.dropped}
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.pop(loop, None)
+        if connection is not None:
+            connection.close()
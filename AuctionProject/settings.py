@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -160,6 +162,90 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Several Daphne processes: run `python manage.py runbroker` and point every
+# worker at the same socket so groups span processes.
+CHANNEL_BROKER_SOCKET = os.environ.get("CHANNEL_BROKER_SOCKET")
+if CHANNEL_BROKER_SOCKET:
+    CHANNEL_LAYERS["default"] = {
+        "BACKEND": "AuctionProject.channel_layers.BrokerChannelLayer",
+        "CONFIG": {
+            "path": CHANNEL_BROKER_SOCKET,
+            "capacity": 100,
+            "channel_capacity": {
+                "auction_item_*": 200,
+                "user_notifications_*": 50,
+            },
+        },
+    }
+
+# Accepted bids of a room are sent together, once per window (seconds);
+# 0 sends every bid in its own frame. See rooms/broadcaster.py
+BID_BROADCAST_WINDOW = 0.01
+
+# Threads accepting bids (the one sync call of a bid) in each process; empty
+# means 1 on SQLite, which has a single writer, and 8 otherwise
+BID_ACCEPT_WORKERS = None
+
+# Write-behind bid journal (see main/journal.py): accepted bids are fsynced
+# to this file in groups and written to the database in batches. Rooms must
+# then be served by a single process each.
+BID_JOURNAL = {
+    "PATH": os.environ.get("BID_JOURNAL_PATH"),
+    "FLUSH_INTERVAL": 0.05,
+    "BATCH_SIZE": 1000,
+}
+
+# Watcher counts of the bidding rooms, sent every INTERVAL seconds to the
+# rooms that changed. See rooms/presence.py
+ROOM_PRESENCE = {
+    "INTERVAL": 2,
+    "STALE_AFTER": 30,
+}
+
+# Items are closed at their deadline by a scheduler started with the ASGI app
+# (or `manage.py run_auction_closer`). See main/scheduler.py
+AUCTION_CLOSER = {
+    "AUTOSTART": True,
+    "BATCH_SIZE": 500,
+    "RESYNC": 300,
+}
+
+# Dashboard counters and rollups, flushed and reconciled by a thread started
+# with the ASGI app (or `manage.py reconcile_metrics`). See dashboard/metrics.py
+DASHBOARD_METRICS = {
+    "AUTOSTART": True,
+    "FLUSH_INTERVAL": 5,
+    "RECONCILE": 300,
+}
+
+# Channel-layer messages of signal receivers are written to an outbox table
+# with their transaction and sent by a dispatcher thread started with the ASGI
+# app. See main/outbox.py
+OUTBOX = {
+    "AUTOSTART": True,
+    "POLL_INTERVAL": 1,
+    "BATCH_SIZE": 500,
+    "MAX_ATTEMPTS": 8,
+}
+
+# Category and auction list responses are cached per generation, bumped when
+# those rows change; auction lists also expire at the next status change.
+# See main/response_cache.py
+RESPONSE_CACHE = {
+    "MAX_TTL": 300,
+}
+
+# Shared by every process of the host: a save in one worker must bump the list
+# cache generations the others read. A process-local backend (LocMemCache)
+# would serve stale lists from the other workers until MAX_TTL.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CACHE_DIR", os.path.join(tempfile.gettempdir(), "auction-cache")),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
 # CORS
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -173,6 +259,15 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# Notifications
+# Storage per broadcast category: "write" keeps one row per recipient (fan-out
+# on write), "read" keeps a single shared row (fan-out on read). Existing rows
+# can be converted with `manage.py fold_broadcast_notifications`.
+NOTIFICATION_DELIVERY_MODES = {
+    "AUCTION_CREATED": "write",
+    "SYSTEM_UPDATE": "write",
+}
+
 # SSE
 EVENTSTREAM_ALLOW_NO_GRIP = True
 EVENTSTREAM_STORAGE_CLASS = "django_eventstream.storage.DjangoModelStorage"
\ No newline at end of file
@@ -22,6 +22,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include("main.urls")),
     path('api/', include("rooms.urls")),
+    path('api/', include("notificationapp.urls")),
     path('api/auth/', include("authen.urls")),
     path('api/dashboard/', include("dashboard.urls")),
 ]
@@ -1,10 +1,11 @@
 import urllib.parse
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
 from django.db import close_old_connections
 
+from authen.token_cache import token_cache
+
 # Get the active user model
 User = get_user_model()
 
@@ -18,30 +19,8 @@ def get_user_from_token(token_key):
     # This prevents the "SynchronousOnlyOperation" error in ASGI environments.
     close_old_connections() 
     
-    try:
-        # 1. Validate the token and decode it
-        access_token = AccessToken(token_key)
-        
-        # 2. Extract user ID
-        user_id = access_token['user_id']
-        
-        # 3. Retrieve user from the database
-        user = User.objects.get(id=user_id)
-        
-        # 4. Simple JWT might allow tokens for inactive users; ensure the user is active
-        if not user.is_active:
-            print(f"JWT Validation: User {user_id} is inactive.")
-            return AnonymousUser()
-        
-        return user
-        
-    except User.DoesNotExist:
-        print("JWT Validation: User ID in token not found in database.")
-        return AnonymousUser()
-    except Exception as e:
-        # Handles exceptions like ExpiredSignatureError, InvalidToken, etc.
-        print(f"JWT Validation Error: {e}")
-        return AnonymousUser()
+    # Decoded claims and the user row are cached (see authen.token_cache)
+    return token_cache.get_user(token_key)
 
 
 class WebSocketTokenAuthMiddleware:
@@ -66,8 +45,11 @@ class WebSocketTokenAuthMiddleware:
 
         # 2. If a token is found, authenticate the user
         if token_key:
-            # Use the asynchronous database function to retrieve the user
-            scope['user'] = await get_user_from_token(token_key)
+            user = token_cache.cached_user(token_key)
+            if user is None:
+                # Use the asynchronous database function to retrieve the user
+                user = await get_user_from_token(token_key)
+            scope['user'] = user
         else:
             # If no token is provided, assign an AnonymousUser
             scope['user'] = AnonymousUser()
@@ -86,7 +68,8 @@ from django.utils.deprecation import MiddlewareMixin
 class TokenAuthenticationMiddleware(MiddlewareMixin):
 
     def process_request(self, request):
-        close_old_connections()
+        # Django already recycles connections on request_started/finished;
+        # a cached token doesn't need the database at all.
 
         # If user is already authenticated (session), do nothing
         if hasattr(request, "user") and request.user.is_authenticated:
@@ -107,10 +90,4 @@ class TokenAuthenticationMiddleware(MiddlewareMixin):
             request.user = AnonymousUser()
             return
 
-        try:
-            access_token = AccessToken(token)
-            user_id = access_token["user_id"]
-            user = User.objects.get(id=user_id)
-            request.user = user
-        except Exception:
-            request.user = AnonymousUser()
\ No newline at end of file
+        request.user = token_cache.get_user(token)
\ No newline at end of file
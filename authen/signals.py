@@ -1,14 +1,32 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from asgiref.sync import async_to_sync
-from dashboard.events_queue import event_queue
-import json
+from dashboard.events import broadcaster
+from dashboard.metrics import USERS, current_value
+from authen.token_cache import token_cache
 
 User = get_user_model()
 
+def publish_user_count():
+    # Once committed, so a rolled back signup doesn't skew the count; it is
+    # the dashboard's own count (dashboard.metrics), the same in every process
+    transaction.on_commit(lambda: broadcaster.publish({"user_count": int(current_value(USERS))}))
+
+
 @receiver(post_save, sender=User)
 def user_created_signal(sender, instance, created, **kwargs):
     if created:
-        data = json.dumps({"user_count": User.objects.count()})
-        async_to_sync(event_queue.put)(data)
+        publish_user_count()
+
+
+@receiver(post_delete, sender=User)
+def user_deleted_signal(sender, instance, **kwargs):
+    publish_user_count()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # Deactivated, edited or deleted: the next request reloads the row
+    token_cache.forget_user(instance.pk)
@@ -1,3 +1,102 @@
-from django.test import TestCase
+import subprocess
+import sys
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .middleware.token_auth import TokenAuthenticationMiddleware, WebSocketTokenAuthMiddleware
+from .token_cache import TokenCache, token_cache
+
+User = get_user_model()
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create(username="bidder")
+        self.token = str(AccessToken.for_user(self.user))
+
+    def test_repeated_requests_cost_no_queries(self):
+        middleware = TokenAuthenticationMiddleware(lambda request: None)
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        middleware.process_request(request)
+        self.assertEqual(request.user, self.user)
+
+        with self.assertNumQueries(0):
+            for _ in range(10000):
+                request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {self.token}")
+                middleware.process_request(request)
+        self.assertEqual(request.user.username, "bidder")
+
+    def test_each_hit_gets_its_own_instance(self):
+        first = token_cache.get_user(self.token)
+        first.username = "changed"
+        self.assertEqual(token_cache.get_user(self.token).username, "bidder")
+
+    def test_saving_the_user_invalidates(self):
+        token_cache.get_user(self.token)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(token_cache.get_user(self.token).is_authenticated)
+
+    def test_saves_in_another_process_invalidate(self):
+        token_cache.get_user(self.token)
+        # The other worker saved the row; this one only sees its signal's effect
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        subprocess.run(
+            [sys.executable, "manage.py", "shell", "-c",
+             f"from authen.token_cache import token_cache; token_cache.forget_user({self.user.pk})"],
+            cwd=settings.BASE_DIR, check=True, capture_output=True,
+        )
+        self.assertIsNone(token_cache.cached_user(self.token))
+        self.assertFalse(token_cache.get_user(self.token).is_authenticated)
+
+    def test_entries_never_outlive_the_token(self):
+        token = AccessToken.for_user(self.user)
+        token.set_exp(lifetime=timedelta(seconds=30))
+        raw = str(token)
+        self.assertTrue(token_cache.get_user(raw).is_authenticated)
+        self.assertIsNotNone(token_cache.cached_user(raw))
+
+        # Well inside the cache TTL, but past the token's exp
+        with mock.patch("authen.token_cache.time.time", return_value=token["exp"] + 1):
+            self.assertIsNone(token_cache.cached_user(raw))
+
+    def test_cache_is_bounded(self):
+        cache = TokenCache(max_entries=2)
+        other = User.objects.create(username="other")
+        tokens = [str(AccessToken.for_user(u)) for u in (self.user, other, self.user)]
+        for raw in tokens:
+            cache.get_user(raw)
+        self.assertEqual(len(cache.claims), 2)
+        self.assertIsNone(cache.cached_user(tokens[0]))
+
+
+class WebSocketTokenAuthTests(TransactionTestCase):
+    def test_reconnect_storm_skips_the_database(self):
+        token_cache.clear()
+        user = User.objects.create(username="bidder")
+        token = str(AccessToken.for_user(user))
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(scope["user"])
+            await send({"type": "websocket.close"})
+
+        async def connect():
+            communicator = WebsocketCommunicator(WebSocketTokenAuthMiddleware(app), f"/ws/?token={token}")
+            await communicator.connect()
+            await communicator.disconnect()
+
+        async_to_sync(connect)()
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                async_to_sync(connect)()
+        self.assertEqual(len(seen), 101)
+        self.assertTrue(all(u.pk == user.pk for u in seen))
@@ -0,0 +1,161 @@
+"""
+Cache for JWT authentication.
+
+Verifying an access token means decoding it and loading its user, on every
+HTTP request and every WebSocket handshake. Both halves are cached here:
+
+* decoded claims, keyed on the raw token, until the token's ``exp`` (or the
+  cache TTL, whichever comes first);
+* a snapshot of the user row, keyed on the user id. Every hit rebuilds a fresh
+  instance with ``User.from_db``, so callers never share one object.
+
+Claims never change, so they stay in process memory. User snapshots live in the
+shared ``default`` cache instead: ``post_save``/``post_delete`` on the user
+model (``authen.signals``) drop them for every worker, so a deactivated user or
+a new password takes effect everywhere on the next request, not after ``TTL``.
+
+Settings (all optional)::
+
+    TOKEN_CACHE = {"MAX_ENTRIES": 10000, "TTL": 300}
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+User = get_user_model()
+
+_MISSING = object()
+
+PREFIX = "token_cache:user"
+
+
+def _option(name, default):
+    return getattr(settings, "TOKEN_CACHE", {}).get(name, default)
+
+
+class TTLCache:
+    """A bounded LRU mapping whose entries carry their own expiry (wall clock)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenCache:
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or _option("MAX_ENTRIES", 10000)
+        self.ttl = ttl or _option("TTL", 300)
+        self.claims = TTLCache(self.max_entries)
+        self.field_names = [field.attname for field in User._meta.concrete_fields]
+
+    # Claims
+
+    def get_claims(self, raw_token):
+        """Decoded, verified claims of ``raw_token`` or None if it is invalid/expired."""
+        claims = self.claims.get(raw_token)
+        if claims is not _MISSING:
+            return claims
+        try:
+            claims = AccessToken(raw_token).payload
+        except Exception as e:
+            # Handles exceptions like ExpiredSignatureError, InvalidToken, etc.
+            print(f"JWT Validation Error: {e}")
+            return None
+        # Never keep a token past its own expiry
+        self.claims.set(raw_token, claims, min(claims["exp"], time.time() + self.ttl))
+        return claims
+
+    # Users
+
+    def cached_user(self, raw_token):
+        """
+        The user for ``raw_token`` if both halves are cached, else None.
+        Never queries, so it is safe to call from async code.
+        """
+        claims = self.claims.get(raw_token)
+        if claims is _MISSING:
+            return None
+        row = cache.get(self._key(claims.get(api_settings.USER_ID_CLAIM)), _MISSING)
+        if row is _MISSING:
+            return None
+        return self._build(row)
+
+    def get_user(self, raw_token):
+        """The active user for ``raw_token``, or AnonymousUser. Queries on a miss only."""
+        claims = self.get_claims(raw_token)
+        if claims is None:
+            return AnonymousUser()
+        # Simple JWT stores the id as a string; signals pass the pk
+        user_id = str(claims.get(api_settings.USER_ID_CLAIM))
+        row = cache.get(self._key(user_id), _MISSING)
+        if row is _MISSING:
+            row = User.objects.filter(pk=user_id).values_list(*self.field_names).first()
+            cache.set(self._key(user_id), row, self.ttl)
+        return self._build(row)
+
+    def _key(self, user_id):
+        return f"{PREFIX}:{user_id}"
+
+    def _build(self, row):
+        if row is None:
+            print("JWT Validation: User ID in token not found in database.")
+            return AnonymousUser()
+        user = User.from_db(DEFAULT_DB_ALIAS, self.field_names, row)
+        # Simple JWT might allow tokens for inactive users; ensure the user is active
+        if not user.is_active:
+            print(f"JWT Validation: User {user.pk} is inactive.")
+            return AnonymousUser()
+        return user
+
+    def forget_user(self, user_id):
+        """Drop the snapshot now and again on commit, so no worker re-caches the old row."""
+        key = self._key(user_id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def clear(self):
+        # The snapshots share the default cache, which is cleared with them
+        self.claims.clear()
+        cache.clear()
+
+
+token_cache = TokenCache()
@@ -0,0 +1,109 @@
+"""
+Pub/sub for the dashboard's server-sent events.
+
+Every ``/api/dashboard/events/`` stream subscribes to the process-wide
+``broadcaster`` and gets each published event. A subscriber has its own
+bounded ring buffer: a dashboard that falls behind loses its oldest pending
+events, it never holds up the others or the publisher. The last ``HISTORY``
+events are kept so a reconnecting ``EventSource`` resumes after its
+``Last-Event-ID``. Event ids are ``<key>-<n>``, ``key`` naming the process's
+broadcaster: a reconnect that lands on another process (or on this one after
+a restart) can't be matched against its counter and gets every kept event.
+
+``publish`` may be called from any thread (signals run in the request's).
+Events are process-local, like the rooms' broadcasters; the counts they
+carry are read from ``dashboard.metrics``. Settings::
+
+    DASHBOARD_EVENTS = {"HISTORY": 1000, "BUFFER": 100, "HEARTBEAT": 15}
+"""
+import asyncio
+import json
+import threading
+import uuid
+from collections import deque
+
+from django.conf import settings
+
+DEFAULTS = {"HISTORY": 1000, "BUFFER": 100, "HEARTBEAT": 15}
+
+
+def events_option(name):
+    return getattr(settings, "DASHBOARD_EVENTS", {}).get(name, DEFAULTS[name])
+
+
+class Subscription:
+    def __init__(self, broadcaster, buffer):
+        self.broadcaster = broadcaster
+        self.events = deque(maxlen=buffer)
+        self.dropped = 0
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+
+    def push(self, event):
+        # Called with the broadcaster's lock held, from any thread
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def next(self, timeout=None):
+        """The next ``(id, data)`` event, or None after ``timeout`` seconds without one."""
+        while True:
+            with self.broadcaster.lock:
+                if self.events:
+                    return self.events.popleft()
+                self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class EventBroadcaster:
+    def __init__(self, history=None, key=None):
+        self.lock = threading.Lock()
+        self.history = deque(maxlen=history or events_option("HISTORY"))
+        self.key = key or uuid.uuid4().hex[:8]
+        self.last_id = 0
+        self.subscribers = set()
+
+    def publish(self, data):
+        """Send ``data`` (JSON-serializable) to every subscriber; returns the event id."""
+        text = json.dumps(data)
+        with self.lock:
+            self.last_id += 1
+            event = (f"{self.key}-{self.last_id}", text)
+            self.history.append(event)
+            for subscriber in self.subscribers:
+                subscriber.push(event)
+        return event[0]
+
+    def subscribe(self, last_event_id=None, buffer=None):
+        """
+        Subscribe from a coroutine. With ``last_event_id``, the kept events
+        after it are queued first (all of them if it isn't one of ours).
+        """
+        subscription = Subscription(self, buffer or events_option("BUFFER"))
+        with self.lock:
+            if last_event_id is not None:
+                after = self.sequence(last_event_id)
+                for event in self.history:
+                    if self.sequence(event[0]) > after:
+                        subscription.push(event)
+            self.subscribers.add(subscription)
+        return subscription
+
+    def sequence(self, event_id):
+        """The ``n`` of ``event_id`` if this broadcaster sent it, else 0."""
+        key, _, n = event_id.rpartition("-")
+        return int(n) if key == self.key and n.isdigit() else 0
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+
+broadcaster = EventBroadcaster()
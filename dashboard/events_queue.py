@@ -1,3 +0,0 @@
-import asyncio
-
-event_queue = asyncio.Queue()
\ No newline at end of file
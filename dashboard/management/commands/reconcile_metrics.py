@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from dashboard.metrics import MetricsFlusher, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the dashboard's metric counters and recent rollups from the tables "
+        "(see DASHBOARD_METRICS). With --watch, keep flushing and reconciling in this process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", type=int, help="Seconds of rollups to recount (default RECONCILE_WINDOW)")
+        parser.add_argument("--watch", action="store_true")
+
+    def handle(self, *args, **options):
+        if not options["watch"]:
+            reconcile(window=options["window"])
+            self.stdout.write("Dashboard metrics reconciled")
+            return
+
+        flusher = MetricsFlusher().start()
+        try:
+            flusher.thread.join()
+        except KeyboardInterrupt:
+            flusher.stop()
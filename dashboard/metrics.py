@@ -0,0 +1,286 @@
+"""
+Real-time metrics of the dashboard.
+
+Signals and consumers ``record`` what happens (a bid, a signup, a socket
+opening) into ``metrics``, the process's recorder: an in-memory tally, so
+recording never touches the database and is safe from async code. The
+tally is added to the ``MetricCounter`` totals and the per minute/hour/day
+``MetricRollup`` buckets by ``flush``, every ``FLUSH_INTERVAL`` seconds; each
+flush costs one UPDATE per metric and bucket touched, however many events it
+carries. Reading the dashboard is a few single-row lookups no matter how big
+the tables get, and writes nothing: it shows the counters as of the last
+flush.
+
+``reconcile`` recounts the totals and the recent buckets from the tables
+themselves every ``RECONCILE`` seconds, which catches any drift (a save
+rolled back after it was counted, rows written by another path, a process
+that died with an unflushed tally), sets the gauges that depend on the
+clock (live auctions), recounts the open room sockets from the presence
+tables (a process that died with sockets open stops counting) and prunes old
+minute buckets. Settings::
+
+    DASHBOARD_METRICS = {"AUTOSTART": True, "FLUSH_INTERVAL": 5, "RECONCILE": 300, "RECONCILE_WINDOW": 7200, "MINUTE_RETENTION": 2}
+"""
+import threading
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from main.models import Auction, AuctionResult, Bid
+from rooms.presence import live_watchers
+from .models import MetricCounter, MetricRollup
+
+DEFAULTS = {"AUTOSTART": True, "FLUSH_INTERVAL": 5, "RECONCILE": 300, "RECONCILE_WINDOW": 7200, "MINUTE_RETENTION": 2}
+
+PERIODS = [MetricRollup.MINUTE, MetricRollup.HOUR, MetricRollup.DAY]
+
+# Metrics
+USERS = "users"
+AUCTIONS = "auctions"
+LIVE_AUCTIONS = "live_auctions"
+BIDS = "bids"
+GMV = "gmv"
+SOCKETS = "sockets"
+
+User = get_user_model()
+
+
+def metrics_option(name):
+    return getattr(settings, "DASHBOARD_METRICS", {}).get(name, DEFAULTS[name])
+
+
+def bucket_start(at, period):
+    """Start of the ``period`` bucket holding ``at`` (days start at local midnight)."""
+    at = timezone.localtime(at).replace(second=0, microsecond=0)
+    if period != MetricRollup.MINUTE:
+        at = at.replace(minute=0)
+    if period == MetricRollup.DAY:
+        at = at.replace(hour=0)
+    return at
+
+
+def add_to(model, delta, **lookup):
+    """``value += delta`` on the row of ``lookup``, created if missing."""
+    if model.objects.filter(**lookup).update(value=F("value") + delta):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(value=delta, **lookup)
+    except IntegrityError:
+        # Created meanwhile by another process
+        model.objects.filter(**lookup).update(value=F("value") + delta)
+
+
+class MetricsRecorder:
+    def __init__(self, clock=timezone.now):
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (name, key) -> delta; (name, key, period, bucket) -> delta
+        self.counters = Counter()
+        self.rollups = Counter()
+
+    def record(self, name, delta=1, key="", at=None, rollup=True):
+        """
+        Count ``delta`` more of ``name`` (e.g. -1 for a socket closing). With
+        ``rollup``, it is also counted in the buckets holding ``at`` (now).
+        """
+        at = at or self.clock()
+        with self.lock:
+            self.counters[(name, key)] += delta
+            if rollup:
+                for period in PERIODS:
+                    self.rollups[(name, key, period, bucket_start(at, period))] += delta
+
+    def flush(self):
+        """Add the tally to the database. Sync; returns how many rows were touched."""
+        with self.lock:
+            counters, self.counters = self.counters, Counter()
+            rollups, self.rollups = self.rollups, Counter()
+        try:
+            with transaction.atomic():
+                for (name, key), delta in counters.items():
+                    if delta:
+                        add_to(MetricCounter, delta, name=name, key=key)
+                for (name, key, period, bucket), delta in rollups.items():
+                    if delta:
+                        add_to(MetricRollup, delta, name=name, key=key, period=period, bucket=bucket)
+        except Exception:
+            # Kept for the next flush
+            with self.lock:
+                self.counters.update(counters)
+                self.rollups.update(rollups)
+            raise
+        return len(counters) + len(rollups)
+
+    def pending(self, name, key=""):
+        """What was recorded for ``name`` and isn't flushed yet."""
+        with self.lock:
+            return self.counters[(name, key)]
+
+
+def counter_values(name, keys=None):
+    """``{key: value}`` of the totals of ``name``."""
+    counters = MetricCounter.objects.filter(name=name)
+    if keys is not None:
+        counters = counters.filter(key__in=keys)
+    return dict(counters.values_list("key", "value"))
+
+
+def current_value(name, key=""):
+    """The total of ``name``: its ``MetricCounter`` plus this process's unflushed tally."""
+    stored = MetricCounter.objects.filter(name=name, key=key).values_list("value", flat=True).first()
+    return (stored or 0) + metrics.pending(name, key)
+
+
+def rollup_values(name, period, start, end, key=""):
+    """``{bucket: value}`` of the ``period`` buckets of ``name`` from ``start`` to ``end``."""
+    return dict(
+        MetricRollup.objects.filter(
+            name=name, key=key, period=period, bucket__gte=bucket_start(start, period), bucket__lte=end
+        ).values_list("bucket", "value")
+    )
+
+
+def snapshot(now=None):
+    """What ``DashboardView`` shows, read from the counters and today's buckets."""
+    now = now or timezone.now()
+    totals = dict(
+        MetricCounter.objects.filter(
+            name__in=[USERS, AUCTIONS, LIVE_AUCTIONS, BIDS, GMV, SOCKETS], key=""
+        ).values_list("name", "value")
+    )
+    today = bucket_start(now, MetricRollup.DAY)
+    bids_today = rollup_values(BIDS, MetricRollup.DAY, today, today).get(today, 0)
+    gmv_by_category = counter_values(GMV)
+    gmv_by_category.pop("", None)
+    return {
+        "auction_count": int(totals.get(AUCTIONS, 0)),
+        "user_count": int(totals.get(USERS, 0)),
+        "bids_today": int(bids_today),
+        "bid_count": int(totals.get(BIDS, 0)),
+        "live_auctions": int(totals.get(LIVE_AUCTIONS, 0)),
+        "active_sockets": int(totals.get(SOCKETS, 0)),
+        "gmv": totals.get(GMV, Decimal("0")),
+        "gmv_by_category": gmv_by_category,
+    }
+
+
+# Flows recounted by ``reconcile``: metric -> (queryset, time field, aggregate)
+def reconciled_flows():
+    return {
+        USERS: (User.objects.all(), "date_joined", Count("pk")),
+        AUCTIONS: (Auction.objects.all(), "created_at", Count("pk")),
+        BIDS: (Bid.objects.all(), "created_at", Count("pk")),
+        GMV: (AuctionResult.objects.all(), "finalized_at", Sum("winning_bid__amount")),
+    }
+
+
+def set_counter(name, value, key=""):
+    MetricCounter.objects.update_or_create(name=name, key=key, defaults={"value": value or 0})
+
+
+def reconcile(now=None, window=None):
+    """
+    Recount the totals, the gauges and the buckets of the last ``window``
+    seconds from the tables, and prune old minute buckets. Sync.
+    """
+    now = now or timezone.now()
+    window = timedelta(seconds=window or metrics_option("RECONCILE_WINDOW"))
+    # Our own tally first, so it isn't counted twice
+    metrics.flush()
+
+    with transaction.atomic():
+        for name, (queryset, field, aggregate) in reconciled_flows().items():
+            set_counter(name, queryset.aggregate(value=aggregate)["value"])
+            for period in PERIODS:
+                since = bucket_start(now - window, period)
+                buckets = (
+                    queryset.filter(**{f"{field}__gte": since, f"{field}__lte": now})
+                    .annotate(bucket=Trunc(field, period))
+                    .order_by()
+                    .values("bucket")
+                    .annotate(value=aggregate)
+                    .values_list("bucket", "value")
+                )
+                MetricRollup.objects.filter(name=name, key="", period=period, bucket__gte=since).delete()
+                MetricRollup.objects.bulk_create([
+                    MetricRollup(name=name, period=period, bucket=bucket, value=value)
+                    for bucket, value in buckets
+                    if value
+                ])
+
+        set_counter(LIVE_AUCTIONS, Auction.objects.filter(start_date__lte=now, end_date__gt=now).count())
+        gmv = AuctionResult.objects.order_by().values_list("item__category").annotate(value=Sum("winning_bid__amount"))
+        MetricCounter.objects.filter(name=GMV).exclude(key="").delete()
+        MetricCounter.objects.bulk_create([
+            MetricCounter(name=GMV, key=str(category_id), value=value)
+            for category_id, value in gmv
+            if category_id is not None
+        ])
+
+        # The +1/-1 of the consumers drift when a process dies with sockets open:
+        # recounted from the rows of the live workers (one per user and room)
+        rooms = dict(live_watchers(now).order_by().values_list("item_id").annotate(value=Count("pk")))
+        MetricCounter.objects.filter(name=SOCKETS).delete()
+        MetricCounter.objects.bulk_create(
+            [MetricCounter(name=SOCKETS, value=sum(rooms.values()))]
+            + [MetricCounter(name=SOCKETS, key=str(item_id), value=value) for item_id, value in rooms.items()]
+        )
+
+        retention = timedelta(days=metrics_option("MINUTE_RETENTION"))
+        MetricRollup.objects.filter(period=MetricRollup.MINUTE, bucket__lt=now - retention).delete()
+
+
+class MetricsFlusher:
+    """Thread flushing ``metrics`` every ``FLUSH_INTERVAL`` seconds and reconciling every ``RECONCILE``."""
+
+    def __init__(self):
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def run(self):
+        flush_every = metrics_option("FLUSH_INTERVAL")
+        reconcile_every = metrics_option("RECONCILE")
+        reconciled_at = None
+        try:
+            while not self.stopping.wait(flush_every):
+                try:
+                    metrics.flush()
+                    if reconciled_at is None or (timezone.now() - reconciled_at).total_seconds() >= reconcile_every:
+                        reconciled_at = timezone.now()
+                        reconcile()
+                except Exception as e:
+                    print(f"Dashboard metrics error: {e}")
+                    connection.close()
+        finally:
+            connection.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True, name="dashboard-metrics")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        metrics.flush()
+
+
+metrics = MetricsRecorder()
+
+_flusher = None
+
+
+def start_metrics():
+    global _flusher
+    if _flusher is None:
+        _flusher = MetricsFlusher().start()
+    return _flusher
@@ -1,3 +1,45 @@
 from django.db import models
 
-# Create your models here.
+
+class MetricCounter(models.Model):
+    """
+    Running total (or gauge) of a dashboard metric, kept by ``dashboard.metrics``.
+    ``key`` splits a metric by dimension (a category, a room); "" is the overall value.
+    """
+
+    name = models.CharField(max_length=50)
+    key = models.CharField(max_length=50, blank=True, default="")
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["name", "key"], name="metric_counter_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.name}[{self.key}] = {self.value}"
+
+
+class MetricRollup(models.Model):
+    """How much a metric moved during one minute, hour or day starting at ``bucket``."""
+
+    MINUTE = "minute"
+    HOUR = "hour"
+    DAY = "day"
+    PERIODS = [(MINUTE, "Minute"), (HOUR, "Hour"), (DAY, "Day")]
+
+    name = models.CharField(max_length=50)
+    key = models.CharField(max_length=50, blank=True, default="")
+    period = models.CharField(max_length=10, choices=PERIODS)
+    bucket = models.DateTimeField()
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index of the range queries
+            models.UniqueConstraint(fields=["name", "key", "period", "bucket"], name="metric_rollup_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.name}[{self.key}] {self.period} {self.bucket:%Y-%m-%d %H:%M} = {self.value}"
@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from main.bidding import bids_stored
+from main.models import Auction, AuctionResult, Bid, Item
+from .metrics import AUCTIONS, BIDS, GMV, USERS, metrics
+
+User = get_user_model()
+
+# Counted as saved; a save rolled back afterwards is corrected by the next
+# reconcile (dashboard.metrics). Bids are only sent once committed.
+
+
+@receiver(post_save, sender=User)
+def count_user(sender, instance, created, **kwargs):
+    if created:
+        metrics.record(USERS, 1, at=instance.date_joined)
+
+
+@receiver(post_delete, sender=User)
+def uncount_user(sender, instance, **kwargs):
+    metrics.record(USERS, -1, rollup=False)
+
+
+@receiver(post_save, sender=Auction)
+def count_auction(sender, instance, created, **kwargs):
+    if created:
+        metrics.record(AUCTIONS, 1, at=instance.created_at)
+
+
+@receiver(post_delete, sender=Auction)
+def uncount_auction(sender, instance, **kwargs):
+    metrics.record(AUCTIONS, -1, rollup=False)
+
+
+@receiver(bids_stored, sender=Bid)
+def count_bids(sender, bids, **kwargs):
+    for bid in bids:
+        metrics.record(BIDS, 1, at=bid.created_at)
+
+
+@receiver(post_save, sender=AuctionResult)
+def count_sale(sender, instance, created, **kwargs):
+    if not created:
+        return
+    amount = instance.winning_bid.amount
+    category_id = Item.objects.filter(pk=instance.item_id).values_list("category_id", flat=True).first()
+    metrics.record(GMV, amount, at=instance.finalized_at)
+    if category_id is not None:
+        metrics.record(GMV, amount, key=str(category_id), rollup=False)
@@ -1,3 +1,146 @@
-from django.test import TestCase
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from main.benchmarking import seed_auction, seed_users
+from main.models import Bid
+from .events import EventBroadcaster, broadcaster
+from rooms.models import PresenceWorker, RoomWatcher
+from .metrics import (
+    BIDS, LIVE_AUCTIONS, SOCKETS, USERS, MetricsRecorder, counter_values, current_value, metrics, reconcile,
+    rollup_values, snapshot,
+)
+from .models import MetricCounter, MetricRollup
+
+User = get_user_model()
+
+
+class EventBroadcasterTests(SimpleTestCase):
+    async def test_every_subscriber_gets_every_event(self):
+        broadcaster = EventBroadcaster()
+        first, second = broadcaster.subscribe(), broadcaster.subscribe()
+        for count in (1, 2):
+            broadcaster.publish({"user_count": count})
+
+        for subscription in (first, second):
+            events = [await subscription.next(timeout=1) for _ in range(2)]
+            self.assertEqual([json.loads(data)["user_count"] for _, data in events], [1, 2])
+            self.assertIsNone(await subscription.next(timeout=0.01))
+            subscription.close()
+        self.assertEqual(broadcaster.subscribers, set())
+
+    async def test_resumes_after_last_event_id(self):
+        broadcaster = EventBroadcaster()
+        ids = [broadcaster.publish({"n": n}) for n in range(5)]
+        subscription = broadcaster.subscribe(last_event_id=ids[2])
+        self.assertEqual([(await subscription.next(timeout=1))[0] for _ in range(2)], ids[3:])
+        self.assertIsNone(await subscription.next(timeout=0.01))
+
+    async def test_id_of_another_process_gets_every_kept_event(self):
+        broadcaster, other = EventBroadcaster(), EventBroadcaster()
+        ids = [broadcaster.publish({"n": n}) for n in range(3)]
+        # Same counter value, other process
+        subscription = broadcaster.subscribe(last_event_id=other.publish({"n": 0}))
+        self.assertEqual([(await subscription.next(timeout=1))[0] for _ in range(3)], ids)
+        subscription = broadcaster.subscribe(last_event_id="garbage")
+        self.assertEqual((await subscription.next(timeout=1))[0], ids[0])
+
+    async def test_slow_subscriber_drops_its_oldest_events(self):
+        broadcaster = EventBroadcaster()
+        subscription = broadcaster.subscribe(buffer=3)
+        for n in range(10):
+            broadcaster.publish({"n": n})
+        events = [json.loads((await subscription.next(timeout=1))[1])["n"] for _ in range(3)]
+        self.assertEqual(events, [7, 8, 9])
+        self.assertEqual(subscription.dropped, 7)
+
+
+class UserCountEventTests(TestCase):
+    def test_signup_publishes_the_metric_count(self):
+        metrics.flush()
+        MetricCounter.objects.update_or_create(name=USERS, key="", defaults={"value": 41})
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create(username="newcomer")
+        # Counted by the recorder, not flushed yet
+        self.assertEqual(json.loads(broadcaster.history[-1][1]), {"user_count": 42})
+        metrics.flush()
+        self.assertEqual(current_value(USERS), 42)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.now = datetime(2025, 3, 1, 10, 30, tzinfo=timezone.utc)
+
+    def test_flush_adds_the_tally_to_counters_and_rollups(self):
+        recorder = MetricsRecorder()
+        for minutes in (0, 0, 1, 45):
+            recorder.record(BIDS, at=self.now + timedelta(minutes=minutes))
+        recorder.record(BIDS, key="7", rollup=False)
+        recorder.flush()
+        for _ in range(100):
+            recorder.record(BIDS, at=self.now)
+        # One UPDATE per counter and bucket (in a savepoint), not per bid
+        with self.assertNumQueries(2 + 4):
+            self.assertEqual(recorder.flush(), 4)
+
+        self.assertEqual(counter_values(BIDS), {"": 104, "7": 1})
+        minutes = rollup_values(BIDS, MetricRollup.MINUTE, self.now, self.now + timedelta(hours=1))
+        self.assertEqual(list(minutes.values()), [102, 1, 1])
+        hours = rollup_values(BIDS, MetricRollup.HOUR, self.now, self.now + timedelta(hours=1))
+        self.assertEqual(list(hours.values()), [103, 1])
+        self.assertEqual(rollup_values(BIDS, MetricRollup.DAY, self.now, self.now)[datetime(2025, 3, 1, tzinfo=timezone.utc)], 104)
+
+    def test_reconcile_replaces_drifted_values(self):
+        bidder, = seed_users(1)
+        item, = seed_auction(bidder)
+        Bid.objects.bulk_create([Bid(item=item, created_by=bidder, amount=Decimal(10 + n)) for n in range(3)])
+        MetricCounter.objects.create(name=USERS, value=42)
+        MetricRollup.objects.create(name=BIDS, period=MetricRollup.DAY, bucket=timezone.localtime().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        ), value=99)
+
+        reconcile()
+        data = snapshot()
+        self.assertEqual(data["user_count"], 1)
+        self.assertEqual(data["bids_today"], 3)
+        self.assertEqual(data["bid_count"], 3)
+        self.assertEqual(data["live_auctions"], 1)
+        self.assertEqual(counter_values(LIVE_AUCTIONS), {"": 1})
+
+    def test_reconcile_recounts_sockets_of_live_workers(self):
+        first, second = seed_users(2)
+        item, = seed_auction(first)
+        alive = PresenceWorker.objects.create(name="alive", seen_at=timezone.now())
+        dead = PresenceWorker.objects.create(name="dead", seen_at=timezone.now() - timedelta(minutes=5))
+        RoomWatcher.objects.create(worker=alive, item=item, user=first)
+        RoomWatcher.objects.create(worker=dead, item=item, user=second)
+        # Left by the dead worker's sockets, never closed
+        MetricCounter.objects.create(name=SOCKETS, value=7)
+        MetricCounter.objects.create(name=SOCKETS, key=str(item.id), value=7)
+        MetricCounter.objects.create(name=SOCKETS, key="999", value=3)
+
+        reconcile()
+        self.assertEqual(counter_values(SOCKETS), {"": 1, str(item.id): 1})
+        self.assertEqual(snapshot()["active_sockets"], 1)
+
+    def test_range_api_fills_empty_buckets(self):
+        admin, = seed_users(1, prefix="admin")
+        admin.is_staff = True
+        admin.save()
+        MetricRollup.objects.create(name=BIDS, period=MetricRollup.HOUR, bucket=self.now.replace(minute=0), value=4)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.get("/api/dashboard/metrics/", {
+            "metric": BIDS, "period": "hour", "start": "2025-03-01T08:00:00Z", "end": "2025-03-01T11:00:00Z",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b["value"] for b in response.data["buckets"]], [0, 0, 4, 0])
+
+        response = client.get("/api/dashboard/metrics/", {"metric": BIDS, "period": "week"})
+        self.assertEqual(response.status_code, 400)
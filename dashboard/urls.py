@@ -1,6 +1,8 @@
-from .views import DashboardView, events
+from .views import DashboardView, MetricsView, OutboxView, events
 from django.urls import path
 urlpatterns = [
     path('',DashboardView.as_view(),name='dashboard'),
+    path('metrics/',MetricsView.as_view(),name='dashboard-metrics'),
+    path('outbox/',OutboxView.as_view(),name='dashboard-outbox'),
     path("events/",events  ),
 ]
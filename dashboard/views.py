@@ -2,6 +2,7 @@ import asyncio
 import queue
 import random
 import time
+from datetime import timedelta
 from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -11,9 +12,14 @@ from django.db.models import Count
 from django.contrib.auth import get_user_model
 
 from django.http import StreamingHttpResponse
-from .events_queue import event_queue
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from .events import broadcaster, events_option
+from .metrics import PERIODS, bucket_start, rollup_values, snapshot
+from .models import MetricRollup
 
 from main.models import Auction , Bid
+from main.outbox import backlog
 
 User = get_user_model()
 class DashboardView(APIView):
@@ -26,26 +32,99 @@ class DashboardView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
-        today = timezone.now().date()
-        auction_count = Auction.objects.count()
-        user_count = User.objects.count()
-        bids_today = Bid.objects.filter(created_at__date=today).count()
-        data = {
-            "auction_count": auction_count,
-            "user_count":user_count,
-            "bids_today":bids_today,
-            
-        }
-        return Response(data)
+        # Read from the metric counters (dashboard.metrics, flushed on their
+        # timer), not counted
+        return Response(snapshot())
 
 
+PERIOD_LENGTH = {
+    MetricRollup.MINUTE: timedelta(minutes=1),
+    MetricRollup.HOUR: timedelta(hours=1),
+    MetricRollup.DAY: timedelta(days=1),
+}
+MAX_BUCKETS = 1500
+
+
+class OutboxView(APIView):
+    """Backlog of the channel-layer outbox (main.outbox): pending, retrying and failed messages."""
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(backlog())
+
+
+class MetricsView(APIView):
+    """
+    Range query over a metric's rollups:
+    ?metric=bids&period=minute|hour|day&start=<iso>&end=<iso>&key=<dimension>
+    Returns every bucket of the range, 0 for the empty ones. Defaults to the
+    last 60 buckets.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        metric = params.get("metric")
+        period = params.get("period", MetricRollup.HOUR)
+        if not metric:
+            return Response({"error": "metric is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if period not in PERIODS:
+            return Response({"error": f"period must be one of {', '.join(PERIODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            end = parse_datetime(params["end"]) if "end" in params else timezone.now()
+            start = parse_datetime(params["start"]) if "start" in params else end - 59 * PERIOD_LENGTH[period]
+            start, end = [
+                timezone.make_aware(at) if at is not None and timezone.is_naive(at) else at for at in (start, end)
+            ]
+        except ValueError:
+            start = end = None
+        if start is None or end is None or start > end:
+            return Response({"error": "start and end must be ISO datetimes, start first"}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start) / PERIOD_LENGTH[period] >= MAX_BUCKETS:
+            return Response({"error": f"At most {MAX_BUCKETS} buckets per query"}, status=status.HTTP_400_BAD_REQUEST)
+
+        values = rollup_values(metric, period, start, end, key=params.get("key", ""))
+        buckets = []
+        bucket = bucket_start(start, period)
+        while bucket <= end:
+            buckets.append({"bucket": bucket, "value": values.get(bucket, 0)})
+            # Half a period past the next one, so 23 and 25 hour days (DST) still land on it
+            bucket = bucket_start(bucket + PERIOD_LENGTH[period] * 3 / 2, period)
+        return Response({"metric": metric, "period": period, "buckets": buckets})
+
+
+
+def last_event_id(request):
+    return request.headers.get("Last-Event-ID") or None
+
 
 async def events(request):
     """
     Sends server-sent events to the client.
+    Every stream gets every event; a reconnecting EventSource sends
+    Last-Event-ID and gets the events it missed first.
     """
+    heartbeat = events_option("HEARTBEAT")
+    subscription = broadcaster.subscribe(last_event_id(request))
+
     async def event_stream():
-        while True:
-            data = await event_queue.get()
-            yield f"data: {data}\n\n"
-    return StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        try:
+            yield f"retry: {heartbeat * 1000}\n\n"
+            while True:
+                event = await subscription.next(timeout=heartbeat)
+                if event is None:
+                    # Keeps proxies from closing an idle stream
+                    yield ": heartbeat\n\n"
+                    continue
+                event_id, data = event
+                yield f"id: {event_id}\ndata: {data}\n\n"
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,106 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks never touch the configured database: they run inside a throwaway
+copy created the same way the test runner creates its test database.
+"""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.utils import timezone
+
+User = get_user_model()
+
+
+@contextmanager
+def scratch_database():
+    """
+    Create an empty, fully migrated database for the duration of the block.
+
+    SQLite gets a temporary *file* instead of the shared in-memory database so
+    that thread hops (``database_sync_to_async``) behave like production.
+    """
+    tmp_dir = None
+    if connection.vendor == "sqlite":
+        tmp_dir = tempfile.mkdtemp(prefix="auction-bench-")
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tmp_dir, "bench.sqlite3")
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if tmp_dir:
+            os.rmdir(tmp_dir)
+
+
+def seed_users(count, prefix="bench_user"):
+    """Bulk create ``count`` users and return them ordered by id."""
+    User.objects.bulk_create(
+        [User(username=f"{prefix}_{i}") for i in range(count)],
+        batch_size=1000,
+    )
+    return list(User.objects.filter(username__startswith=f"{prefix}_").order_by("id"))
+
+
+def seed_auction(owner, items=1, start_price=Decimal("10.00"), min_increment=Decimal("1.00")):
+    """
+    Create a live auction with ``items`` active items and return the items.
+
+    The auction is inserted with ``bulk_create`` so post_save side effects
+    (such as the auction-created notification fan-out) don't run.
+    """
+    from main.models import Auction, Category, Item
+
+    now = timezone.now()
+    category, _ = Category.objects.get_or_create(name="Benchmark", defaults={"slug": "benchmark"})
+    auction, = Auction.objects.bulk_create([
+        Auction(
+            category=category,
+            title="Benchmark auction",
+            slug="benchmark-auction",
+            entry_fee=Decimal("0.00"),
+            start_date=now - timedelta(hours=1),
+            end_date=now + timedelta(days=1),
+            created_by=owner,
+        )
+    ])
+    return [
+        Item.objects.create(
+            auction=auction,
+            title=f"Benchmark item {i}",
+            category=category,
+            start_price=start_price,
+            min_increment=min_increment,
+            is_active=True,
+        )
+        for i in range(items)
+    ]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples`` (which need not be sorted)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Stopwatch:
+    """Tiny wall-clock timer used as ``with Stopwatch() as sw: ...``."""
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+        return False
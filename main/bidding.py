@@ -0,0 +1,198 @@
+"""
+Bid acceptance.
+
+Every new bid goes through ``accept_bid``: a single conditional UPDATE on
+``Item`` advances the denormalized ``current_price``/``current_winner``/
+``bid_count`` only if the bid still beats the current state (compare-and-swap
+in the database), then the ``Bid`` row is inserted in the same transaction.
+Two racing bids can therefore never both win against the same high bid.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Item, Bid
+
+CENT = Decimal("0.01")
+# Amounts carry two decimals; comparing with half a cent of slack keeps the
+# UPDATE exact on backends that store decimals as floats (SQLite).
+HALF_CENT = Decimal("0.005")
+
+# Sent with ``bids`` (a list of ``Bid``) once they are committed. Bids are
+# written with bulk_create, which sends no post_save.
+bids_stored = Signal()
+
+
+class BidRejected(Exception):
+    """Raised when a bid can't be accepted. ``code`` tells callers why."""
+
+    INVALID = "invalid"
+    NOT_FOUND = "not_found"
+    INACTIVE = "inactive"
+    ENDED = "ended"
+    TOO_LOW = "too_low"
+    UNAVAILABLE = "unavailable"
+
+    def __init__(self, message, code, min_acceptable_bid=None, current_price=None, bid_count=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.min_acceptable_bid = min_acceptable_bid
+        # The item state the bid lost against, so in-memory caches can resync
+        self.current_price = current_price
+        self.bid_count = bid_count
+
+
+def minimum_bid(item):
+    """
+    The lowest acceptable next bid for ``item`` (an ``Item`` or anything with the
+    same price attributes): the start price for the opening bid, the current
+    high bid plus the minimum increment afterwards.
+    """
+    if not item.bid_count:
+        return max(item.start_price, item.min_increment)
+    return item.current_price + item.min_increment
+
+
+def normalize_amount(amount):
+    """Coerce ``amount`` into a positive Decimal with at most two decimals."""
+    try:
+        amount = Decimal(str(amount))
+    except (InvalidOperation, TypeError, ValueError):
+        raise BidRejected("Invalid bid amount", BidRejected.INVALID)
+
+    if not amount.is_finite() or amount <= 0 or amount != amount.quantize(CENT):
+        raise BidRejected("Invalid bid amount", BidRejected.INVALID)
+
+    max_digits = Bid._meta.get_field("amount").max_digits
+    if len(amount.quantize(CENT).as_tuple().digits) > max_digits:
+        raise BidRejected("Invalid bid amount", BidRejected.INVALID)
+    return amount
+
+
+def check_bid(item, amount, now=None, closes_at=None):
+    """
+    Validate ``amount`` against ``item``'s last known state without touching
+    the database. Used as a cheap early check; ``accept_bid`` is authoritative.
+    """
+    now = now or timezone.now()
+    if not item.is_active or item.end_at is not None:
+        raise BidRejected("Item is inactive", BidRejected.INACTIVE)
+
+    if closes_at is not None and closes_at < now:
+        raise BidRejected(
+            "The auction has ended and no further bids are accepted.",
+            BidRejected.ENDED,
+        )
+
+    required = minimum_bid(item)
+    if amount < required:
+        raise BidRejected(
+            f"Bid must be at least {required:.2f}",
+            BidRejected.TOO_LOW,
+            min_acceptable_bid=required,
+            current_price=item.current_price,
+            bid_count=item.bid_count,
+        )
+
+
+def acceptable_bid_q(amount):
+    """SQL form of ``minimum_bid(item) <= amount``."""
+    # Wrapped in Value() so the half cent isn't rounded away by DecimalField's
+    # own two-decimal lookup adaptation.
+    limit = Value(amount + HALF_CENT)
+    opening = Q(bid_count=0, start_price__lte=limit, min_increment__lte=limit)
+    raising = Q(bid_count__gt=0, current_price__lte=limit - F("min_increment"))
+    return opening | raising
+
+
+def soft_close_q(now):
+    """Items a bid at ``now`` extends: inside their soft-close window, not yet extended past it."""
+    return Q(
+        closes_at__lte=Value(now) + F("soft_close_window"),
+        closes_at__lt=Value(now) + F("soft_close_extension"),
+    )
+
+
+def accept_bid(item_id, user, amount, bid=None, soft_close=True, read_deadline=False):
+    """
+    Atomically accept a bid of ``amount`` by ``user`` on item ``item_id``.
+
+    Costs one conditional UPDATE plus one INSERT when the bid wins; no rows
+    are read or locked beforehand. The same UPDATE applies the item's soft
+    close, unless the caller knows the bid can't extend it (``soft_close``
+    False: no soft close configured, or outside the window). Returns the
+    saved ``Bid`` (``bid`` if one was passed in) or raises ``BidRejected``.
+
+    With ``read_deadline`` the item's ``closes_at`` is read back in the same
+    transaction and set as ``bid.closes_at`` (otherwise None).
+    """
+    amount = normalize_amount(amount)
+    now = timezone.now()
+
+    changes = {
+        "current_price": amount,
+        "current_winner": user,
+        "bid_count": F("bid_count") + 1,
+    }
+    if soft_close:
+        changes["closes_at"] = Case(
+            When(soft_close_q(now), then=Value(now) + F("soft_close_extension")),
+            default=F("closes_at"),
+        )
+        changes["extensions"] = Case(
+            When(soft_close_q(now), then=F("extensions") + 1),
+            default=F("extensions"),
+            output_field=PositiveIntegerField(),
+        )
+
+    with transaction.atomic():
+        advanced = (
+            Item.objects.filter(
+                pk=item_id,
+                is_active=True,
+                end_at__isnull=True,
+                closes_at__gte=now,
+            )
+            .filter(acceptable_bid_q(amount))
+            .update(**changes)
+        )
+        if advanced:
+            if bid is None:
+                bid = Bid(item_id=item_id, created_by=user, amount=amount)
+            bid.amount = amount
+            # bulk_create skips Bid.save(), which would route back here
+            Bid.objects.bulk_create([bid])
+            transaction.on_commit(lambda: bids_stored.send(sender=Bid, bids=[bid]))
+            bid.closes_at = None
+            if read_deadline:
+                bid.closes_at = Item.objects.values_list("closes_at", flat=True).get(pk=item_id)
+            return bid
+
+    raise rejection_for(item_id, amount, now)
+
+
+def rejection_for(item_id, amount, now):
+    """Read the item once to explain why ``accept_bid`` didn't advance it."""
+    try:
+        item = Item.objects.get(pk=item_id)
+    except Item.DoesNotExist:
+        return BidRejected("Item not found", BidRejected.NOT_FOUND)
+
+    try:
+        check_bid(item, amount, now=now, closes_at=item.closes_at)
+    except BidRejected as e:
+        return e
+
+    # The state moved between the UPDATE and this read; report the latest.
+    required = minimum_bid(item)
+    return BidRejected(
+        f"Bid must be at least {required:.2f}",
+        BidRejected.TOO_LOW,
+        min_acceptable_bid=required,
+        current_price=item.current_price,
+        bid_count=item.bid_count,
+    )
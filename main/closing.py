@@ -0,0 +1,58 @@
+"""
+Closing items when their auction ends.
+
+``finalize_items`` is what the close scheduler (``main.scheduler``) runs for
+the items whose deadline (``Item.closes_at``) came up. Items are closed by a
+conditional UPDATE on ``end_at IS NULL`` and a passed deadline, so an item is
+finalized exactly once even when several schedulers (processes) race for it,
+and never before its deadline if that was extended meanwhile. The winner is the item's top bid,
+provided it meets the reserve price.
+"""
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .bidding import HALF_CENT
+from .models import AuctionResult, Bid, Item
+
+
+def open_items(item_ids=None):
+    """Deadlines (id -> ``closes_at``) of the items not finalized yet."""
+    items = Item.objects.filter(end_at__isnull=True, closes_at__isnull=False)
+    if item_ids is not None:
+        items = items.filter(pk__in=item_ids)
+    return dict(items.values_list("pk", "closes_at"))
+
+
+def reserve_met_q():
+    return Q(reserve_price__isnull=True) | Q(current_price__gt=F("reserve_price") - HALF_CENT)
+
+
+def finalize_items(item_ids, now=None):
+    """
+    Close the items of ``item_ids`` whose deadline has passed.
+
+    Returns ``{item_id: AuctionResult or None}`` for the items closed by this
+    call (None: no bid, or the reserve wasn't met); items closed elsewhere or
+    not due yet are left out. Creating the results fires the usual
+    ``AuctionResult`` post_save notifications.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Compare-and-swap on the whole batch; ``now`` then tells the rows
+        # this call closed. Should two callers ever share the same ``now``,
+        # the unique AuctionResult.item rolls the second one back.
+        Item.objects.filter(
+            pk__in=item_ids, end_at__isnull=True, closes_at__lte=now
+        ).update(is_active=False, end_at=now)
+        closed = dict.fromkeys(Item.objects.filter(pk__in=item_ids, end_at=now).values_list("pk", flat=True))
+        if not closed:
+            return closed
+
+        winning = Item.objects.filter(pk__in=closed, current_winner__isnull=False).filter(reserve_met_q())
+        top_bids = Bid.objects.filter(item__in=winning).top(1)
+        for bid in top_bids:
+            closed[bid.item_id] = AuctionResult.objects.create(
+                item_id=bid.item_id, winner=bid.created_by, winning_bid=bid
+            )
+    return closed
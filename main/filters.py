@@ -1,31 +1,35 @@
 from .models import Auction
-from django_filters import FilterSet , CharFilter , BaseInFilter
-from django.utils import timezone
-from django.db.models import Q
+from django_filters import FilterSet , CharFilter , BaseInFilter , OrderingFilter
 class AuctionFilter(FilterSet):
     status = CharFilter(method="filter_by_status",label="Status")
     category = BaseInFilter(field_name="category__slug", lookup_expr="in", label="Category")
+    # ?ordering=status,-end_date ; "status" sorts by the same SQL expression
+    ordering = OrderingFilter(
+        fields=(
+            ("auction_status", "status"),
+            ("start_date", "start_date"),
+            ("end_date", "end_date"),
+            ("created_at", "created_at"),
+            ("item_count", "item_count"),
+        ),
+    )
     class Meta:
         model = Auction
         fields = ['category']
-    def filter_by_status(self, queryset, name, value):
-        now = timezone.now()
-
-        # split the incoming value "live,upcoming"
-        statuses = [v.strip() for v in value.split(',') if v.strip()]
-
-        q = Q()
 
-        if 'ended' in statuses:
-            q |= Q(end_date__lt=now)
+    def filter_queryset(self, queryset):
+        # Filtering and ordering by status need the annotation
+        if "auction_status" not in queryset.query.annotations:
+            queryset = queryset.with_status()
+        if "item_count" not in queryset.query.annotations:
+            queryset = queryset.with_item_count()
+        return super().filter_queryset(queryset)
 
-        if 'upcoming' in statuses:
-            q |= Q(start_date__gt=now)
-
-        if 'live' in statuses:
-            q |= Q(start_date__lte=now, end_date__gt=now)
+    def filter_by_status(self, queryset, name, value):
+        # split the incoming value "live,upcoming"
+        statuses = [v.strip() for v in value.split(',') if v.strip() in ("ended", "upcoming", "live")]
 
-        if q:
-            return queryset.filter(q)
+        if statuses:
+            return queryset.filter(auction_status__in=statuses)
 
         return queryset
\ No newline at end of file
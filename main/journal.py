@@ -0,0 +1,253 @@
+"""
+Write-behind journal of accepted bids.
+
+With ``BID_JOURNAL`` set, the order books of the process accept bids in
+memory and append them to a local, append-only log file. A bid is
+acknowledged once the log is fsynced. Appends that arrive while an fsync is
+running wait for the next one, so a burst costs one fsync per group of bids
+rather than one database commit per bid (group commit). If an fsync fails,
+its records are cut from the file again and the appends raise.
+
+A flusher then writes the journaled bids to ``main_bid`` with
+``bulk_create``, every ``FLUSH_INTERVAL`` seconds, in batches of
+``BATCH_SIZE``. The same transaction advances each item's bidding state and
+the journal's ``BidJournalCheckpoint``. On start, the records past the
+checkpoint are replayed (exactly once) before the file is truncated; it is
+truncated again whenever it has grown past ``ROTATE_BYTES`` and everything
+in it is in the database. Records of items closed in the meantime (see
+``main.scheduler``) are not written: a closed item keeps its result.
+
+The in-memory books are authoritative in this mode, so each room must be
+served by a single process. Each record carries the time its book accepted
+the bid, which is stored as the bid's ``created_at``. Settings::
+
+    BID_JOURNAL = {"PATH": "/var/lib/auction/bids.journal", "FLUSH_INTERVAL": 0.05, "BATCH_SIZE": 1000}
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import Counter
+from decimal import Decimal
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .bidding import bids_stored
+from .models import Bid, BidJournalCheckpoint, Item
+
+DEFAULTS = {"FLUSH_INTERVAL": 0.05, "BATCH_SIZE": 1000, "ROTATE_BYTES": 64 * 1024 * 1024}
+
+
+def journal_option(name):
+    return (getattr(settings, "BID_JOURNAL", None) or {}).get(name, DEFAULTS.get(name))
+
+
+def read_records(path):
+    """The complete records of a journal file (a torn last line is skipped)."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            yield json.loads(line)
+
+
+class BidJournal:
+    def __init__(self, path, flush_interval=None, batch_size=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size or journal_option("BATCH_SIZE")
+        self.rotate_bytes = journal_option("ROTATE_BYTES")
+        self.seq = 0
+        self.file = None
+        # Synced, not yet in the database
+        self.unflushed = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.waiters = []
+        self.syncing = None
+        self.flushing = None
+        self.stats = Counter()
+
+    def open(self):
+        """Replay what the database is missing, then start a new file. Sync."""
+        checkpoint, _ = BidJournalCheckpoint.objects.get_or_create(name=self.path)
+        records = list(read_records(self.path))
+        missing = [record for record in records if record["seq"] > checkpoint.last_seq]
+        for start in range(0, len(missing), self.batch_size):
+            self.write(missing[start:start + self.batch_size])
+        self.stats["replayed"] = len(missing)
+        self.seq = max([checkpoint.last_seq] + [record["seq"] for record in records])
+        # Everything is in the database now
+        self.file = open(self.path, "wb")
+        os.fsync(self.file.fileno())
+        return self
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    async def append(self, record):
+        """
+        Journal ``record`` (a dict) and return once it is on disk. Raises the
+        ``OSError`` of a failed sync; the record is then not journaled.
+        """
+        self.seq += 1
+        record["seq"] = self.seq
+        offset = self.file.tell()
+        self.file.write(json.dumps(record).encode() + b"\n")
+        self.stats["appends"] += 1
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append((waiter, record, offset))
+        if self.syncing is None:
+            self.syncing = asyncio.ensure_future(self._sync())
+        await waiter
+
+    async def _sync(self):
+        loop = asyncio.get_running_loop()
+        waiters = []
+        try:
+            while self.waiters:
+                waiters, self.waiters = self.waiters, []
+                self.file.flush()
+                # Appends made meanwhile wait for the next fsync, together
+                await loop.run_in_executor(None, os.fsync, self.file.fileno())
+                self.stats["fsyncs"] += 1
+                # Only what is on disk may reach the database
+                with self.lock:
+                    self.unflushed.extend(record for _, record, _ in waiters)
+                for waiter, _, _ in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+                if self.flushing is None and self.flush_interval:
+                    self.flushing = asyncio.ensure_future(self._flush_later())
+        except Exception as e:
+            failed, self.waiters = waiters + self.waiters, []
+            self.stats["failed"] += len(failed)
+            self.discard(failed[0][2])
+            for waiter, _, _ in failed:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        finally:
+            self.syncing = None
+
+    def discard(self, offset):
+        """Cut the records from ``offset`` on, so a restart doesn't replay them."""
+        try:
+            self.file.seek(offset)
+            self.file.truncate()
+        except OSError as e:
+            print(f"Bid journal could not discard unsynced records: {e}")
+
+    async def _flush_later(self):
+        try:
+            while self.unflushed:
+                await asyncio.sleep(self.flush_interval)
+                await database_sync_to_async(self.flush, thread_sensitive=False)()
+                if not self.unflushed and self.syncing is None and self.file.tell() >= self.rotate_bytes:
+                    # Every record so far is in the database
+                    self.file.seek(0)
+                    self.file.truncate()
+                    self.stats["rotations"] += 1
+        except Exception as e:
+            print(f"Bid journal flush failed: {e}")
+        finally:
+            self.flushing = None
+
+    def flush(self):
+        """Write the journaled bids to the database. Sync, thread-safe; returns how many."""
+        # One flush at a time, so the checkpoint only ever moves forward
+        with self.flush_lock:
+            with self.lock:
+                records, self.unflushed = self.unflushed, []
+            written = 0
+            try:
+                while written < len(records):
+                    batch = records[written:written + self.batch_size]
+                    self.write(batch)
+                    written += len(batch)
+            except Exception:
+                # Kept for the next flush; the checkpoint tells what made it
+                with self.lock:
+                    self.unflushed[:0] = records[written:]
+                raise
+        return written
+
+    def write(self, records):
+        latest = {}
+        counts = Counter()
+        for record in records:
+            latest[record["item"]] = record
+            counts[record["item"]] += 1
+
+        with transaction.atomic():
+            # Updated first: an item closed by now (end_at set) is skipped,
+            # and one still open can't be closed before this commits
+            open_items = {
+                item_id for item_id, record in latest.items()
+                if Item.objects.filter(pk=item_id, end_at__isnull=True).update(
+                    current_price=Decimal(record["amount"]),
+                    current_winner_id=record["user"],
+                    bid_count=F("bid_count") + counts[item_id],
+                    closes_at=parse_datetime(record["closes_at"]) if record["closes_at"] else F("closes_at"),
+                    extensions=record["extensions"],
+                )
+            }
+            bids = Bid.objects.bulk_create([
+                Bid(
+                    item_id=record["item"],
+                    created_by_id=record["user"],
+                    amount=Decimal(record["amount"]),
+                    # Journals written before records had it: the flush time
+                    created_at=parse_datetime(record["created_at"]) if "created_at" in record else timezone.now(),
+                )
+                for record in records
+                if record["item"] in open_items
+            ])
+            BidJournalCheckpoint.objects.filter(name=self.path).update(last_seq=records[-1]["seq"])
+            transaction.on_commit(lambda: bids_stored.send(sender=Bid, bids=bids))
+        late = len(records) - len(bids)
+        if late:
+            print(f"Bid journal: {late} bid(s) on closed items not written")
+        self.stats["db_batches"] += 1
+        self.stats["flushed"] += len(bids)
+        self.stats["late"] += late
+
+
+_journal = None
+
+
+def get_journal():
+    """The journal of this process, or None when bids go straight to the database."""
+    return _journal
+
+
+def start_journal(path=None):
+    """Replay and open the journal (sync, at startup)."""
+    global _journal
+    if _journal is None:
+        _journal = BidJournal(
+            path or journal_option("PATH"), flush_interval=journal_option("FLUSH_INTERVAL")
+        ).open()
+    return _journal
+
+
+def stop_journal(flush=True):
+    """Flush the journal to the database (unless ``flush`` is False) and close it."""
+    global _journal
+    journal, _journal = _journal, None
+    if journal is not None:
+        if flush:
+            journal.flush()
+        journal.close()
+    return journal
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from AuctionProject import broker
+from AuctionProject.channel_layers import BrokerChannelLayer
+from main.benchmarking import Stopwatch, percentile
+
+GROUP = "auction_item_1"
+
+
+def _wait_for_socket(path, timeout=5):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() > deadline:
+            raise RuntimeError(f"Broker didn't create {path}")
+        time.sleep(0.01)
+
+
+def _worker(path, watchers, messages, ready, results):
+    """One Daphne-like process holding ``watchers`` sockets in the bid room."""
+
+    async def watch(layer, channel, latencies):
+        for _ in range(messages):
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message["sent_at"])
+
+    async def run():
+        layer = BrokerChannelLayer(path, capacity=messages + 1)
+        channels = [await layer.new_channel() for _ in range(watchers)]
+        await asyncio.gather(*(layer.group_add(GROUP, channel) for channel in channels))
+        await layer.stats()  # round trip: every group_add has reached the broker
+        ready.release()
+        latencies = []
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(watch(layer, channel, latencies) for channel in channels)),
+                timeout=60,
+            )
+        except asyncio.TimeoutError:
+            pass
+        results.put((latencies, layer.dropped))
+        await layer.close()
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = (
+        "Broadcast bids to one room whose sockets are spread over several worker "
+        "processes, through the channel-layer broker, and report delivery latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--watchers", type=int, default=250, help="Sockets per worker")
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--rate", type=float, default=100, help="Bids per second sent to the room")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        workers, watchers, messages = options["workers"], options["watchers"], options["messages"]
+        path = os.path.join(tempfile.mkdtemp(prefix="auction-broker-"), "broker.sock")
+
+        context = multiprocessing.get_context("fork")
+        broker_process = context.Process(target=broker.run, args=(path,), daemon=True)
+        broker_process.start()
+        ready, results = context.Semaphore(0), context.Queue()
+        processes = []
+        try:
+            _wait_for_socket(path)
+            processes = [
+                context.Process(target=_worker, args=(path, watchers, messages, ready, results), daemon=True)
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            for _ in processes:
+                ready.acquire()
+
+            with Stopwatch() as sw:
+                stats = asyncio.run(self.publish(path, messages, options["rate"]))
+            collected = [results.get(timeout=90) for _ in processes]
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+            broker_process.terminate()
+            broker_process.join()
+
+        latencies = [sample * 1000 for samples, _ in collected for sample in samples]
+        expected = workers * watchers * messages
+        report = {
+            "workers": workers,
+            "sockets": workers * watchers,
+            "messages": messages,
+            "expected_deliveries": expected,
+            "delivered": len(latencies),
+            "dropped": expected - len(latencies),
+            "deliveries_per_sec": round(len(latencies) / sw.elapsed, 1) if sw.elapsed else 0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+            },
+            "broker": stats,
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['sockets']} sockets over {workers} processes, {messages} bids: "
+            f"{report['delivered']}/{expected} delivered, {report['deliveries_per_sec']} deliveries/sec"
+        )
+        self.stdout.write(
+            "latency p50 {p50} ms, p95 {p95} ms, p99 {p99} ms".format(**report["latency_ms"])
+        )
+        self.stdout.write(
+            f"broker frames out: {stats['frames_out']} "
+            f"({stats['frames_out'] / max(messages, 1):.1f} per bid)"
+        )
+
+    async def publish(self, path, messages, rate):
+        layer = BrokerChannelLayer(path)
+        interval = 1 / rate if rate > 0 else 0
+        for i in range(messages):
+            await layer.group_send(GROUP, {
+                "type": "broadcast_bid",
+                "bid": {"amount": str(10 + i), "sequence": i},
+                "sent_at": time.time(),
+            })
+            if interval:
+                await asyncio.sleep(interval)
+        # Give the workers a moment to drain before reading the counters
+        await asyncio.sleep(0.5)
+        stats = await layer.stats()
+        await layer.close()
+        return stats
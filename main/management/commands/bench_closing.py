@@ -0,0 +1,58 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.benchmarking import Stopwatch, scratch_database, seed_auction, seed_users
+from main.models import AuctionResult, Bid, Item
+from main.scheduler import CloseScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed N items whose auction just ended, each with a few bids, and report "
+        "how many closings per second the close scheduler finalizes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=2000)
+        parser.add_argument("--bidders", type=int, default=3, help="Bids (and bidders) per item")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            users = seed_users(options["bidders"] + 1, prefix="bench_closer")
+            owner, bidders = users[0], users[1:]
+            items = seed_auction(owner, items=options["items"])
+            self.seed_bids(items, bidders)
+            # Every item has a reserve; every other one is out of reach
+            Item.objects.update(reserve_price=Decimal("10.00"))
+            Item.objects.filter(pk__in=[item.id for item in items[::2]]).update(reserve_price=Decimal("1000.00"))
+            Item.objects.update(closes_at=timezone.now() - timedelta(seconds=1))
+
+            scheduler = CloseScheduler(batch_size=options["batch_size"])
+            with Stopwatch() as load:
+                scheduled = scheduler.load()
+            with Stopwatch() as sw:
+                while scheduler.run_pending():
+                    pass
+
+            results = AuctionResult.objects.count()
+            self.stdout.write(
+                f"{scheduled} items loaded in {load.elapsed * 1000:.0f} ms; "
+                f"closed {scheduler.closed} ({results} with a winner) in {sw.elapsed:.2f}s: "
+                f"{scheduler.closed / sw.elapsed:.0f} closings/sec"
+            )
+
+    def seed_bids(self, items, bidders):
+        bids = []
+        for item in items:
+            for i, user in enumerate(bidders):
+                bids.append(Bid(item=item, created_by=user, amount=item.start_price + i))
+        Bid.objects.bulk_create(bids, batch_size=1000)
+        Item.objects.update(
+            current_price=items[0].start_price + len(bidders) - 1,
+            current_winner=bidders[-1],
+            bid_count=len(bidders),
+        )
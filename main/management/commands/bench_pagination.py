@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from main.benchmarking import Stopwatch, percentile, scratch_database, seed_auction, seed_users
+from main.models import Bid
+from main.pagination import AmountPagination, CreatedAtPagination
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed one item with N bids and compare the latency of a bid-history page "
+        "at increasing depths: keyset pagination (main.pagination) vs OFFSET."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bids", type=int, default=1_000_000)
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        total, page_size = options["bids"], options["page_size"]
+        self.cursors = {}
+        with scratch_database():
+            bidder, = seed_users(1, prefix="bench_pager")
+            item, = seed_auction(bidder)
+            self.seed_bids(item, bidder, total)
+            bids = Bid.objects.filter(item=item)
+
+            for paginator_class in (CreatedAtPagination, AmountPagination):
+                ordering = paginator_class.ordering
+                self.stdout.write(f"order by {', '.join(ordering)} ({total} bids, {page_size} per page):")
+                for depth in (0, total // 100, total // 10, total // 2, total - page_size):
+                    if depth:
+                        # The cursor a client holds after reading ``depth`` rows (not timed)
+                        last = bids.order_by(*ordering)[depth - 1]
+                        self.cursors[(paginator_class, depth)] = paginator_class().encode_cursor(
+                            paginator_class().position(last)
+                        )
+                    keyset = self.time(lambda: self.keyset_page(paginator_class, bids, depth, page_size), options)
+                    offset = self.time(lambda: list(bids.order_by(*ordering)[depth:depth + page_size]), options)
+                    self.stdout.write(
+                        f"  row {depth:>9}: keyset p50 {keyset:.2f} ms, OFFSET p50 {offset:.2f} ms"
+                    )
+
+    def keyset_page(self, paginator_class, bids, depth, page_size):
+        paginator = paginator_class()
+        query = {"page_size": page_size}
+        if depth:
+            query["cursor"] = self.cursors[(paginator_class, depth)]
+        request = Request(RequestFactory().get("/", query))
+        return paginator.paginate_queryset(bids, request)
+
+    def time(self, run, options):
+        samples = []
+        for _ in range(options["repeat"]):
+            with Stopwatch() as sw:
+                run()
+            samples.append(sw.elapsed * 1000)
+        return percentile(samples, 50)
+
+    def seed_bids(self, item, bidder, total):
+        # created_at is the insert time: thousands of ties per timestamp
+        batch = []
+        for i in range(total):
+            batch.append(Bid(item=item, created_by=bidder, amount=10 + i % 5000))
+            if len(batch) == 10000:
+                Bid.objects.bulk_create(batch)
+                batch = []
+        Bid.objects.bulk_create(batch)
+        self.stdout.write(f"Seeded {total} bids")
@@ -0,0 +1,133 @@
+import random
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from main.benchmarking import scratch_database, seed_auction, seed_users
+from main.models import Auction, Bid
+from notificationapp.models import Notification, NotificationCategories
+
+# "SCAN main_bid" (SQLite, no index) / "Seq Scan on main_bid" (PostgreSQL)
+SEQUENTIAL_SCAN = re.compile(r"(\bSCAN (?!.*\bUSING\b)\S+|Seq Scan on \S+)")
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch database, run EXPLAIN on the hot bid/notification/auction "
+        "queries and fail if any of them reads its table sequentially."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--items", type=int, default=50)
+        parser.add_argument("--bids", type=int, default=20000)
+        parser.add_argument("--notifications", type=int, default=20000)
+        parser.add_argument("--auctions", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.seed(options)
+            failures = []
+            for name, queryset in self.hot_queries():
+                plan = queryset.explain()
+                scans = SEQUENTIAL_SCAN.findall(plan)
+                self.stdout.write(f"{'SEQ SCAN' if scans else 'ok':8} {name}")
+                for line in plan.splitlines():
+                    self.stdout.write(f"         {line}")
+                if scans:
+                    failures.append(name)
+
+        if failures:
+            raise CommandError(f"Sequential scan in: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("Every hot query uses an index."))
+
+    def seed(self, options):
+        rng = random.Random(0)
+        users = seed_users(options["users"])
+        items = seed_auction(users[0], items=options["items"])
+        now = timezone.now()
+
+        Bid.objects.bulk_create(
+            [
+                Bid(
+                    item=rng.choice(items),
+                    created_by=rng.choice(users),
+                    amount=Decimal(rng.randrange(1000, 100000)) / 100,
+                )
+                for _ in range(options["bids"])
+            ],
+            batch_size=1000,
+        )
+        # Spread the bids over the last month (one hour per slice), as on a real dashboard
+        bid_ids = list(Bid.objects.order_by("pk").values_list("pk", flat=True))
+        hours = 24 * 30
+        per_hour = max(1, len(bid_ids) // hours)
+        for hour, start in enumerate(range(0, len(bid_ids), per_hour)):
+            Bid.objects.filter(pk__in=bid_ids[start:start + per_hour]).update(
+                created_at=now - timedelta(hours=hours - hour)
+            )
+
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    user=rng.choice(users) if i % 20 else None,
+                    category=NotificationCategories.SYSTEM_UPDATE,
+                    content="Benchmark notification",
+                    is_read=rng.random() < 0.9,
+                )
+                for i in range(options["notifications"])
+            ],
+            batch_size=1000,
+        )
+
+        auction = Auction.objects.get()
+        Auction.objects.bulk_create(
+            [
+                Auction(
+                    title=f"Auction {i}",
+                    slug=f"auction-{i}",
+                    entry_fee=Decimal("0.00"),
+                    start_date=now + timedelta(days=rng.randrange(-400, 30)),
+                    end_date=now + timedelta(days=rng.randrange(-400, 30) + 400),
+                    created_by=auction.created_by,
+                    category=auction.category,
+                )
+                for i in range(options["auctions"])
+            ],
+            batch_size=1000,
+        )
+        # Let the planner see real statistics
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def hot_queries(self):
+        now = timezone.now()
+        item_id = Bid.objects.values_list("item_id", flat=True).first()
+        user_id = Notification.objects.exclude(user=None).values_list("user_id", flat=True).first()
+        today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        return [
+            ("bid history of an item",
+             Bid.objects.filter(item_id=item_id).order_by("-created_at")[:20]),
+            ("highest bid of an item",
+             Bid.objects.filter(item_id=item_id).order_by().values("item_id").annotate(top=Max("amount"))),
+            ("unread notifications of a user",
+             Notification.objects.filter(user_id=user_id, is_read=False).order_by("-created_at")[:20]),
+            ("notification inbox of a user",
+             Notification.objects.filter(user_id=user_id).order_by("-created_at")[:20]),
+            ("broadcast notifications",
+             Notification.objects.filter(user__isnull=True, created_at__gt=now - timedelta(days=7))),
+            ("live auctions",
+             Auction.objects.filter(start_date__lte=now, end_date__gt=now)),
+            ("upcoming auctions",
+             Auction.objects.filter(start_date__gt=now)),
+            ("ended auctions",
+             Auction.objects.filter(end_date__lte=now)),
+            ("bids today (dashboard)",
+             Bid.objects.filter(created_at__gte=today, created_at__lt=today + timedelta(days=1))),
+        ]
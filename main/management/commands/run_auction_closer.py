@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from main.scheduler import CloseScheduler, publish_closed
+
+
+class Command(BaseCommand):
+    help = (
+        "Close items at their auction's deadline in this process (for deployments "
+        "where the ASGI workers don't run the scheduler, see AUCTION_CLOSER). "
+        "With --once, only close what is overdue now and exit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true")
+
+    def handle(self, *args, **options):
+        scheduler = CloseScheduler(on_closed=publish_closed)
+        if options["once"]:
+            scheduler.load()
+            while scheduler.run_pending():
+                pass
+            self.stdout.write(f"Closed {scheduler.closed} overdue items")
+            return
+
+        scheduler.start()
+        self.stdout.write(f"Scheduled {len(scheduler)} items; closing them at their deadline")
+        try:
+            scheduler.thread.join()
+        except KeyboardInterrupt:
+            scheduler.stop()
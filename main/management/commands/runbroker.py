@@ -0,0 +1,22 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from AuctionProject import broker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the Unix-socket channel-layer broker shared by all Daphne workers "
+        "of this host (see CHANNEL_BROKER_SOCKET)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            default=os.environ.get("CHANNEL_BROKER_SOCKET", broker.DEFAULT_SOCKET_PATH),
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Channel broker listening on {options['path']}")
+        broker.run(options["path"])
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.25 on 2026-10-18 02:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_bidding_state(apps, schema_editor):
+    Item = apps.get_model("main", "Item")
+    Bid = apps.get_model("main", "Bid")
+    for item in Item.objects.filter(bids__isnull=False).distinct().iterator():
+        bids = Bid.objects.filter(item_id=item.pk)
+        top_bid = bids.order_by("-amount", "created_at").first()
+        item.current_price = top_bid.amount
+        item.current_winner_id = top_bid.created_by_id
+        item.bid_count = bids.count()
+        item.save(update_fields=["current_price", "current_winner", "bid_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='bid_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='current_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, help_text='The highest accepted bid (empty until the first bid).', max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='current_winner',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leading_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_bidding_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.25 on 2026-10-18 04:00
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_closes_at(apps, schema_editor):
+    Auction = apps.get_model("main", "Auction")
+    Item = apps.get_model("main", "Item")
+    end_date = Auction.objects.filter(pk=OuterRef("auction_id")).values("end_date")
+    Item.objects.update(closes_at=Subquery(end_date))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='closes_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='extensions',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='soft_close_extension',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='soft_close_window',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_closes_at, migrations.RunPython.noop),
+    ]
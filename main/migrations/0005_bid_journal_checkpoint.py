@@ -0,0 +1,21 @@
+# Generated by Django 4.2.25 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_item_soft_close'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BidJournalCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('last_seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.25 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_bid_journal_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['is_active', '-created_at', '-id'], name='item_active_created_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.25 on 2026-10-18 06:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bid',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -3,7 +3,8 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db.models import Max
+from django.db.models import Case, CharField, Count, F, Prefetch, Value, When, Window
+from django.db.models.functions import RowNumber
 from django.utils.text import slugify
 from .custom_fields import LocationField
 
@@ -11,6 +12,65 @@ from .custom_fields import LocationField
 
 User = get_user_model()
 
+# How many bids the nested item serializers show per item
+TOP_BIDS = 10
+
+
+def auction_status(now=None):
+    """
+    ``Auction.status`` as a SQL expression ("ended", "upcoming" or "live"),
+    shared by the list annotation, the status filter and ordering.
+    """
+    now = now or timezone.now()
+    return Case(
+        When(end_date__lte=now, then=Value("ended")),
+        When(start_date__gt=now, then=Value("upcoming")),
+        default=Value("live"),
+        output_field=CharField(),
+    )
+
+
+class AuctionQuerySet(models.QuerySet):
+    def with_status(self, now=None):
+        """Annotate ``auction_status`` (``Auction.status`` reads it when present)."""
+        return self.annotate(auction_status=auction_status(now))
+
+    def with_item_count(self):
+        return self.annotate(item_count=Count("items"))
+
+    def with_details(self, top_bids=TOP_BIDS):
+        """
+        Everything AuctionSerializer renders in a fixed number of queries:
+        auctions + category, items + category, and the ``top_bids`` highest
+        bids of each item with their bidders.
+        """
+        return self.select_related("category").prefetch_related(
+            Prefetch("items", queryset=Item.objects.with_bids(top_bids))
+        )
+
+
+class ItemQuerySet(models.QuerySet):
+    def with_bids(self, top_bids=TOP_BIDS):
+        """Items with their category and only their ``top_bids`` highest bids prefetched."""
+        return self.select_related("category").prefetch_related(
+            Prefetch("bids", queryset=Bid.objects.top(top_bids))
+        )
+
+
+class BidQuerySet(models.QuerySet):
+    def top(self, n=TOP_BIDS):
+        """The ``n`` highest bids of every item, highest first (one query)."""
+        return (
+            self.select_related("created_by")
+            .annotate(item_rank=Window(
+                RowNumber(),
+                partition_by=F("item_id"),
+                order_by=(F("amount").desc(), F("id").desc()),
+            ))
+            .filter(item_rank__lte=n)
+            .order_by("-amount", "-id")
+        )
+
 class Category(models.Model):
     name = models.CharField(max_length=255, unique=True)
     icon = models.FileField(upload_to="category", blank=True, null=True)
@@ -43,6 +103,15 @@ class Auction(models.Model):
     slug = models.SlugField(max_length=255, null=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
 
+    objects = AuctionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Status filters: live/upcoming range on start_date, ended on end_date
+            models.Index(fields=["start_date", "end_date"], name="auction_dates_idx"),
+            models.Index(fields=["end_date"], name="auction_end_date_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -63,6 +132,9 @@ class Auction(models.Model):
 
     @property
     def status(self):
+        if hasattr(self, "auction_status"):
+            # Computed by the database (AuctionQuerySet.with_status)
+            return self.auction_status
         now = timezone.now()
         if self.end_date <= now:
             return "ended"
@@ -98,10 +170,35 @@ class Item(models.Model):
     is_active = models.BooleanField(default=False)
     end_at = models.DateTimeField(auto_now_add=False , blank=True , null=True)
     slug = models.SlugField(max_length=255, null=True, blank=True)
-    
+
+    # Denormalized bidding state, only ever advanced by main.bidding.accept_bid
+    current_price = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True, editable=False,
+        help_text="The highest accepted bid (empty until the first bid).",
+    )
+    current_winner = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True, editable=False,
+        related_name="leading_items",
+    )
+    bid_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Soft close: a bid placed less than ``soft_close_window`` before the
+    # deadline moves it to the bid's time plus ``soft_close_extension``.
+    soft_close_window = models.DurationField(blank=True, null=True)
+    soft_close_extension = models.DurationField(blank=True, null=True)
+    # Effective deadline: the auction's end date until a soft-close extension
+    # moves it. Only ever moved by accept_bid's UPDATE and main.signals.
+    closes_at = models.DateTimeField(blank=True, null=True, editable=False)
+    extensions = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ItemQuerySet.as_manager()
 
     class Meta:
         db_table_comment = "Auction Items"
+        indexes = [
+            # The item list: active items, newest first (keyset pagination)
+            models.Index(fields=["is_active", "-created_at", "-id"], name="item_active_created_idx"),
+        ]
 
     def __str__(self):
         return self.title
@@ -109,6 +206,8 @@ class Item(models.Model):
     def clean(self):
         if self.reserve_price is not None and self.start_price > self.reserve_price:
             raise ValidationError("The start price must be less than reserve price.")
+        if (self.soft_close_window is None) != (self.soft_close_extension is None):
+            raise ValidationError("Soft close needs both a window and an extension.")
         super().clean()
     
     # To ensure validation runs before every save, you must call clean()
@@ -117,6 +216,8 @@ class Item(models.Model):
         if not self.slug:
             # Generate slug from the title
             self.slug = slugify(self.title)
+        if self.closes_at is None and self.auction_id:
+            self.closes_at = self.auction.end_date
         self.full_clean()  # Calls clean_fields(), clean(), and validate_unique()
         super().save(*args, **kwargs)
 
@@ -125,46 +226,38 @@ class Bid(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name="bids")
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: journaled bids are stored with the time they were
+    # accepted, not the time they reach the table (main.journal)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = BidQuerySet.as_manager()
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # An item's bid history, newest first
+            models.Index(fields=["item", "-created_at"], name="bid_item_created_idx"),
+            # An item's highest bid (MAX(amount)) and top-N bids
+            models.Index(fields=["item", "-amount"], name="bid_item_amount_idx"),
+            # Bids per day on the dashboard
+            models.Index(fields=["created_at"], name="bid_created_idx"),
+        ]
 
     def __str__(self):
         return f"{self.created_by} bid {self.amount} on {self.item}"
 
     # Overriding the clean() method for model-wide validation
     def clean(self):
+        # Early, read-only check of a new bid against the item's denormalized
+        # state (no aggregate over other bids). The authoritative, race-free
+        # check happens in main.bidding.accept_bid when the bid is saved.
+        if self._state.adding and self.item_id and self.amount is not None:
+            from .bidding import BidRejected, check_bid
 
-        # 1. Check if the auction is still active
-        if self.item.auction.end_date < timezone.now():
-            raise ValidationError(
-                "The auction has ended and no further bids are accepted."
-            )
-
-        # 2. Check the amount against the current highest bid + min_increment
-
-        # Find the highest existing bid amount for this item
-        highest_bid_amount = Bid.objects.filter(item=self.item).aggregate(
-            Max("amount")
-        )["amount__max"]
-
-        # Determine the required minimum bid: start_price if no bids, otherwise highest_bid
-        required_minimum_bid = self.item.start_price
-        if highest_bid_amount:
-            # If highest_bid_amount exists, the next bid must be higher than it + min_increment
-            required_minimum_bid = highest_bid_amount + self.item.min_increment
-        else:
-            # If no bids exist, the first bid must be >= start_price
-            # If the start_price is also less than the min_increment, a sensible rule is:
-            required_minimum_bid = max(self.item.start_price, self.item.min_increment)
-
-        # Check if the proposed bid amount meets the required minimum
-        if self.amount < required_minimum_bid:
-            raise ValidationError(
-                f"Bid amount must be at least ${required_minimum_bid:.2f} "
-                f"(current high bid is ${highest_bid_amount or self.item.start_price:.2f} + min increment of ${self.item.min_increment:.2f})"
-            )
+            try:
+                check_bid(self.item, self.amount, closes_at=self.item.closes_at)
+            except BidRejected as e:
+                raise ValidationError(e.message)
 
         super().clean()
 
@@ -172,6 +265,18 @@ class Bid(models.Model):
     # and handle the ValidationError before calling save().
     def save(self, *args, **kwargs):
         self.full_clean()  # Calls clean_fields(), clean(), and validate_unique()
+        if self._state.adding:
+            # New bids must advance the item atomically with the insert
+            from .bidding import BidRejected, accept_bid
+
+            try:
+                accept_bid(
+                    self.item_id, self.created_by, self.amount, bid=self,
+                    soft_close=self.item.soft_close_window is not None,
+                )
+            except BidRejected as e:
+                raise ValidationError(e.message)
+            return
         super().save(*args, **kwargs)
 
 
@@ -183,3 +288,41 @@ class AuctionResult(models.Model):
 
     def __str__(self):
         return f"{self.winner} won {self.item.title} with {self.winning_bid.amount}"
+
+
+class BidJournalCheckpoint(models.Model):
+    """The last journal record (``main.journal``) written to the database, per journal file."""
+
+    name = models.CharField(max_length=255, unique=True)
+    last_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_seq}"
+
+
+class OutboxMessage(models.Model):
+    """A channel-layer message written with the transaction that caused it (``main.outbox``)."""
+
+    group = models.CharField(max_length=255)
+    message = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Not sent before then: the backoff of a failed send
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # The dispatcher sending it, until its lease runs out
+    claimed_by = models.CharField(max_length=255, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    # Given up on after MAX_ATTEMPTS sends
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The queue, in order
+            models.Index(fields=["id"], name="outbox_pending_idx", condition=models.Q(failed_at__isnull=True)),
+            # Groups waiting on a retry or held by a dispatcher
+            models.Index(fields=["group", "available_at"], name="outbox_group_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.group} #{self.pk}"
@@ -0,0 +1,240 @@
+"""
+Transactional outbox for channel-layer messages.
+
+Signal receivers don't ``group_send`` from the saving request's thread:
+``enqueue`` adds an ``OutboxMessage`` row to the current transaction, so a
+save that rolls back sends nothing and the request never waits on the
+channel layer. Once the transaction commits, the process's dispatcher thread
+(started with the ASGI app) is woken; it also polls every ``POLL_INTERVAL``
+seconds for the rows of other processes (management commands, WSGI workers).
+The sends themselves run on the server's event loop, which the consumers
+attach on connect (``attach_loop``): the in-memory layer only wakes the
+sockets waiting on the loop it is called from.
+
+The dispatcher leases a batch of due rows with one UPDATE, sends the
+messages of each group in order (the groups concurrently) and deletes those
+sent. A failed send is retried with exponential backoff, and until then the
+rest of its group waits: a group's messages are delivered in the order they
+were written. Groups leased by another dispatcher are skipped. After
+``MAX_ATTEMPTS`` a message is kept with ``failed_at`` set and its group moves
+on. ``backlog()`` describes the queue. Settings::
+
+    OUTBOX = {"AUTOSTART": True, "POLL_INTERVAL": 1, "BATCH_SIZE": 500, "MAX_ATTEMPTS": 8}
+"""
+import asyncio
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+DEFAULTS = {
+    "AUTOSTART": True,
+    "POLL_INTERVAL": 1,
+    "BATCH_SIZE": 500,
+    "MAX_ATTEMPTS": 8,
+    # Seconds: first retry delay (doubled on each attempt) and its cap
+    "RETRY_DELAY": 1,
+    "MAX_RETRY_DELAY": 300,
+    # Seconds a dispatcher holds the batch it claimed
+    "LEASE": 30,
+}
+
+# Names this process's dispatcher in ``OutboxMessage.claimed_by``
+WORKER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def outbox_option(name):
+    return getattr(settings, "OUTBOX", {}).get(name, DEFAULTS[name])
+
+
+def enqueue(group, message):
+    """``group_send(group, message)`` once the current transaction commits."""
+    enqueue_many([(group, message)])
+
+
+def enqueue_many(messages):
+    """``enqueue`` each ``(group, message)`` of ``messages``, in one INSERT."""
+    if not messages:
+        return
+    OutboxMessage.objects.bulk_create([OutboxMessage(group=group, message=message) for group, message in messages])
+    transaction.on_commit(wake)
+
+
+def wake():
+    if _dispatcher is not None:
+        _dispatcher.wake()
+
+
+def backlog(now=None):
+    """The queue: pending, retrying and failed messages, groups, age of the oldest pending one (seconds)."""
+    now = now or timezone.now()
+    pending = Q(failed_at__isnull=True)
+    stats = OutboxMessage.objects.aggregate(
+        pending=Count("pk", filter=pending),
+        retrying=Count("pk", filter=pending & Q(attempts__gt=0)),
+        failed=Count("pk", filter=Q(failed_at__isnull=False)),
+        groups=Count("group", filter=pending, distinct=True),
+        oldest=Min("created_at", filter=pending),
+    )
+    oldest = stats.pop("oldest")
+    stats["oldest_age"] = (now - oldest).total_seconds() if oldest else 0
+    if _dispatcher is not None:
+        stats["dispatcher"] = {"sent": _dispatcher.sent, "retried": _dispatcher.retried, "failed": _dispatcher.failed}
+    return stats
+
+
+class OutboxDispatcher:
+    def __init__(self, channel_layer=None, clock=timezone.now, worker=WORKER):
+        self.channel_layer = channel_layer
+        self.clock = clock
+        self.worker = worker
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+        # The server's loop, once a consumer attached it
+        self.loop = None
+        self.sent = self.retried = self.failed = 0
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self):
+        poll_interval = outbox_option("POLL_INTERVAL")
+        try:
+            while not self.stopping:
+                self.wakeup.wait(poll_interval)
+                self.wakeup.clear()
+                try:
+                    # Until the queue is drained
+                    while self.dispatch() and not self.stopping:
+                        pass
+                except Exception as e:
+                    print(f"Outbox dispatch error: {e}")
+                    connection.close()
+        finally:
+            connection.close()
+
+    def claim(self, now):
+        """Lease a batch of due messages; returns them in order."""
+        lease_until = now + timedelta(seconds=outbox_option("LEASE"))
+        # A group waiting on a retry, or being sent by a dispatcher, is held whole
+        held = OutboxMessage.objects.filter(failed_at__isnull=True).filter(
+            Q(available_at__gt=now) | Q(claimed_until__gt=now)
+        )
+        due = (
+            OutboxMessage.objects.filter(failed_at__isnull=True, available_at__lte=now)
+            .exclude(group__in=held.values("group"))
+            .order_by("pk")
+            .values("pk")[:outbox_option("BATCH_SIZE")]
+        )
+        # One statement, so two dispatchers can't both claim a group
+        if not OutboxMessage.objects.filter(pk__in=due).update(claimed_by=self.worker, claimed_until=lease_until):
+            return []
+        return list(OutboxMessage.objects.filter(claimed_by=self.worker, claimed_until=lease_until).order_by("pk"))
+
+    def dispatch(self):
+        """Send one batch; returns how many messages it had."""
+        now = self.clock()
+        messages = self.claim(now)
+        if not messages:
+            return 0
+        groups = {}
+        for message in messages:
+            groups.setdefault(message.group, []).append(message)
+        results = self.send(groups)
+
+        sent, unsent = [], []
+        with transaction.atomic():
+            for delivered, failure, rest in results:
+                sent += delivered
+                if failure is not None:
+                    self.retry(*failure, now)
+                    unsent += [message.pk for message in rest]
+            OutboxMessage.objects.filter(pk__in=sent).delete()
+            # Behind a failed message: sent after its retry
+            OutboxMessage.objects.filter(pk__in=unsent).update(claimed_by="", claimed_until=None)
+        self.sent += len(sent)
+        return len(messages)
+
+    def send(self, groups):
+        """``send_groups`` on the server's loop; on a loop of its own if there is none (no socket to wake)."""
+        loop = self.loop
+        if loop is None or loop.is_closed() or not loop.is_running():
+            return async_to_sync(self.send_groups)(groups)
+        future = asyncio.run_coroutine_threadsafe(self.send_groups(groups), loop)
+        try:
+            return future.result(outbox_option("LEASE"))
+        except BaseException:
+            # Left claimed: sent again once the lease expires
+            future.cancel()
+            raise
+
+    async def send_groups(self, groups):
+        channel_layer = self.channel_layer or get_channel_layer()
+        return await asyncio.gather(*(self.send_group(channel_layer, group, messages) for group, messages in groups.items()))
+
+    async def send_group(self, channel_layer, group, messages):
+        """Send ``messages`` in order, stopping at the first failure: (sent ids, (message, error) or None, unsent)."""
+        sent = []
+        for n, message in enumerate(messages):
+            try:
+                await channel_layer.group_send(group, message.message)
+            except Exception as e:
+                return sent, (message, e), messages[n + 1:]
+            sent.append(message.pk)
+        return sent, None, []
+
+    def retry(self, message, error, now):
+        attempts = message.attempts + 1
+        changes = {"attempts": attempts, "last_error": str(error), "claimed_by": "", "claimed_until": None}
+        if attempts >= outbox_option("MAX_ATTEMPTS"):
+            changes["failed_at"] = now
+            self.failed += 1
+        else:
+            delay = min(outbox_option("RETRY_DELAY") * 2 ** (attempts - 1), outbox_option("MAX_RETRY_DELAY"))
+            changes["available_at"] = now + timedelta(seconds=delay)
+            self.retried += 1
+        OutboxMessage.objects.filter(pk=message.pk).update(**changes)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True, name="outbox-dispatcher")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping = True
+        self.wake()
+        if self.thread is not None:
+            self.thread.join()
+
+
+_dispatcher = None
+
+
+def get_dispatcher():
+    """The running dispatcher of this process, or None."""
+    return _dispatcher
+
+
+def attach_loop():
+    """Send this process's outbox on the running loop (the server's). Called by the consumers on connect."""
+    loop = asyncio.get_running_loop()
+    if _dispatcher is not None and _dispatcher.loop is not loop:
+        _dispatcher.loop = loop
+
+
+def start_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboxDispatcher().start()
+    return _dispatcher
@@ -1,4 +1,122 @@
-from rest_framework.pagination import PageNumberPagination
+"""
+Keyset ("seek") pagination.
 
-class AuctionItemPagination(PageNumberPagination):
-    page_size=1
+A page continues right after the last row of the previous one with a WHERE
+on the ordering columns instead of an OFFSET, so the 10 000th page costs what
+the first one does, given an index on the ordering. The cursor is the last
+row's ordering values, base64-encoded: clients pass ``next`` back as-is.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from operator import attrgetter
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Field names, "-" for descending; the last one must be unique
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        # One row more tells whether there is a next page
+        rows = list(queryset[:page_size + 1])
+        self.next_position = self.position(rows[page_size - 1]) if len(rows) > page_size else None
+        return rows[:page_size]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def fields(self):
+        return [(name.lstrip("-"), name.startswith("-")) for name in self.ordering]
+
+    def after(self, position):
+        """The rows following ``position`` in ``ordering``."""
+        fields = self.fields()
+        q, equal = Q(), Q()
+        for (name, descending), value in zip(fields, position):
+            q |= equal & Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+            equal &= Q(**{name: value})
+        # A plain range on the leading column too, so the index can seek to it
+        first, descending = fields[0]
+        return Q(**{f"{first}__{'lte' if descending else 'gte'}": position[0]}) & q
+
+    def position(self, row):
+        return [attrgetter(name)(row) for name, _ in self.fields()]
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if isinstance(value, datetime) else str(value) for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            fields = [self.model._meta.get_field(name) for name, _ in self.fields()]
+            if len(values) != len(fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(fields, values)]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if any(value is None for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class CreatedAtPagination(KeysetPagination):
+    """Newest first: (created_at, id) descending."""
+
+    ordering = ("-created_at", "-id")
+
+
+class AmountPagination(KeysetPagination):
+    """Highest first: (amount, id) descending."""
+
+    ordering = ("-amount", "-id")
+
+
+class AuctionItemPagination(CreatedAtPagination):
+    page_size = 20
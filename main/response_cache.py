@@ -0,0 +1,148 @@
+"""
+Versioned response cache for the category and auction lists.
+
+A list response is cached under its scope's generation and the parameters
+of the filterset (normalized: ``?status=upcoming,live`` and
+``?status=live,upcoming`` share an entry); other query parameters don't
+change the response and aren't part of the key. Saving or deleting a
+``Category``, ``Auction`` or ``Item`` bumps the generation of the scopes it
+shows up in once the transaction commits (``main.signals``), so every entry
+of the scope is bypassed at once without being deleted.
+
+An auction's status moves with the clock, not with a save: the auction
+entries expire at the next ``start_date``/``end_date`` to come, of any auction
+(``MAX_TTL`` at most). Each entry keeps the ETag of its content; a request
+whose ``If-None-Match`` matches gets a 304 without a body.
+
+The generations and entries live in the default cache, which every process
+must share (``CACHES`` in the settings: file-based, per host). With a
+process-local one, the other workers would not see a bump. Settings::
+
+    RESPONSE_CACHE = {"MAX_TTL": 300}
+"""
+import hashlib
+import json
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Min, Q
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Auction
+
+DEFAULTS = {"MAX_TTL": 300}
+
+PREFIX = "response_cache"
+CATEGORIES = "categories"
+AUCTIONS = "auctions"
+
+
+def response_cache_option(name):
+    return getattr(settings, "RESPONSE_CACHE", {}).get(name, DEFAULTS[name])
+
+
+def generation(scope):
+    key = f"{PREFIX}:{scope}:generation"
+    # Starts from the clock: should the key be evicted, old entries don't come back
+    cache.add(key, time.time_ns(), timeout=None)
+    return cache.get(key)
+
+
+def bump(*scopes):
+    """Bypass every cached response of ``scopes``."""
+    for scope in scopes:
+        try:
+            cache.incr(f"{PREFIX}:{scope}:generation")
+        except ValueError:
+            cache.set(f"{PREFIX}:{scope}:generation", time.time_ns(), timeout=None)
+
+
+def next_status_change(now=None):
+    """The next ``start_date`` or ``end_date`` to come, of any auction, or None."""
+    now = now or timezone.now()
+    # Both served by the date indexes
+    dates = Auction.objects.aggregate(
+        start=Min("start_date", filter=Q(start_date__gt=now)),
+        end=Min("end_date", filter=Q(end_date__gt=now)),
+    )
+    upcoming = [date for date in dates.values() if date is not None]
+    return min(upcoming) if upcoming else None
+
+
+def auctions_ttl(now=None):
+    """Seconds until an auction's status changes (one lookup per generation), capped at ``MAX_TTL``."""
+    now = now or timezone.now()
+    key = f"{PREFIX}:{AUCTIONS}:{generation(AUCTIONS)}:next_status_change"
+    cached = cache.get(key)
+    if cached is None or (cached[0] is not None and cached[0] <= now):
+        cached = (next_status_change(now),)
+        cache.set(key, cached, ttl_until(cached[0], now))
+    return ttl_until(cached[0], now)
+
+
+def ttl_until(moment, now):
+    max_ttl = response_cache_option("MAX_TTL")
+    if moment is None:
+        return max_ttl
+    return max(1, min(max_ttl, math.ceil((moment - now).total_seconds())))
+
+
+def etag_of(data):
+    content = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return quote_etag(hashlib.md5(content.encode()).hexdigest())
+
+
+class VersionedListCacheMixin:
+    """
+    Cache ``list`` under ``cache_scope``'s generation, keyed on the
+    ``filterset_class`` parameters, for ``cache_ttl()`` seconds.
+    """
+
+    cache_scope = None
+
+    def cache_ttl(self):
+        return response_cache_option("MAX_TTL")
+
+    def cache_params(self, request):
+        filterset_class = getattr(self, "filterset_class", None)
+        names = sorted(filterset_class.base_filters) if filterset_class else []
+        params = []
+        for name in names:
+            for value in request.query_params.getlist(name):
+                if name != "ordering":
+                    # A set of values, in any order
+                    value = ",".join(sorted(v.strip() for v in value.split(",")))
+                params.append((name, value))
+        return params
+
+    def cache_key(self, request):
+        digest = hashlib.md5(json.dumps(self.cache_params(request)).encode()).hexdigest()
+        return f"{PREFIX}:{self.cache_scope}:{generation(self.cache_scope)}:{digest}"
+
+    def list(self, request, *args, **kwargs):
+        key = self.cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = {"etag": etag_of(response.data), "data": response.data}
+            cache.set(key, entry, self.cache_ttl())
+
+        # Weak comparison, as for GET
+        if_none_match = {etag.removeprefix("W/") for etag in parse_etags(request.headers.get("If-None-Match", ""))}
+        if entry["etag"] in if_none_match or "*" in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry["data"])
+        response["ETag"] = entry["etag"]
+        # Clients revalidate with If-None-Match each time
+        patch_cache_control(response, no_cache=True)
+        return response
@@ -0,0 +1,211 @@
+"""
+In-process scheduler closing items at their deadline.
+
+The deadlines of every item not finalized yet are loaded once, at start, into
+a heap; a single thread sleeps until the earliest one comes up and hands the
+due items, in batches, to ``main.closing.finalize_items``. Nothing polls the
+database per deadline.
+
+- Overdue items (the process was down when they ended) are due at start and
+  closed right away.
+- Extended deadlines are pushed again with ``schedule``; the heap entry with
+  the old deadline is skipped when it comes up. An extension made by another
+  process is noticed when the stale deadline fires: the UPDATE doesn't match,
+  and the item goes back on the heap with the deadline read from the database.
+- Items created by other processes are picked up by a resync every
+  ``RESYNC`` seconds.
+
+Several processes may run a scheduler; ``finalize_items`` closes each item
+exactly once. Settings::
+
+    AUCTION_CLOSER = {"AUTOSTART": True, "BATCH_SIZE": 500, "RESYNC": 300}
+"""
+import heapq
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .closing import finalize_items, open_items
+from .journal import get_journal
+from .outbox import enqueue_many
+
+DEFAULTS = {"AUTOSTART": True, "BATCH_SIZE": 500, "RESYNC": 300}
+# Seconds to wait before retrying a batch that failed
+ERROR_DELAY = 1
+
+
+def closer_option(name):
+    return getattr(settings, "AUCTION_CLOSER", {}).get(name, DEFAULTS[name])
+
+
+class CloseScheduler:
+    def __init__(self, finalize=finalize_items, on_closed=None, clock=timezone.now, batch_size=None):
+        self.finalize = finalize
+        self.on_closed = on_closed
+        self.clock = clock
+        self.batch_size = batch_size or closer_option("BATCH_SIZE")
+        # (deadline, item_id); entries whose deadline isn't the current one are stale
+        self.heap = []
+        self.deadlines = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.closed = 0
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, item_id, deadline):
+        """(Re)schedule ``item_id`` to close at ``deadline``."""
+        with self.condition:
+            if self.deadlines.get(item_id) == deadline:
+                return
+            self.deadlines[item_id] = deadline
+            heapq.heappush(self.heap, (deadline, item_id))
+            if len(self.heap) > 2 * len(self.deadlines) + 1000:
+                self._compact()
+            if self.heap[0] == (deadline, item_id):
+                # Earlier than what the thread is sleeping for
+                self.condition.notify()
+
+    def cancel(self, item_id):
+        with self.condition:
+            self.deadlines.pop(item_id, None)
+
+    def load(self):
+        """Schedule every item not finalized yet; returns how many."""
+        items = open_items()
+        for item_id, deadline in items.items():
+            self.schedule(item_id, deadline)
+        return len(items)
+
+    def _compact(self):
+        self.heap = [(deadline, item_id) for item_id, deadline in self.deadlines.items()]
+        heapq.heapify(self.heap)
+
+    def _pop_due(self, now):
+        """``{item_id: deadline}`` of up to ``batch_size`` due items, taken off the heap."""
+        due = {}
+        while self.heap and self.heap[0][0] <= now and len(due) < self.batch_size:
+            deadline, item_id = heapq.heappop(self.heap)
+            if self.deadlines.get(item_id) != deadline:
+                continue
+            del self.deadlines[item_id]
+            due[item_id] = deadline
+        return due
+
+    def next_deadline(self):
+        with self.condition:
+            while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+    def run_pending(self, now=None):
+        """
+        Finalize one batch of due items. Returns ``{item_id: result}`` as
+        ``finalize_items`` does.
+        """
+        now = now or self.clock()
+        with self.condition:
+            due = self._pop_due(now)
+        if not due:
+            return {}
+
+        try:
+            journal = get_journal()
+            if journal is not None:
+                # The winners are read from the database: no journaled bid may be missing
+                journal.flush()
+            closed = self.finalize(list(due), now)
+        except Exception:
+            # Back on the heap for the next run, unless rescheduled meanwhile
+            with self.condition:
+                for item_id, deadline in due.items():
+                    if item_id not in self.deadlines:
+                        self.schedule(item_id, deadline)
+            raise
+        missed = [item_id for item_id in due if item_id not in closed]
+        if missed:
+            # Extended (or closed) by someone else: follow the database
+            for item_id, deadline in open_items(missed).items():
+                self.schedule(item_id, deadline)
+        self.closed += len(closed)
+        if closed and self.on_closed:
+            self.on_closed(closed, now)
+        return closed
+
+    def run(self):
+        resync_every = closer_option("RESYNC")
+        resynced_at = self.clock()
+        try:
+            while True:
+                with self.condition:
+                    if self.stopping:
+                        return
+                    deadline = self.next_deadline()
+                    now = self.clock()
+                    due = deadline is not None and deadline <= now
+                    if not due:
+                        timeout = resync_every if deadline is None else (deadline - now).total_seconds()
+                        self.condition.wait(min(timeout, resync_every))
+                try:
+                    while due and self.run_pending():
+                        pass
+                    if (self.clock() - resynced_at).total_seconds() >= resync_every:
+                        resynced_at = self.clock()
+                        self.load()
+                except Exception as e:
+                    print(f"Auction close scheduler error: {e}")
+                    connection.close()
+                    with self.condition:
+                        if not self.stopping:
+                            self.condition.wait(ERROR_DELAY)
+        finally:
+            connection.close()
+
+    def start(self):
+        self.load()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="auction-closer")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def publish_closed(closed, ended_at):
+    """
+    Tell the rooms of the closed items (``BidConsumer.auction_closed``),
+    through the outbox: its dispatcher sends on the server's loop.
+    """
+    enqueue_many([
+        (f"auction_item_{item_id}", {
+            "type": "auction_closed",
+            "item_id": item_id,
+            "ended_at": ended_at.isoformat(),
+            "winner": result.winner.username if result else None,
+            "amount": str(result.winning_bid.amount) if result else None,
+        })
+        for item_id, result in closed.items()
+    ])
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """The running scheduler of this process, or None."""
+    return _scheduler
+
+
+def start_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = CloseScheduler(on_closed=publish_closed).start()
+    return _scheduler
@@ -23,7 +23,8 @@ class ItemsSerializer(serializers.ModelSerializer):
     bids = BidBasicSerializer(many=True , read_only = True)
     class Meta:
         model = Item
-        fields = ["id", "title","desc","start_price","min_increment","auction","category" , "bids" , "end_at" , "is_active","slug"]
+        fields = ["id", "title","desc","start_price","min_increment","current_price","bid_count","auction","category" , "bids" , "end_at" , "is_active","slug",
+                  "closes_at", "soft_close_window", "soft_close_extension"]
 
 
 class AuctionSerializer(serializers.ModelSerializer):
@@ -44,7 +45,7 @@ class AuctionBasicDetailsSerializer(AuctionSerializer):
     """
     category = CategorySerializer(read_only=True)
     items = None  # disable inherited items
-    item_count = serializers.SerializerMethodField()
+    item_count = serializers.IntegerField(read_only=True)  # annotated by AuctionView
 
     class Meta(AuctionSerializer.Meta):
         fields = [
@@ -53,5 +54,3 @@ class AuctionBasicDetailsSerializer(AuctionSerializer):
             'status', 'item_count','category'
         ]
 
-    def get_item_count(self, obj):
-        return obj.items.count()
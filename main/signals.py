@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Auction, Category, Item
+from .response_cache import AUCTIONS, CATEGORIES, bump
+from .scheduler import get_scheduler
+
+
+def bump_on_commit(*scopes):
+    # Bumped before the commit, a list read in between would be cached under
+    # the new generation with the old rows
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def forget_category_lists(sender, **kwargs):
+    # Auctions are listed with their category
+    bump_on_commit(CATEGORIES, AUCTIONS)
+
+
+@receiver(post_save, sender=Auction)
+@receiver(post_delete, sender=Auction)
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def forget_auction_lists(sender, **kwargs):
+    # Items count in the list's item_count
+    bump_on_commit(AUCTIONS)
+
+
+@receiver(post_save, sender=Item)
+def schedule_item_close(sender, instance, **kwargs):
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return
+    if instance.end_at is None:
+        scheduler.schedule(instance.id, instance.closes_at)
+    else:
+        scheduler.cancel(instance.id)
+
+
+@receiver(post_save, sender=Auction)
+def sync_item_deadlines(sender, instance, created, **kwargs):
+    """
+    A moved end date moves the deadline of the auction's open items, except
+    for soft-close extensions that already run past it.
+    """
+    if created:
+        return
+    items = instance.items.filter(end_at__isnull=True)
+    items.exclude(closes_at=instance.end_date).filter(
+        Q(extensions=0) | Q(closes_at__isnull=True) | Q(closes_at__lt=instance.end_date)
+    ).update(closes_at=instance.end_date)
+
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        for item_id, closes_at in items.values_list("pk", "closes_at"):
+            scheduler.schedule(item_id, closes_at)
@@ -1,3 +1,811 @@
-from django.test import TestCase
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from AuctionProject import broker
+from AuctionProject.channel_layers import BrokerChannelLayer
+from notificationapp.models import FanOutJob
+from notificationapp.routing import websocket_urlpatterns as notification_urls
+
+from .benchmarking import seed_users
+from .bidding import BidRejected, accept_bid
+from .closing import finalize_items
+from .journal import BidJournal
+from .models import TOP_BIDS, Auction, AuctionResult, Bid, Category, Item, OutboxMessage
+from .outbox import OutboxDispatcher, backlog, enqueue, enqueue_many
+from .response_cache import CATEGORIES, auctions_ttl, generation
+from .scheduler import CloseScheduler, publish_closed
+
+User = get_user_model()
+
+
+def create_item(owner, **kwargs):
+    now = timezone.now()
+    category, _ = Category.objects.get_or_create(name="Test", defaults={"slug": "test"})
+    auction = Auction.objects.create(
+        title="Test auction",
+        entry_fee=Decimal("0.00"),
+        start_date=now - timedelta(hours=1),
+        end_date=now + timedelta(hours=1),
+        created_by=owner,
+        category=category,
+    )
+    fields = {
+        "title": "Test item",
+        "start_price": Decimal("10.00"),
+        "min_increment": Decimal("1.00"),
+        "is_active": True,
+        "category": category,
+    }
+    fields.update(kwargs)
+    return Item.objects.create(auction=auction, **fields)
+
+
+class AcceptBidTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.bidder = User.objects.create(username="bidder")
+        self.item = create_item(self.owner)
+
+    def test_opening_bid_must_reach_start_price(self):
+        with self.assertRaises(BidRejected) as ctx:
+            accept_bid(self.item.id, self.bidder, Decimal("9.99"))
+        self.assertEqual(ctx.exception.code, BidRejected.TOO_LOW)
+
+        accept_bid(self.item.id, self.bidder, Decimal("10.00"))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.current_price, Decimal("10.00"))
+        self.assertEqual(self.item.current_winner, self.bidder)
+        self.assertEqual(self.item.bid_count, 1)
+
+    def test_next_bid_needs_min_increment(self):
+        accept_bid(self.item.id, self.bidder, Decimal("10.00"))
+        with self.assertRaises(BidRejected) as ctx:
+            accept_bid(self.item.id, self.bidder, Decimal("10.99"))
+        self.assertEqual(ctx.exception.min_acceptable_bid, Decimal("11.00"))
+        accept_bid(self.item.id, self.bidder, Decimal("11.00"))
+        self.assertEqual(Bid.objects.filter(item=self.item).count(), 2)
+
+    def test_rejects_inactive_ended_and_invalid(self):
+        with self.assertRaises(BidRejected) as ctx:
+            accept_bid(self.item.id, self.bidder, Decimal("10.001"))
+        self.assertEqual(ctx.exception.code, BidRejected.INVALID)
+
+        Item.objects.filter(pk=self.item.pk).update(closes_at=timezone.now() - timedelta(seconds=1))
+        with self.assertRaises(BidRejected) as ctx:
+            accept_bid(self.item.id, self.bidder, Decimal("50.00"))
+        self.assertEqual(ctx.exception.code, BidRejected.ENDED)
+
+        Item.objects.filter(pk=self.item.pk).update(is_active=False)
+        with self.assertRaises(BidRejected) as ctx:
+            accept_bid(self.item.id, self.bidder, Decimal("50.00"))
+        self.assertEqual(ctx.exception.code, BidRejected.INACTIVE)
+
+    def test_bid_save_goes_through_accept(self):
+        Bid.objects.create(item=self.item, created_by=self.bidder, amount=Decimal("12.00"))
+        with self.assertRaises(ValidationError):
+            Bid.objects.create(item=self.item, created_by=self.bidder, amount=Decimal("12.50"))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.current_price, Decimal("12.00"))
+        self.assertEqual(self.item.bid_count, 1)
+
+    def test_accept_costs_two_statements(self):
+        with CaptureQueriesContext(connection) as ctx:
+            accept_bid(self.item.id, self.bidder, Decimal("10.00"))
+        statements = [q["sql"] for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].startswith("UPDATE"))
+        self.assertTrue(statements[1].startswith("INSERT"))
+
+
+class AuctionDetailQueryTests(TestCase):
+    """The auction detail must cost the same number of queries however big it is."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create(username="owner")
+        self.bidders = [User.objects.create(username=f"bidder_{i}") for i in range(3)]
+        self.item = create_item(self.owner)
+        self.auction = self.item.auction
+
+    def add_item(self, bids):
+        item = Item.objects.create(
+            auction=self.auction, title="Another item", category=self.item.category,
+            start_price=Decimal("10.00"), min_increment=Decimal("1.00"), is_active=True,
+        )
+        for i in range(bids):
+            accept_bid(item.id, self.bidders[i % len(self.bidders)], Decimal(10 + i))
+        return item
+
+    def get_detail(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f"/api/auction/{self.auction.slug}/")
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.add_item(bids=2)
+        _, small = self.get_detail()
+
+        for _ in range(5):
+            self.add_item(bids=TOP_BIDS + 5)
+        data, large = self.get_detail()
+
+        self.assertEqual(len(data["items"]), 7)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 4)
+
+    def test_nested_bids_are_the_top_n(self):
+        item = self.add_item(bids=TOP_BIDS + 5)
+        data, _ = self.get_detail()
+
+        bids = next(i for i in data["items"] if i["id"] == item.id)["bids"]
+        self.assertEqual(len(bids), TOP_BIDS)
+        amounts = [Decimal(b["amount"]) for b in bids]
+        self.assertEqual(amounts, sorted(amounts, reverse=True))
+        self.assertEqual(amounts[0], Decimal(10 + TOP_BIDS + 4))
+        self.assertTrue(all(b["created_by"].startswith("bidder_") for b in bids))
+
+
+class AuctionListTests(TestCase):
+    def setUp(self):
+        # Rows are bulk-created below: no signal bumps the cached lists
+        cache.clear()
+        self.client = APIClient()
+        self.owner = User.objects.create(username="owner")
+        self.category = Category.objects.create(name="Test", slug="test")
+        now = timezone.now()
+        windows = {
+            "ended": (now - timedelta(days=2), now - timedelta(days=1)),
+            "live": (now - timedelta(hours=1), now + timedelta(hours=1)),
+            "upcoming": (now + timedelta(days=1), now + timedelta(days=2)),
+        }
+        auctions = []
+        for i in range(30):
+            status = list(windows)[i % 3]
+            start, end = windows[status]
+            auctions.append(Auction(
+                title=f"{status} {i}", slug=f"{status}-{i}", entry_fee=Decimal("0.00"),
+                start_date=start, end_date=end + timedelta(minutes=i),
+                created_by=self.owner, category=self.category,
+            ))
+        auctions = Auction.objects.bulk_create(auctions)
+        Item.objects.bulk_create([
+            Item(auction=auction, title="Item", category=self.category,
+                 start_price=Decimal("1.00"), min_increment=Decimal("1.00"))
+            for auction in auctions for _ in range(auctions.index(auction) % 4)
+        ])
+
+    def get_list(self, query=""):
+        # Looked up once per generation, not per list (main.response_cache)
+        auctions_ttl()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f"/api/auction/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_list_is_one_query(self):
+        data, queries = self.get_list()
+        self.assertEqual(len(data), 30)
+        self.assertEqual(queries, 1)
+        for row in data:
+            auction = Auction.objects.get(pk=row["id"])
+            self.assertEqual(row["status"], auction.status)
+            self.assertEqual(row["item_count"], auction.items.count())
+
+    def test_filter_and_order_by_status(self):
+        data, queries = self.get_list("?status=live,upcoming&ordering=status,-end_date")
+        self.assertEqual(queries, 1)
+        self.assertEqual([row["status"] for row in data], ["live"] * 10 + ["upcoming"] * 10)
+        live_ends = [row["end_date"] for row in data[:10]]
+        self.assertEqual(live_ends, sorted(live_ends, reverse=True))
+
+        data, _ = self.get_list("?status=bogus")
+        self.assertEqual(len(data), 30)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.owner = User.objects.create(username="owner")
+        self.category = Category.objects.create(name="Cars", slug="cars")
+        self.now = timezone.now()
+        self.create_auction("Live", self.now - timedelta(hours=1), self.now + timedelta(hours=1))
+
+    def create_auction(self, title, start, end):
+        return Auction.objects.create(
+            title=title, entry_fee=Decimal("0.00"), start_date=start, end_date=end,
+            created_by=self.owner, category=self.category,
+        )
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, headers=headers)
+        return response, len(ctx.captured_queries)
+
+    def test_hits_skip_the_database_and_revalidate_with_etags(self):
+        first, _ = self.get("/api/auction/?status=live,upcoming")
+        again, queries = self.get("/api/auction/?status=upcoming,live&unrelated=1")
+        self.assertEqual(queries, 0)
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(again["ETag"], first["ETag"])
+
+        response, queries = self.get("/api/auction/?status=live,upcoming", if_none_match=first["ETag"])
+        self.assertEqual((response.status_code, response.content, queries), (304, b"", 0))
+
+    def test_saves_bump_the_generation(self):
+        auctions, _ = self.get("/api/auction/")
+        categories, _ = self.get("/api/category/")
+        # Only the cache bumps run on commit, not the auction's fan-out thread
+        with mock.patch("notificationapp.signals.schedule_fanout"), self.captureOnCommitCallbacks(execute=True):
+            self.create_auction("Next", self.now + timedelta(days=1), self.now + timedelta(days=2))
+        self.assertEqual(len(self.get("/api/auction/")[0].json()), 2)
+        self.assertEqual(self.get("/api/category/")[1], 0)
+
+        self.category.name = "Classic cars"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        response, _ = self.get("/api/auction/", if_none_match=auctions["ETag"])
+        self.assertEqual(response.json()[0]["category"]["name"], "Classic cars")
+        self.assertNotEqual(self.get("/api/category/")[0]["ETag"], categories["ETag"])
+
+    def test_generation_is_bumped_once_the_save_commits(self):
+        before = generation(CATEGORIES)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.category.name = "Classic cars"
+                self.category.save()
+                # A list read now still sees the old row: it must not be cached as new
+                self.assertEqual(generation(CATEGORIES), before)
+        self.assertGreater(generation(CATEGORIES), before)
+
+    def test_a_bump_in_another_process_is_seen(self):
+        before = generation(CATEGORIES)
+        subprocess.run(
+            [sys.executable, "manage.py", "shell", "-c", "from main.response_cache import bump; bump('categories')"],
+            cwd=settings.BASE_DIR, check=True, capture_output=True,
+        )
+        self.assertGreater(generation(CATEGORIES), before)
+
+    def test_auction_entries_expire_at_the_next_status_change(self):
+        self.create_auction("Soon", self.now + timedelta(seconds=90), self.now + timedelta(days=1))
+        self.assertEqual(auctions_ttl(self.now), 90)
+        with self.settings(RESPONSE_CACHE={"MAX_TTL": 60}):
+            self.assertEqual(auctions_ttl(self.now), 60)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner, = seed_users(1, prefix="keyset")
+        self.item = create_item(self.owner)
+        now = timezone.now()
+        # Ties on both keys: created_at repeats every 3 bids, amount every 4
+        Bid.objects.bulk_create([
+            Bid(item=self.item, created_by=self.owner, amount=Decimal(10 + i // 4))
+            for i in range(50)
+        ])
+        for i, bid in enumerate(Bid.objects.order_by("id")):
+            Bid.objects.filter(pk=bid.pk).update(created_at=now - timedelta(seconds=i // 3))
+
+    def walk(self, query):
+        url, pages, bids = f"/api/items/{self.item.slug}/bids/{query}", [], []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(ctx.captured_queries)
+            bids += response.json()["results"]
+            url = response.json()["next"]
+        return pages, bids
+
+    def test_pages_follow_the_keys_without_offset(self):
+        pages, bids = self.walk("?page_size=7")
+        self.assertEqual(len(pages), 8)
+        expected = list(Bid.objects.filter(item=self.item).order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual([b["id"] for b in bids], expected)
+        # Same queries on the last page as on the first, and no OFFSET
+        self.assertEqual({len(queries) for queries in pages}, {2})
+        self.assertFalse(any("OFFSET" in q["sql"] for queries in pages for q in queries))
+
+        _, bids = self.walk("?order=amount&page_size=5")
+        expected = list(Bid.objects.filter(item=self.item).order_by("-amount", "-id").values_list("id", flat=True))
+        self.assertEqual([b["id"] for b in bids], expected)
+
+    def test_page_size_is_bounded_and_cursor_checked(self):
+        response = self.client.get(f"/api/items/{self.item.slug}/bids/?page_size=100000")
+        self.assertEqual(len(response.json()["results"]), 50)
+        response = self.client.get(f"/api/items/{self.item.slug}/bids/?page_size=10")
+        self.assertEqual(len(response.json()["results"]), 10)
+        response = self.client.get(f"/api/items/{self.item.slug}/bids/?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 404)
+
+
+class CloseSchedulerTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.first, self.second = (User.objects.create(username=f"bidder_{i}") for i in range(2))
+        self.item = create_item(self.owner, reserve_price=Decimal("15.00"))
+        accept_bid(self.item.id, self.first, "12.00")
+        self.top_bid = accept_bid(self.item.id, self.second, "16.00")
+
+    def end_auction(self, closes_at):
+        Item.objects.filter(pk=self.item.pk).update(closes_at=closes_at)
+
+    def test_top_bid_wins_exactly_once(self):
+        scheduler = CloseScheduler()
+        self.assertEqual(scheduler.load(), 1)
+        self.assertEqual(scheduler.run_pending(), {})  # not due yet
+
+        now = timezone.now()
+        self.end_auction(now - timedelta(seconds=1))
+        closed = scheduler.run_pending(now + timedelta(hours=2))
+        result = closed[self.item.id]
+        self.assertEqual((result.winner, result.winning_bid), (self.second, self.top_bid))
+        self.item.refresh_from_db()
+        self.assertFalse(self.item.is_active)
+        self.assertIsNotNone(self.item.end_at)
+
+        # Another scheduler, or one restarted with stale state, can't close it again
+        self.assertEqual(finalize_items([self.item.id]), {})
+        self.assertEqual(CloseScheduler().load(), 0)
+        self.assertEqual(AuctionResult.objects.count(), 1)
+
+    def test_rooms_are_told_through_the_outbox(self):
+        now = timezone.now()
+        self.end_auction(now)
+        scheduler = CloseScheduler(on_closed=publish_closed)
+        scheduler.load()
+        scheduler.run_pending(now)
+        message = OutboxMessage.objects.get(group=f"auction_item_{self.item.id}").message
+        self.assertEqual(message["type"], "auction_closed")
+        self.assertEqual((message["winner"], message["amount"]), ("bidder_1", "16.00"))
+
+    def test_reserve_not_met_ends_without_result(self):
+        Item.objects.filter(pk=self.item.pk).update(reserve_price=Decimal("50.00"))
+        self.end_auction(timezone.now())
+        self.assertEqual(finalize_items([self.item.id]), {self.item.id: None})
+        self.assertFalse(AuctionResult.objects.exists())
+
+    def test_extension_moves_the_close(self):
+        scheduler = CloseScheduler()
+        scheduler.load()
+        old_deadline = scheduler.deadlines[self.item.id]
+        new_deadline = old_deadline + timedelta(minutes=5)
+        # Extended by another process: the stale deadline fires for nothing
+        self.end_auction(new_deadline)
+        self.assertEqual(scheduler.run_pending(old_deadline), {})
+        self.assertEqual(scheduler.deadlines[self.item.id], new_deadline)
+
+        # Extended in this process: the old heap entry is skipped
+        self.end_auction(new_deadline + timedelta(minutes=5))
+        scheduler.schedule(self.item.id, new_deadline + timedelta(minutes=5))
+        self.assertEqual(scheduler.run_pending(new_deadline), {})
+        self.assertIn(self.item.id, scheduler.run_pending(new_deadline + timedelta(minutes=5)))
+
+    def test_failed_batch_stays_scheduled(self):
+        failures = [OperationalError("database is locked")]
+
+        def flaky_finalize(item_ids, now):
+            if failures:
+                raise failures.pop()
+            return finalize_items(item_ids, now)
+
+        scheduler = CloseScheduler(finalize=flaky_finalize)
+        scheduler.load()
+        deadline = scheduler.deadlines[self.item.id]
+        self.end_auction(deadline)
+        with self.assertRaises(OperationalError):
+            scheduler.run_pending(deadline)
+        self.assertEqual(scheduler.deadlines, {self.item.id: deadline})
+        self.assertIn(self.item.id, scheduler.run_pending(deadline))
+
+
+class FlakyChannelLayer:
+    """Records group_send calls; fails those whose message is in ``failing``."""
+
+    def __init__(self):
+        self.sent = []
+        self.failing = set()
+
+    async def group_send(self, group, message):
+        if message["n"] in self.failing:
+            raise ConnectionError("layer down")
+        self.sent.append((group, message["n"]))
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        # The dispatcher's clock: a moment after the messages are written
+        self.now = timezone.now() + timedelta(seconds=0.5)
+        self.layer = FlakyChannelLayer()
+        self.dispatcher = OutboxDispatcher(channel_layer=self.layer, clock=lambda: self.now)
+
+    def test_rolled_back_messages_are_never_sent(self):
+        try:
+            with transaction.atomic():
+                enqueue("a", {"n": 1})
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_a_failed_send_holds_its_group_only(self):
+        enqueue_many([("a", {"n": 1}), ("b", {"n": 2}), ("a", {"n": 3}), ("b", {"n": 4})])
+        self.layer.failing = {1}
+        self.assertEqual(self.dispatcher.dispatch(), 4)
+        self.assertEqual(self.layer.sent, [("b", 2), ("b", 4)])
+        self.assertEqual(backlog(self.now)["retrying"], 1)
+
+        # Nothing of "a" before its first message's retry is due
+        self.layer.failing = set()
+        self.assertEqual(self.dispatcher.dispatch(), 0)
+        self.now += timedelta(seconds=1)
+        self.assertEqual(self.dispatcher.dispatch(), 2)
+        self.assertEqual(self.layer.sent[2:], [("a", 1), ("a", 3)])
+        self.assertEqual(backlog(self.now)["pending"], 0)
+
+    def test_gives_up_after_max_attempts(self):
+        enqueue_many([("a", {"n": 1}), ("a", {"n": 2})])
+        self.layer.failing = {1}
+        with self.settings(OUTBOX={"MAX_ATTEMPTS": 2}):
+            for _ in range(2):
+                self.dispatcher.dispatch()
+                self.now += timedelta(minutes=10)
+            self.dispatcher.dispatch()
+        self.assertEqual(self.layer.sent, [("a", 2)])
+        stats = backlog(self.now)
+        self.assertEqual((stats["pending"], stats["failed"]), (0, 1))
+        self.assertEqual(OutboxMessage.objects.get().last_error, "layer down")
+
+
+class OutboxDeliveryTests(TransactionTestCase):
+    def test_message_reaches_a_connected_socket_promptly(self):
+        user = User.objects.create(username="alice")
+        dispatcher = OutboxDispatcher()
+
+        async def scenario():
+            communicator = WebsocketCommunicator(URLRouter(notification_urls), "/ws/notifications/")
+            communicator.scope["user"] = user
+            self.assertTrue((await communicator.connect())[0])
+            self.assertEqual((await communicator.receive_json_from())["type"], "unread_count")
+            self.assertIs(dispatcher.loop, asyncio.get_running_loop())
+
+            # Written (and the dispatcher woken) by another thread, as a request would
+            await sync_to_async(enqueue, thread_sensitive=False)(f"user_notifications_{user.pk}", {
+                "type": "send_notification", "message": "Outbid", "data": {},
+            })
+            started = time.monotonic()
+            self.assertEqual((await communicator.receive_json_from(timeout=1))["message"], "Outbid")
+            self.assertLess(time.monotonic() - started, 0.5)
+            # Done with its batch before the socket's row is deleted: SQLite
+            # tables are locked while another connection writes
+            await sync_to_async(dispatcher.stop, thread_sensitive=False)()
+            await communicator.disconnect()
+
+        with self.settings(OUTBOX={"POLL_INTERVAL": 60}), mock.patch("main.outbox._dispatcher", dispatcher):
+            dispatcher.start()
+            try:
+                async_to_sync(scenario)()
+            finally:
+                dispatcher.stop()
+        self.assertFalse(OutboxMessage.objects.exists())
+
+
+class SoftCloseSimulationTests(TestCase):
+    """Thousands of last-second bids, replayed against a model of the soft close."""
+
+    BIDS = 2000
+    WINDOW = timedelta(seconds=30)
+    EXTENSION = timedelta(seconds=20)
+
+    def test_deadline_follows_the_model(self):
+        owner = User.objects.create(username="owner")
+        bidders = [User.objects.create(username=f"sniper_{i}") for i in range(5)]
+        item = create_item(owner, soft_close_window=self.WINDOW, soft_close_extension=self.EXTENSION)
+        rng = random.Random(7)
+        closes_at = item.closes_at
+        now = closes_at - timedelta(minutes=1)
+        amount = item.start_price
+        extensions = accepted = 0
+
+        clock = mock.patch("main.bidding.timezone.now", side_effect=lambda: now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        for i in range(self.BIDS):
+            # Mostly inside the last seconds; the very last bid comes too late
+            now += timedelta(milliseconds=rng.randrange(0, 4000))
+            if i == self.BIDS - 1:
+                now = closes_at + timedelta(microseconds=1)
+            try:
+                bid = accept_bid(item.id, bidders[i % 5], amount, read_deadline=True)
+            except BidRejected as e:
+                self.assertEqual(e.code, BidRejected.ENDED)
+                self.assertGreater(now, closes_at)
+                continue
+            self.assertLessEqual(now, closes_at)
+            accepted += 1
+            amount += item.min_increment
+            if closes_at - now <= self.WINDOW and closes_at < now + self.EXTENSION:
+                closes_at = now + self.EXTENSION
+                extensions += 1
+            self.assertEqual(bid.closes_at, closes_at)
+
+        item.refresh_from_db()
+        self.assertEqual(accepted, self.BIDS - 1)
+        self.assertEqual((item.closes_at, item.extensions, item.bid_count), (closes_at, extensions, accepted))
+        self.assertGreater(extensions, self.BIDS // 2)
+
+
+class BidJournalTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create(username="owner")
+        self.bidder = User.objects.create(username="bidder")
+        self.item = create_item(owner)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "bids.journal")
+
+    def append(self, journal, *amounts, accepted_at=None):
+        async def append_all():
+            await asyncio.gather(*(
+                journal.append({
+                    "item": self.item.id,
+                    "user": self.bidder.id,
+                    "amount": amount,
+                    "closes_at": self.item.closes_at.isoformat(),
+                    "extensions": 0,
+                    **({"created_at": accepted_at.isoformat()} if accepted_at else {}),
+                })
+                for amount in amounts
+            ))
+
+        async_to_sync(append_all)()
+
+    def test_group_commit_and_exactly_once_replay(self):
+        journal = BidJournal(self.path).open()
+        self.append(journal, "10.00", "11.00", "12.00")
+        self.assertEqual((journal.stats["appends"], journal.stats["fsyncs"]), (3, 1))
+        self.assertEqual(journal.flush(), 3)
+        self.append(journal, "13.00", "14.00")
+        journal.close()  # crash: the last two bids are only in the file
+        with open(self.path, "ab") as f:
+            f.write(b'{"seq": 6, "item"')  # torn write
+
+        self.assertEqual(Bid.objects.count(), 3)
+        replayed = BidJournal(self.path).open()
+        self.assertEqual(replayed.stats["replayed"], 2)
+        replayed.close()
+        self.assertEqual(BidJournal(self.path).open().stats["replayed"], 0)
+
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.current_price, self.item.bid_count), (Decimal("14.00"), 5))
+        self.assertEqual(
+            list(Bid.objects.order_by("amount").values_list("amount", flat=True)),
+            [Decimal(amount) for amount in ("10", "11", "12", "13", "14")],
+        )
+
+    def test_failed_sync_is_not_journaled(self):
+        journal = BidJournal(self.path).open()
+        self.append(journal, "10.00")
+        with mock.patch("main.journal.os.fsync", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.append(journal, "11.00", "12.00")
+        self.append(journal, "13.00")
+        self.assertEqual(journal.stats["failed"], 2)
+        self.assertEqual([record["amount"] for record in journal.unflushed], ["10.00", "13.00"])
+        journal.close()
+
+        BidJournal(self.path).open().close()
+        self.assertEqual(
+            list(Bid.objects.order_by("amount").values_list("amount", flat=True)),
+            [Decimal("10.00"), Decimal("13.00")],
+        )
+
+    def test_bids_keep_the_time_they_were_accepted(self):
+        accepted_at = timezone.now() - timedelta(minutes=5)
+        journal = BidJournal(self.path).open()
+        self.append(journal, "10.00", accepted_at=accepted_at)
+        # A record of a journal written before records carried the time
+        self.append(journal, "11.00")
+        journal.flush()
+        journal.close()
+
+        bids = Bid.objects.order_by("amount")
+        self.assertEqual(bids[0].created_at, accepted_at)
+        self.assertGreater(bids[1].created_at, accepted_at + timedelta(minutes=4))
+
+    def test_closed_item_keeps_its_result(self):
+        journal = BidJournal(self.path).open()
+        self.append(journal, "10.00")
+        Item.objects.filter(pk=self.item.id).update(end_at=timezone.now())
+        journal.flush()
+
+        self.assertFalse(Bid.objects.exists())
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.current_price, self.item.bid_count), (None, 0))
+        self.assertEqual((journal.stats["late"], journal.stats["flushed"]), (1, 0))
+
+
+class BrokerThread:
+    """A broker serving ``path`` on a loop of its own, as ``runbroker`` would."""
+
+    def __init__(self, path):
+        self.broker = broker.Broker()
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(self.broker.serve(path))
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def snapshot(self):
+        return asyncio.run_coroutine_threadsafe(self._snapshot(), self.loop).result()
+
+    async def _snapshot(self):
+        return self.broker.snapshot()
+
+    def stop(self):
+        async def shutdown():
+            self.server.close()
+            for client in set(self.broker.owners.values()):
+                client.writer.close()
+            await asyncio.sleep(0.05)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class BrokerChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "broker.sock")
+        self.broker = BrokerThread(self.path)
+        self.addCleanup(lambda: self.broker.stop())
+
+    async def until(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not await sync_to_async(condition)():
+            self.assertLess(time.time(), deadline)
+            await asyncio.sleep(0.01)
+
+    async def test_send_and_group_send_between_processes(self):
+        first, second = BrokerChannelLayer(self.path), BrokerChannelLayer(self.path)
+        channel = await second.new_channel()
+        await first.send(channel, {"type": "hello"})
+        self.assertEqual(await asyncio.wait_for(second.receive(channel), 1), {"type": "hello"})
+
+        members = [await first.new_channel(), await second.new_channel()]
+        await first.group_add("room", members[0])
+        await second.group_add("room", members[1])
+        await second.stats()  # round trip: both group_adds have reached the broker
+        await first.group_send("room", {"type": "bid"})
+        self.assertEqual(await asyncio.wait_for(first.receive(members[0]), 1), {"type": "bid"})
+        self.assertEqual(await asyncio.wait_for(second.receive(members[1]), 1), {"type": "bid"})
+        await first.close()
+        await second.close()
+
+    async def test_receiver_resumes_after_a_broker_restart(self):
+        layer, sender = BrokerChannelLayer(self.path), BrokerChannelLayer(self.path)
+        channel = await layer.new_channel()
+        await layer.group_add("room", channel)
+        received = asyncio.ensure_future(layer.receive(channel))
+        await layer.stats()
+        await sender.stats()
+
+        await sync_to_async(self.broker.stop)()
+        self.broker = await sync_to_async(BrokerThread)(self.path)
+        # Reconnected with the same key and its membership
+        await self.until(lambda: self.broker.snapshot()["members"] == 1)
+        await sender.group_send("room", {"type": "bid"})
+        self.assertEqual(await asyncio.wait_for(received, 1), {"type": "bid"})
+        await layer.close()
+        await sender.close()
+
+    async def test_memberships_expire(self):
+        layer = BrokerChannelLayer(self.path, group_expiry=0)
+        channel = await layer.new_channel()
+        await layer.group_add("room", channel)
+        await layer.group_send("room", {"type": "bid"})
+        await layer.stats()
+        self.assertEqual(self.broker.snapshot()["members"], 0)
+        await layer.close()
+
+    def test_connections_close_with_their_loop(self):
+        layer = BrokerChannelLayer(self.path)
+        for _ in range(3):
+            # Each call runs in a new event loop
+            async_to_sync(layer.new_channel)()
+        async_to_sync(self.until)(lambda: self.broker.snapshot()["processes"] == 0)
+        self.assertTrue(all(connection.closed for connection in layer._connections.values()))
+
+
+class ConcurrentBidStressTest(TransactionTestCase):
+    """Thousands of racing bids must never store one below the increment."""
+
+    BIDS = 2000
+    WORKERS = 4
+
+    def test_no_bid_below_increment_is_stored(self):
+        owner = User.objects.create(username="owner")
+        bidders = [User.objects.create(username=f"bidder_{i}") for i in range(self.WORKERS)]
+        # Outside a TestCase transaction the auction-created fan-out thread
+        # starts on commit and competes with the bidders for the SQLite lock
+        with transaction.atomic():
+            item = create_item(owner, start_price=Decimal("1.00"), min_increment=Decimal("0.50"))
+
+        # Amounts are drawn from a narrow band so that most racing bids collide.
+        rng = random.Random(42)
+        amounts = [Decimal(rng.randrange(100, 2000)) / 100 for _ in range(self.BIDS)]
+        start = threading.Barrier(self.WORKERS)
+        accepted = []
+
+        def fire(worker):
+            start.wait()
+            try:
+                for amount in amounts[worker::self.WORKERS]:
+                    while True:
+                        try:
+                            accept_bid(item.id, bidders[worker], amount)
+                            accepted.append(amount)
+                        except BidRejected:
+                            pass
+                        except OperationalError:
+                            # SQLite reports writer contention instead of waiting
+                            time.sleep(0.001)
+                            continue
+                        break
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            list(pool.map(fire, range(self.WORKERS)))
+
+        stored = list(Bid.objects.filter(item=item).order_by("id").values_list("amount", flat=True))
+        self.assertEqual(len(stored), len(accepted))
+        self.assertGreaterEqual(stored[0], item.start_price)
+        for previous, current in zip(stored, stored[1:]):
+            self.assertGreaterEqual(current, previous + item.min_increment)
+
+        item.refresh_from_db()
+        self.assertEqual(item.bid_count, len(stored))
+        self.assertEqual(item.current_price, stored[-1])
+
+        # ...and still reaches every user
+        deadline = time.time() + 10
+        while True:
+            try:
+                job = FanOutJob.objects.get()
+            except OperationalError:
+                # Its own writes lock the table, as they did for the bidders
+                job = None
+            if job is not None and job.status == FanOutJob.Status.DONE:
+                break
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+        self.assertEqual(job.delivered, User.objects.count())
@@ -1,26 +1,61 @@
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from django.http import Http404
 from django_filters import rest_framework as filters
-from .models import Category , Auction , Item
-from .serializers import CategorySerializer,AuctionBasicDetailsSerializer,AuctionSerializer , ItemsSerializer
+from .models import Category , Auction , Item , Bid
+from .serializers import CategorySerializer,AuctionBasicDetailsSerializer,AuctionSerializer , ItemsSerializer , BidBasicSerializer
 from .filters import AuctionFilter
+from .pagination import AmountPagination , AuctionItemPagination , CreatedAtPagination
+from .response_cache import AUCTIONS , CATEGORIES , VersionedListCacheMixin , auctions_ttl
 
-class CategoryView(viewsets.ModelViewSet):
+class CategoryView(VersionedListCacheMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    # The list is cached until a category changes (main.response_cache)
+    cache_scope = CATEGORIES
 
-class AuctionView(viewsets.ModelViewSet):
-    queryset = Auction.objects.all()
+class AuctionView(VersionedListCacheMixin, viewsets.ModelViewSet):
+    queryset = Auction.objects.select_related("category")
     serializer_class = AuctionBasicDetailsSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = AuctionFilter
     lookup_field = "slug"
+    # The list is cached until an auction, item or category changes, or an
+    # auction's status does (main.response_cache)
+    cache_scope = AUCTIONS
+
+    def cache_ttl(self):
+        return auctions_ttl()
+
+    def get_queryset(self):
+        if self.action == "retrieve":
+            # Items, categories and the top bids in a constant number of queries
+            return Auction.objects.with_details().with_status()
+        # item_count and status come from the list query itself
+        return super().get_queryset().with_item_count().with_status()
+
     def get_serializer_class(self):
         if self.action =="retrieve":
             return AuctionSerializer
         return super().get_serializer_class()
 
 class AuctionItemsView(viewsets.ModelViewSet):
-    queryset = Item.objects.filter(is_active=True)
+    queryset = Item.objects.filter(is_active=True).with_bids()
     serializer_class = ItemsSerializer
     lookup_field = "slug"
+    # Newest first, by keyset: no OFFSET however deep the page
+    pagination_class = AuctionItemPagination
+
+    @action(detail=True)
+    def bids(self, request, slug=None):
+        """
+        Bid history of an item, ended ones included: newest first, or
+        highest first with ?order=amount. Keyset-paginated.
+        """
+        item_id = Item.objects.filter(slug=slug).values_list("pk", flat=True).first()
+        if item_id is None:
+            raise Http404
+        paginator = AmountPagination() if request.query_params.get("order") == "amount" else CreatedAtPagination()
+        page = paginator.paginate_queryset(Bid.objects.filter(item_id=item_id).select_related("created_by"), request, self)
+        return paginator.get_paginated_response(BidBasicSerializer(page, many=True).data)
 
@@ -1,4 +1,15 @@
 from django.contrib import admin
-from .models import Notification
+from .models import BroadcastReceipt, FanOutJob, Notification, NotificationReadCursor
 # Register your models here.
-admin.site.register(Notification)
\ No newline at end of file
+admin.site.register(Notification)
+
+
+@admin.register(FanOutJob)
+class FanOutJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'delivered', 'total', 'created_at', 'finished_at')
+    list_filter = ('status', 'category')
+    readonly_fields = ('status', 'total', 'delivered', 'last_user_id', 'error', 'finished_at')
+
+
+admin.site.register(NotificationReadCursor)
+admin.site.register(BroadcastReceipt)
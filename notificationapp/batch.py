@@ -0,0 +1,64 @@
+"""
+Many personal notifications at once.
+
+``create_notifications`` renders and stores unsaved notifications from one
+context resolved by the caller (``notification_context``: title and slug of
+the object they are about, the sender's name), so no row reads its
+``content_object`` or ``sender``. Each category is rendered once, the rows
+go in with ``bulk_create`` and the unread counters with one UPDATE, however
+many recipients there are. ``publish_notifications`` then queues them for
+the recipients with a socket open: one presence lookup, one outbox INSERT.
+"""
+from django.db import transaction
+
+from main.outbox import enqueue_many
+
+from .models import Notification
+from .presence import online_user_ids
+from .unread import add_personal
+
+
+def notification_context(title=None, slug=None, sender_name=None):
+    return {'title': title, 'slug': slug, 'sender_name': sender_name}
+
+
+def create_notifications(notifications, context):
+    """Render the missing contents of ``notifications`` (personal ones) from ``context`` and store them."""
+    rendered = {}
+    for notif in notifications:
+        if not notif.content:
+            if notif.category not in rendered:
+                rendered[notif.category] = notif.generate_content(context)
+            notif.content = rendered[notif.category]
+
+    with transaction.atomic():
+        Notification.objects.bulk_create(notifications)
+        # bulk_create sends no post_save
+        add_personal([notif.user_id for notif in notifications if not notif.is_read], 1)
+    return notifications
+
+
+def realtime_event(notif, context):
+    """The ``send_notification`` message of one notification."""
+    return {
+        # IMPORTANT: 'type' must match the consumer's handler method name (send_notification)
+        'type': 'send_notification',
+        'message': notif.content,
+        'data': {
+            'id': notif.id,
+            'notification_id': notif.id,
+            'category': notif.category,
+            'item_slug': context.get('slug'),
+        },
+    }
+
+
+def publish_notifications(notifications, context):
+    """Push ``notifications``, once the transaction commits, to those of their recipients who are connected."""
+    if not notifications:
+        return
+    online = online_user_ids({notif.user_id for notif in notifications})
+    enqueue_many([
+        (f'user_notifications_{notif.user_id}', realtime_event(notif, context))
+        for notif in notifications if notif.user_id in online
+    ])
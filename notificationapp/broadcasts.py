@@ -0,0 +1,99 @@
+"""
+Fan-out on read.
+
+For categories configured with ``DeliveryMode.FAN_OUT_ON_READ`` a single
+``Notification`` row without a recipient is stored and shared by every user.
+Per-user state lives in ``NotificationReadCursor`` and ``BroadcastReceipt``
+(see ``NotificationQuerySet.unread``/``mark_all_as_read``).
+"""
+from django.db import transaction
+from django.db.models import Min
+
+from main.outbox import enqueue
+
+from .models import BroadcastReceipt, Notification
+from .unread import reset_counters
+
+# Every NotificationConsumer joins this group
+BROADCAST_GROUP = "notifications_broadcast"
+
+
+def create_broadcast(category, content_object=None, sender=None, payload=None):
+    """Store one shared notification and push it to every connected user after commit."""
+    notif = Notification(user=None, category=category, sender=sender)
+    if content_object is not None:
+        notif.content_object = content_object
+    notif.save()  # content rendered once in Notification.save()
+
+    publish_broadcast(notif, payload)
+    return notif
+
+
+def publish_broadcast(notif, payload=None):
+    # Sent once the transaction commits (main.outbox)
+    enqueue(
+        BROADCAST_GROUP,
+        {
+            "type": "send_notification",
+            "message": notif.content,
+            "data": {
+                "notification_id": notif.id,
+                "sender": notif.sender.username if notif.sender else None,
+                "category": notif.category,
+                "created_at": notif.created_at.isoformat(),
+                "broadcast": True,
+                **(payload or {}),
+            },
+        },
+    )
+
+
+def fold_into_broadcasts(category, batch_size=1000, stdout=None):
+    """
+    Migration helper: replace the per-user rows of ``category`` with one
+    broadcast row per related object and content, so rows without an object
+    only fold when they say the same thing. Users who had read their copy get
+    a read receipt. Each object is folded in its own transaction, so the helper
+    can be interrupted and re-run. Returns the number of rows removed.
+    """
+    groups = (
+        Notification.objects.filter(category=category, user__isnull=False)
+        .values('content_type_id', 'object_id', 'content')
+        .annotate(first_sent=Min('created_at'))
+        .order_by('first_sent')
+    )
+    removed = 0
+    for group in groups.iterator():
+        with transaction.atomic():
+            rows = Notification.objects.filter(
+                category=category,
+                user__isnull=False,
+                content_type_id=group['content_type_id'],
+                object_id=group['object_id'],
+                content=group['content'],
+            )
+            first = rows.order_by('created_at').first()
+            broadcast = Notification.objects.create(
+                user=None,
+                sender_id=first.sender_id,
+                category=category,
+                content_type_id=first.content_type_id,
+                object_id=first.object_id,
+                content=first.content,
+            )
+            # created_at is auto_now_add; keep the original send time
+            Notification.objects.filter(pk=broadcast.pk).update(created_at=first.created_at)
+
+            read_by = rows.filter(is_read=True).values_list('user_id', flat=True)
+            BroadcastReceipt.objects.bulk_create(
+                (BroadcastReceipt(user_id=user_id, notification=broadcast) for user_id in read_by.iterator()),
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            deleted, _ = rows.delete()
+            removed += deleted
+        if stdout is not None:
+            stdout.write(f"  {group['content_type_id']}/{group['object_id']}: folded {deleted} rows")
+    # Folded rows move between the personal and broadcast counts
+    reset_counters()
+    return removed
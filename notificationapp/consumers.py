@@ -1,6 +1,42 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
 import json
+from urllib.parse import parse_qs
 from channels.db import database_sync_to_async
+from django.db import transaction
+from main.outbox import attach_loop
+from rooms.presence import presence
+from .broadcasts import BROADCAST_GROUP
+from .models import Notification
+from .presence import socket_closed, socket_opened
+from .unread import unread_count
+
+# Most notifications replayed on reconnect; past that the client reloads its inbox
+REPLAY_LIMIT = 200
+
+
+def replay_since(user, since, limit=REPLAY_LIMIT):
+    """
+    The notifications of ``user`` after id ``since``, oldest first, and
+    whether there are more than ``limit``: one range read of the user's
+    stream (index on user, id), the broadcasts' included.
+    """
+    rows = list(
+        Notification.objects.for_user(user).filter(pk__gt=since)
+        .select_related('sender').order_by('pk')[:limit + 1]
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def unread_and_replay(user, since):
+    """
+    The user's unread count, then (with ``since``) what ``replay_since``
+    returns, read in one transaction: the replayed rows are those the count
+    already has, so they aren't counted again.
+    """
+    with transaction.atomic():
+        unread = unread_count(user)
+        replay = replay_since(user, since) if since is not None else ([], False)
+    return unread, replay
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -19,16 +55,77 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             self.group_name,
             self.channel_name
         )
+        # ...and to the group shared broadcasts are published to
+        await self.channel_layer.group_add(
+            BROADCAST_GROUP,
+            self.channel_name
+        )
+        # Outbox messages for the user are sent on this loop (main.outbox)
+        attach_loop()
 
         await self.accept()
         print(f"User {self.user_id} connected to notifications.")
 
+        # Listed as online from now on, so senders don't skip this user
+        if await database_sync_to_async(socket_opened)(self.user_id, self.channel_name):
+            presence.worker_recreated()
+        presence.hold()
+        self.online = True
+
+        # Reconnecting with ?since=<last notification id seen>: what was
+        # missed meanwhile first, then live delivery (the group messages
+        # queue up until connect returns). The badge is read with the
+        # replay and kept current from here on: +1 per notification pushed,
+        # reset by the unread_count events sent when notifications are read
+        self.replayed_to = 0
+        since = self.since()
+        self.unread, (notifications, more) = await database_sync_to_async(unread_and_replay)(user, since)
+        if since is not None:
+            await self.replay(notifications, more, since)
+        await self.send_unread_count()
+
+    def since(self):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return max(0, int(query['since'][0]))
+        except (KeyError, ValueError):
+            return None
+
+    async def replay(self, notifications, more, since):
+        for notif in notifications:
+            await self.send(text_data=json.dumps({
+                'type': 'send_notification',
+                'message': notif.content,
+                'data': {
+                    'notification_id': notif.id,
+                    'sender': notif.sender.username if notif.sender else None,
+                    'category': notif.category,
+                    'created_at': notif.created_at.isoformat(),
+                    'broadcast': notif.user_id is None,
+                },
+                'replayed': True,
+            }))
+        if notifications:
+            self.replayed_to = notifications[-1].id
+        # ``more``: the client should reload its inbox instead
+        await self.send(text_data=json.dumps({
+            'type': 'replay_done', 'cursor': self.replayed_to or since, 'more': more,
+        }))
+
     async def disconnect(self, close_code):
+        if getattr(self, 'online', False):
+            self.online = False
+            presence.release()
+            await database_sync_to_async(socket_closed)(self.channel_name)
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
+            await self.channel_layer.group_discard(
+                BROADCAST_GROUP,
+                self.channel_name
+            )
         print(f"Disconnected from notifications with code: {close_code}")
 
     # Receive message from the group
@@ -37,9 +134,24 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         Handler for sending notification events to the client.
         The 'event' dict should contain a 'message' key.
         """
+        data = event.get('data', {})
+        notification_id = data.get('notification_id')
+        if notification_id and notification_id <= self.replayed_to:
+            # Sent while the replay was read: already delivered
+            return
+        self.unread += 1
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'type': event['type'], # e.g., 'new_bid', 'auction_end', 'user_joined'
             'message': event['message'],
-            'data': event.get('data', {}) # Optional extra data
-        }))
\ No newline at end of file
+            'data': data, # Optional extra data
+            'unread_count': self.unread,
+        }))
+
+    async def unread_count(self, event):
+        # Sent by notificationapp.unread when notifications were read or dismissed
+        self.unread = event['count']
+        await self.send_unread_count()
+
+    async def send_unread_count(self):
+        await self.send(text_data=json.dumps({'type': 'unread_count', 'count': self.unread}))
\ No newline at end of file
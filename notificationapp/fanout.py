@@ -0,0 +1,212 @@
+"""
+Bulk fan-out of one notification to every user.
+
+Instead of one ``Notification.objects.create`` + ``group_send`` per user inside
+the saving request, a ``FanOutJob`` is recorded and delivered after commit by
+a background thread:
+
+1. users are read by id, a batch at a time after the job's cursor,
+2. the content is rendered once for everybody,
+3. each batch is written with ``bulk_create`` together with the job cursor
+   and its real-time messages, for the users with a notification socket open
+   only (``presence``). The messages go through the outbox (``main.outbox``),
+   so a batch is either stored and pushed, or neither.
+
+The thread starts as soon as the saving transaction commits, typically while
+bids are being written. On SQLite, which has a single writer, a read or write
+of the job that finds the database locked is retried with backoff rather than
+failing the job. A job that fails anyway is marked ``FAILED`` and run again
+by its thread after ``REQUEUE_DELAY`` seconds, up to ``REQUEUE_ATTEMPTS``
+times; past that, ``manage.py resume_fanouts`` picks it up.
+"""
+import logging
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from main.outbox import enqueue_many
+
+from .models import FanOutJob, Notification
+from .presence import online_user_ids
+from .unread import add_personal
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+# Queries that find the database locked: attempts, first pause and its cap (seconds)
+LOCKED_ATTEMPTS = 10
+LOCKED_DELAY = 0.05
+MAX_LOCKED_DELAY = 2
+# Runs of a failed job by its thread, and the pause between them (seconds)
+REQUEUE_ATTEMPTS = 5
+REQUEUE_DELAY = 30
+
+
+def create_fanout_job(category, content_object=None, sender=None, payload=None):
+    """Record a fan-out job, rendering its content once."""
+    preview = Notification(category=category, sender=sender)
+    if content_object is not None:
+        # Assigning the instance fills the GenericForeignKey cache; no query
+        preview.content_object = content_object
+
+    return FanOutJob.objects.create(
+        category=category,
+        sender=sender,
+        content_type=ContentType.objects.get_for_model(content_object) if content_object is not None else None,
+        object_id=content_object.pk if content_object is not None else None,
+        content=preview.generate_content(),
+        payload=payload or {},
+    )
+
+
+def schedule_fanout(job):
+    """Deliver ``job`` in a background thread once the current transaction commits."""
+    transaction.on_commit(lambda: start_fanout_thread(job.pk))
+
+
+def start_fanout_thread(job_id):
+    thread = threading.Thread(target=_run_in_thread, args=(job_id,), daemon=True, name=f"fanout-{job_id}")
+    thread.start()
+    return thread
+
+
+def _run_in_thread(job_id):
+    try:
+        for attempt in range(1, REQUEUE_ATTEMPTS + 1):
+            try:
+                run_fanout(job_id)
+                return
+            except Exception:
+                if attempt == REQUEUE_ATTEMPTS:
+                    logger.exception("Fan-out job %s failed, left for resume_fanouts", job_id)
+                    return
+                logger.exception("Fan-out job %s failed, run again in %ss", job_id, REQUEUE_DELAY)
+            # A fresh connection for the next run
+            connection.close()
+            time.sleep(REQUEUE_DELAY)
+    finally:
+        connection.close()
+
+
+def run_fanout(job_id, batch_size=BATCH_SIZE, on_progress=None):
+    """
+    Deliver (or resume) a fan-out job. Safe to call again after a crash: only
+    users after ``job.last_user_id`` are processed. ``on_progress(job)`` is
+    called after every batch.
+    """
+    try:
+        job = _while_locked(_start_job, job_id)
+        if job.status == FanOutJob.Status.DONE:
+            return job
+        while True:
+            batch = _while_locked(_next_recipients, job, batch_size)
+            if not batch:
+                break
+            if not _while_locked(_deliver_batch, job, batch):
+                # Another runner owns this job now
+                return job
+            if on_progress:
+                on_progress(job)
+
+        job.status = FanOutJob.Status.DONE
+        job.finished_at = timezone.now()
+        _while_locked(job.save, update_fields=['status', 'finished_at', 'updated_at'])
+    except Exception as e:
+        _while_locked(
+            FanOutJob.objects.filter(pk=job_id).update,
+            status=FanOutJob.Status.FAILED, error=str(e), updated_at=timezone.now(),
+        )
+        raise
+    return job
+
+
+def _start_job(job_id):
+    """The job, marked running with its total, unless it is done already."""
+    job = FanOutJob.objects.select_related('sender').get(pk=job_id)
+    if job.status != FanOutJob.Status.DONE:
+        job.status = FanOutJob.Status.RUNNING
+        job.total = job.delivered + User.objects.filter(pk__gt=job.last_user_id).count()
+        job.save(update_fields=['status', 'total', 'updated_at'])
+    return job
+
+
+def _next_recipients(job, batch_size):
+    """The ids of the next ``batch_size`` users after the job's cursor."""
+    return list(
+        User.objects.filter(pk__gt=job.last_user_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+    )
+
+
+def _while_locked(write, *args, **kwargs):
+    """Call ``write``, again after a pause for as long as the database is locked (see above)."""
+    delay = LOCKED_DELAY
+    for attempt in range(1, LOCKED_ATTEMPTS + 1):
+        try:
+            return write(*args, **kwargs)
+        except OperationalError as e:
+            if "locked" not in str(e) or attempt == LOCKED_ATTEMPTS:
+                raise
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_LOCKED_DELAY)
+
+
+def _deliver_batch(job, user_ids):
+    notifications = [
+        Notification(
+            user_id=user_id,
+            sender_id=job.sender_id,
+            category=job.category,
+            content_type_id=job.content_type_id,
+            object_id=job.object_id,
+            content=job.content,
+        )
+        for user_id in user_ids
+    ]
+    with transaction.atomic():
+        # Advancing the cursor is a compare-and-swap, so two runners resuming
+        # the same job can never both deliver a batch.
+        claimed = FanOutJob.objects.filter(pk=job.pk, last_user_id=job.last_user_id).update(
+            last_user_id=user_ids[-1],
+            delivered=F('delivered') + len(user_ids),
+            updated_at=timezone.now(),
+        )
+        if not claimed:
+            return None
+        Notification.objects.bulk_create(notifications, batch_size=len(notifications))
+        # bulk_create sends no post_save
+        add_personal(user_ids, 1)
+        online = online_user_ids(user_ids)
+        enqueue_many([
+            (f"user_notifications_{notif.user_id}", realtime_event(job, notif))
+            for notif in notifications if notif.user_id in online
+        ])
+    job.last_user_id = user_ids[-1]
+    job.delivered += len(user_ids)
+    return notifications
+
+
+def realtime_event(job, notif):
+    """The ``send_notification`` message of one delivered notification."""
+    return {
+        "type": "send_notification",
+        "message": notif.content,
+        "data": {
+            "notification_id": notif.id,
+            "sender": job.sender.username if job.sender else None,
+            "category": notif.category,
+            "created_at": notif.created_at.isoformat(),
+            **job.payload,
+        },
+    }
+
+
+def resume_unfinished(on_progress=None):
+    """Resume every job that was interrupted (pending, running or failed)."""
+    unfinished = FanOutJob.objects.exclude(status=FanOutJob.Status.DONE).order_by('pk')
+    return [run_fanout(job.pk, on_progress=on_progress) for job in unfinished]
@@ -0,0 +1,86 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+
+from main.benchmarking import Stopwatch, scratch_database, seed_auction, seed_users
+from main.models import Auction
+from notificationapp.fanout import create_fanout_job, run_fanout
+from notificationapp.models import Notification, NotificationCategories
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the AUCTION_CREATED fan-out: the old per-user create + "
+        "group_send loop (on a sample, extrapolated) against the batched pipeline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000])
+        parser.add_argument("--legacy-sample", type=int, default=1000,
+                            help="Users the old loop is timed on before extrapolating.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for users in options["users"]:
+            with scratch_database():
+                self.run(users, options["legacy_sample"], options["batch_size"])
+
+    def run(self, users, legacy_sample, batch_size):
+        seeded = seed_users(users)
+        auction = Auction.objects.get(pk=seed_auction(seeded[0])[0].auction_id)
+
+        sample = seeded[:min(legacy_sample, users)]
+        with Stopwatch() as legacy:
+            self.run_legacy(auction, sample)
+        Notification.objects.all().delete()
+        legacy_estimate = legacy.elapsed / len(sample) * users
+
+        job = create_fanout_job(
+            NotificationCategories.AUCTION_CREATED,
+            content_object=auction,
+            sender=auction.created_by,
+            payload={"auction_id": auction.id, "title": auction.title},
+        )
+        with Stopwatch() as pipeline:
+            run_fanout(job.pk, batch_size=batch_size, on_progress=self.progress)
+        self.stdout.write("")
+
+        self.stdout.write(f"users:              {users}")
+        self.stdout.write(f"per-user loop:      {legacy_estimate:8.1f} s (extrapolated from {len(sample)})")
+        self.stdout.write(f"batched pipeline:   {pipeline.elapsed:8.1f} s "
+                          f"({users / pipeline.elapsed:,.0f} notifications/sec)")
+        self.stdout.write(f"speed-up:           {legacy_estimate / pipeline.elapsed:8.1f}x")
+        self.stdout.write(f"stored:             {Notification.objects.count()}")
+
+    def progress(self, job):
+        self.stdout.write(f"\r  delivered {job.delivered}/{job.total} ({job.progress:.0%})", ending="")
+        self.stdout.flush()
+
+    def run_legacy(self, auction, users):
+        # The loop notify_all_users_on_auction_create used to run in the request
+        channel_layer = get_channel_layer()
+        auction_ct = ContentType.objects.get_for_model(Auction)
+        for user in users:
+            notif = Notification.objects.create(
+                user=user,
+                sender=auction.created_by,
+                category=NotificationCategories.AUCTION_CREATED,
+                content_type=auction_ct,
+                object_id=auction.id,
+            )
+            async_to_sync(channel_layer.group_send)(
+                f"user_notifications_{user.id}",
+                {
+                    "type": "send_notification",
+                    "message": notif.content,
+                    "data": {
+                        "notification_id": notif.id,
+                        "auction_id": auction.id,
+                        "title": auction.title,
+                        "sender": auction.created_by.username,
+                        "category": notif.category,
+                        "created_at": notif.created_at.isoformat(),
+                    },
+                },
+            )
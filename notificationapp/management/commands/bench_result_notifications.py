@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from main.benchmarking import Stopwatch, scratch_database, seed_auction, seed_users
+from main.models import AuctionResult, Bid, Item
+from notificationapp.models import Notification, NotificationCategories
+from notificationapp.signals import send_realtime_notification
+
+
+class Command(BaseCommand):
+    help = (
+        "Finalize one item per participant count and report the queries and time "
+        "the AuctionResult notifications take: the old per-participant loop "
+        "against the batched rendering (notificationapp.batch)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--participants", type=int, nargs="+", default=[10, 100, 1000])
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            for participants in options["participants"]:
+                legacy = self.measure(participants, self.run_legacy)
+                batched = self.measure(participants, None)
+                self.stdout.write(
+                    f"{participants:>6} participants: per-participant loop {legacy[0]:>6} queries "
+                    f"{legacy[1] * 1000:8.1f} ms, batched {batched[0]:>4} queries {batched[1] * 1000:8.1f} ms"
+                )
+        # SQLite caps a statement at 999 parameters: Django splits the
+        # bulk INSERT every ~110 rows there, into one statement elsewhere
+        self.stdout.write(f"(database: {connection.vendor})")
+
+    def measure(self, participants, legacy):
+        """Finalize a fresh item; returns (queries, seconds)."""
+        users = seed_users(participants + 1, prefix=f"bench_result_{participants}_{bool(legacy)}")
+        owner, bidders = users[0], users[1:]
+        item, = seed_auction(owner)
+        Bid.objects.bulk_create(
+            [Bid(item=item, created_by=user, amount=Decimal(10 + n)) for n, user in enumerate(bidders)],
+            batch_size=1000,
+        )
+        top = Bid.objects.filter(item=item).order_by("-amount").first()
+        result = AuctionResult(item=item, winner=top.created_by, winning_bid=top)
+        # The query log keeps 9000 entries at most
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as ctx, Stopwatch() as sw:
+            if legacy:
+                # Saved without post_save, then notified the old way
+                AuctionResult.objects.bulk_create([result])
+                legacy(result)
+            else:
+                result.save()
+        return len(ctx.captured_queries), sw.elapsed
+
+    def run_legacy(self, result):
+        # The loop handle_auction_result used to run
+        item = Item.objects.get(pk=result.item_id)
+        participants = Bid.objects.filter(item=item).values_list("created_by", flat=True).distinct()
+        for user_id in list(participants):
+            if user_id == result.winner.id:
+                category = NotificationCategories.AUCTION_WON
+                content = f"🎉 **Congratulations!** You won the bid for **{item.title}**!"
+            else:
+                category = NotificationCategories.AUCTION_OUTBID
+                content = f"😔 You did not win the bid for **{item.title}**."
+            notif = Notification.objects.create(
+                user_id=user_id,
+                sender=item.auction.created_by,
+                category=category,
+                content=content,
+                content_type=ContentType.objects.get_for_model(item),
+                object_id=item.pk,
+            )
+            # Fresh instance: the GenericForeignKey is read again, as it was
+            send_realtime_notification(user_id, Notification.objects.get(pk=notif.pk))
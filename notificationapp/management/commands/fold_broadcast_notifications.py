@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from notificationapp.broadcasts import fold_into_broadcasts
+from notificationapp.models import NotificationCategories
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold existing per-user notifications of a broadcast category into single "
+        "shared rows (fan-out on read) with per-user read receipts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("categories", nargs="*", help="Defaults to every category configured for fan-out on read.")
+
+    def handle(self, *args, **options):
+        categories = options["categories"] or [c.value for c in NotificationCategories if c.is_broadcast()]
+        if not categories:
+            raise CommandError("No category is configured for fan-out on read (NOTIFICATION_DELIVERY_MODES).")
+
+        for value in categories:
+            try:
+                category = NotificationCategories(value)
+            except ValueError:
+                raise CommandError(f"Unknown notification category: {value}")
+            self.stdout.write(f"Folding {category.value} notifications...")
+            removed = fold_into_broadcasts(category, stdout=self.stdout)
+            self.stdout.write(f"Removed {removed} per-user rows.")
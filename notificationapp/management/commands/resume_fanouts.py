@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from notificationapp.fanout import resume_unfinished
+
+
+class Command(BaseCommand):
+    help = "Resume notification fan-out jobs interrupted by a restart or a failure."
+
+    def handle(self, *args, **options):
+        jobs = resume_unfinished(on_progress=self.progress)
+        for job in jobs:
+            self.stdout.write(f"{job}: {job.get_status_display()}")
+        if not jobs:
+            self.stdout.write("No unfinished fan-out jobs.")
+
+    def progress(self, job):
+        self.stdout.write(f"  job {job.pk}: {job.delivered}/{job.total} ({job.progress:.0%})")
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.25 on 2026-10-18 04:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('rooms', '0001_presence'),
+        ('notificationapp', '0005_unread_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationSocket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'id'], name='notif_user_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='notificationsocket',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_sockets', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='notificationsocket',
+            name='worker',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_sockets', to='rooms.presenceworker'),
+        ),
+    ]
@@ -1,7 +1,11 @@
-from django.db import models
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import Case, Exists, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
 User = get_user_model()
 
@@ -9,17 +13,123 @@ User = get_user_model()
 
 class NotificationQuerySet(models.QuerySet):
     """Custom QuerySet to add common notification queries."""
-    def unread(self):
-        """Returns all unread notifications."""
-        return self.filter(is_read=False)
+    def unread(self, user=None):
+        """
+        Returns all unread notifications. Given a ``user``, returns that user's
+        unread notifications: personal rows merged with the broadcasts newer
+        than their read cursor that they haven't read or dismissed one by one.
+        """
+        if user is None:
+            return self.filter(is_read=False)
+        personal = Q(user=user, is_read=False)
+        broadcasts = Q(user__isnull=True, created_at__gt=_read_until(user)) & ~Q(
+            pk__in=BroadcastReceipt.objects.filter(user=user).values('notification_id')
+        )
+        return self.filter(personal | broadcasts)
 
     def read(self):
         """Returns all read notifications."""
         return self.filter(is_read=True)
+
+    def for_user(self, user):
+        """Everything ``user`` can see: personal rows plus broadcasts since they joined, minus dismissed ones."""
+        broadcasts = Q(user__isnull=True, created_at__gt=user.date_joined) & ~Q(
+            pk__in=BroadcastReceipt.objects.filter(user=user, is_dismissed=True).values('notification_id')
+        )
+        return self.filter(Q(user=user) | broadcasts)
+
+    def broadcasts(self):
+        """Returns the shared rows of fan-out-on-read categories."""
+        return self.filter(user__isnull=True)
+
+    def with_read_state(self, user):
+        """Annotate ``read``: ``is_read`` for personal rows, the cursor and receipts for broadcasts."""
+        receipt = BroadcastReceipt.objects.filter(user=user, is_dismissed=False, notification=OuterRef('pk'))
+        return self.annotate(read=Case(
+            When(user__isnull=False, then=F('is_read')),
+            When(Q(created_at__lte=_read_until(user)) | Exists(receipt), then=Value(True)),
+            default=Value(False),
+            output_field=models.BooleanField(),
+        ))
     
     def mark_all_as_read(self, user):
-        """Marks all unread notifications for a specific user as read."""
-        return self.filter(user=user, is_read=False).update(is_read=True)
+        """
+        Marks all unread notifications for a specific user as read. Broadcasts
+        are covered by moving the user's read cursor instead of touching rows.
+        """
+        from .unread import publish_unread, see_all_broadcasts
+
+        now = timezone.now()
+        unread_broadcasts = self.unread(user).filter(user__isnull=True).count()
+        updated = self.filter(user=user, is_read=False).update(is_read=True)
+        NotificationReadCursor.objects.update_or_create(user=user, defaults={'read_until': now})
+        # Receipts behind the cursor carry no information any more
+        BroadcastReceipt.objects.filter(
+            user=user, is_dismissed=False, notification__created_at__lte=now
+        ).delete()
+        see_all_broadcasts(user.pk)
+        publish_unread(user)
+        return updated + unread_broadcasts
+
+    def mark_as_read(self, user):
+        """Marks the notifications in this queryset as read for ``user``."""
+        from .unread import add_personal, publish_unread, see_broadcasts
+
+        updated = self.filter(user=user, is_read=False).update(is_read=True)
+        receipts = _add_read_receipts(self.unread(user).filter(user__isnull=True), user)
+        add_personal([user.pk], -updated)
+        see_broadcasts(user.pk, receipts)
+        if updated or receipts:
+            publish_unread(user)
+        return updated + receipts
+
+    def dismiss(self, user):
+        """Hides the notifications in this queryset from ``user``."""
+        from .unread import add_personal, publish_unread, see_broadcasts
+
+        # What was still unread comes off the user's count
+        unread_personal = self.filter(user=user, is_read=False).count()
+        unread_broadcasts = self.unread(user).filter(user__isnull=True).count()
+        deleted, _ = self.filter(user=user).delete()
+        broadcast_ids = list(self.filter(user__isnull=True).values_list('pk', flat=True))
+        BroadcastReceipt.objects.bulk_create(
+            [BroadcastReceipt(user=user, notification_id=pk, is_dismissed=True) for pk in broadcast_ids],
+            update_conflicts=True,
+            update_fields=['is_dismissed'],
+            unique_fields=['user', 'notification'],
+        )
+        add_personal([user.pk], -unread_personal)
+        see_broadcasts(user.pk, unread_broadcasts)
+        if unread_personal or unread_broadcasts:
+            publish_unread(user)
+        return deleted + len(broadcast_ids)
+
+
+def _add_read_receipts(broadcasts, user):
+    """
+    Give ``user`` a read receipt for each of ``broadcasts``; returns how many
+    were added. One INSERT ... SELECT: a receipt added meanwhile by a
+    concurrent read is skipped and not counted twice.
+    """
+    connection = connections[broadcasts.db]
+    select, params = broadcasts.order_by().values('pk').query.sql_with_params()
+    table = connection.ops.quote_name(BroadcastReceipt._meta.db_table)
+    with connection.cursor() as cursor:
+        # "WHERE true" keeps SQLite from reading ON CONFLICT as a join constraint
+        cursor.execute(
+            f"INSERT INTO {table} (user_id, notification_id, is_dismissed, created_at) "
+            f"SELECT %s, broadcast.id, %s, %s FROM ({select}) broadcast WHERE true "
+            f"ON CONFLICT (user_id, notification_id) DO NOTHING",
+            (user.pk, False, connection.ops.adapt_datetimefield_value(timezone.now()), *params),
+        )
+        return cursor.rowcount
+
+
+def _read_until(user):
+    """SQL expression for the moment up to which ``user`` has read all broadcasts."""
+    cursor = NotificationReadCursor.objects.filter(user=user).values('read_until')[:1]
+    return Coalesce(Subquery(cursor), Value(user.date_joined))
+
 
 class NotificationManager(models.Manager):
     """Custom Manager to inject the custom QuerySet."""
@@ -27,12 +137,28 @@ class NotificationManager(models.Manager):
         return NotificationQuerySet(self.model, using=self._db)
     
     # Expose custom methods on the Manager as well
-    def unread(self):
-        # Usage : Notification.objects.unread()
-        return self.get_queryset().unread()
+    def unread(self, user=None):
+        # Usage : Notification.objects.unread() / Notification.objects.unread(user)
+        return self.get_queryset().unread(user)
+
+    def for_user(self, user):
+        return self.get_queryset().for_user(user)
+
+    def broadcasts(self):
+        return self.get_queryset().broadcasts()
+
+    def mark_all_as_read(self, user):
+        return self.get_queryset().mark_all_as_read(user)
 
 # --- Notification Categories ---
 
+class DeliveryMode(models.TextChoices):
+    # One row per recipient, written when the notification is sent
+    FAN_OUT_ON_WRITE = 'write', "Fan-out on write"
+    # One shared row; each user only keeps a read cursor and receipts
+    FAN_OUT_ON_READ = 'read', "Fan-out on read"
+
+
 class NotificationCategories(models.TextChoices):
     # Group: AUCTION ACTIVITY
     AUCTION_JOINED = 'ROOM_JOINED', "Joined Bidding Room"
@@ -50,6 +176,20 @@ class NotificationCategories(models.TextChoices):
             return 'AUCTION_ACTIVITY'
         return 'GENERAL_ALERT'
 
+    def get_delivery_mode(self):
+        """
+        How notifications of this category are stored. Categories sent to every
+        user can be switched to fan-out on read in
+        ``settings.NOTIFICATION_DELIVERY_MODES``; the others always fan out on write.
+        """
+        if self not in [self.AUCTION_CREATED, self.SYSTEM_UPDATE]:
+            return DeliveryMode.FAN_OUT_ON_WRITE
+        modes = getattr(settings, 'NOTIFICATION_DELIVERY_MODES', {})
+        return DeliveryMode(modes.get(self.value, DeliveryMode.FAN_OUT_ON_WRITE))
+
+    def is_broadcast(self):
+        return self.get_delivery_mode() == DeliveryMode.FAN_OUT_ON_READ
+
 # --- Notification Model ---
 
 class Notification(models.Model):
@@ -60,8 +200,11 @@ class Notification(models.Model):
     user = models.ForeignKey(
         User, 
         on_delete=models.CASCADE, 
+        null=True,
+        blank=True,
         related_name='notifications_received',
-        verbose_name="Recipient"
+        verbose_name="Recipient",
+        help_text="Empty for broadcasts, which are shared by every user."
     ) 
     
     # The entity that CAUSED the notification (e.g., the user who joined, the admin)
@@ -115,31 +258,60 @@ class Notification(models.Model):
         ordering = ['-created_at']
         verbose_name = "Notification"
         verbose_name_plural = "Notifications"
+        indexes = [
+            # A user's inbox, newest first (user IS NULL: the broadcasts)
+            models.Index(fields=['user', '-created_at'], name='notif_user_created_idx'),
+            # A user's stream by id (replay on reconnect, NotificationConsumer)
+            models.Index(fields=['user', 'id'], name='notif_user_id_idx'),
+            # A user's unread notifications only (the badge and "mark all as read")
+            models.Index(
+                fields=['user', '-created_at'], name='notif_user_unread_idx',
+                condition=Q(is_read=False),
+            ),
+        ]
 
     def __str__(self):
+        if self.is_broadcast:
+            return f"Broadcast ({self.get_category_display()})"
         return f"Notif for {self.user.username} ({self.get_category_display()})"
+
+    @property
+    def is_broadcast(self):
+        return self.user_id is None
     
     # --- Content Generation and Save Override ---
     
-    def generate_content(self):
-        """Generates the notification content based on category and related objects."""
+    def render_context(self):
+        """
+        What the content is rendered from: the related object's title and
+        slug, the sender's name. Reads ``content_object`` and ``sender``
+        (queries, unless cached); callers that already know these values
+        pass them to ``generate_content`` instead.
+        """
+        content_object = self.content_object
+        return {
+            'title': getattr(content_object, 'title', None),
+            'slug': getattr(content_object, 'slug', None),
+            'sender_name': self.sender.username if self.sender_id else None,
+        }
+
+    def generate_content(self, context=None):
+        """Generates the notification content based on category and ``context`` (``render_context()``)."""
+        if context is None:
+            context = self.render_context()
         category_display = self.get_category_display()
         
-        # You'll need access to the related object (content_object) or sender for richer messages.
-        sender_name = self.sender.username if self.sender else 'System'
+        sender_name = context.get('sender_name') or 'System'
+        title = context.get('title')
         
         if self.category == NotificationCategories.AUCTION_CREATED:
-            # Assumes content_object is the Auction model
-            auction_title = getattr(self.content_object, 'title', 'an item') if self.content_object else 'an auction'
-            return f"**{auction_title}** has been created!"
+            return f"**{title or 'an auction'}** has been created!"
         
         elif self.category == NotificationCategories.AUCTION_JOINED: 
             return f"**{sender_name}** {category_display}."
         
         elif self.category == NotificationCategories.AUCTION_OUTBID:
-            # Assumes content_object is the Auction model
-            auction_title = getattr(self.content_object, 'title', 'an auction') if self.content_object else 'your item'
-            return f"You have been **outbid** on **{auction_title}**!"
+            return f"You have been **outbid** on **{title or 'your item'}**!"
         
         elif self.category == NotificationCategories.SYSTEM_UPDATE: 
             return f"{category_display}: Check out the latest changes!"
@@ -154,4 +326,122 @@ class Notification(models.Model):
         if not self.pk and not self.content:
             self.content = self.generate_content()
         
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+# --- Fan-out on read: per-user state for broadcasts ---
+
+class NotificationReadCursor(models.Model):
+    """Every broadcast created up to ``read_until`` counts as read for ``user``."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_cursor')
+    read_until = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user} read broadcasts until {self.read_until}"
+
+
+class BroadcastReceipt(models.Model):
+    """A user's read (or dismissed) mark on one broadcast newer than their cursor."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='broadcast_receipts')
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='receipts')
+    is_dismissed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'notification'], name='unique_broadcast_receipt'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {'dismissed' if self.is_dismissed else 'read'} {self.notification_id}"
+
+
+# --- Unread counts (see notificationapp.unread) ---
+
+class UnreadCounter(models.Model):
+    """
+    A user's unread count, kept current so the badge is a primary-key
+    lookup: ``personal`` unread rows, plus the broadcasts sent
+    (``BroadcastCounter.sent``) minus the ``broadcasts_seen`` ones.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter')
+    personal = models.IntegerField(default=0)
+    broadcasts_seen = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.personal} unread + broadcasts after {self.broadcasts_seen}"
+
+
+class BroadcastCounter(models.Model):
+    """How many broadcasts were ever sent (a single row)."""
+    sent = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.sent} broadcasts sent"
+
+
+# --- Live sockets (see notificationapp.presence) ---
+
+class NotificationSocket(models.Model):
+    """A connected NotificationConsumer, so senders can skip users who have none."""
+    worker = models.ForeignKey('rooms.PresenceWorker', on_delete=models.CASCADE, related_name='notification_sockets')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_sockets')
+    channel_name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return f"{self.user_id} on {self.channel_name}"
+
+
+# --- Bulk fan-out jobs ---
+
+class FanOutJob(models.Model):
+    """
+    One notification broadcast to every user, delivered in batches off the
+    request path (see notificationapp.fanout). ``last_user_id`` is advanced in
+    the same transaction as each batch, so an interrupted job can be resumed
+    without duplicating or skipping anyone.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', "Pending"
+        RUNNING = 'RUNNING', "Running"
+        DONE = 'DONE', "Done"
+        FAILED = 'FAILED', "Failed"
+
+    category = models.CharField(max_length=50, choices=NotificationCategories.choices)
+    sender = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='fanout_jobs',
+    )
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    content_object = GenericForeignKey('content_type', 'object_id')
+
+    # Rendered once for all recipients
+    content = models.CharField(max_length=255, blank=True, null=True)
+    # Extra data sent along with each real-time message
+    payload = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    total = models.PositiveIntegerField(default=0)
+    delivered = models.PositiveIntegerField(default=0)
+    last_user_id = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_category_display()} fan-out ({self.delivered}/{self.total})"
+
+    @property
+    def progress(self):
+        """Share of recipients delivered so far, between 0 and 1."""
+        if not self.total:
+            return 1.0 if self.status == self.Status.DONE else 0.0
+        return min(1.0, self.delivered / self.total)
@@ -0,0 +1,47 @@
+"""
+Who has a notification socket open.
+
+Each ``NotificationConsumer`` writes a ``NotificationSocket`` row on connect
+and deletes it on disconnect, under the process's ``PresenceWorker`` (see
+``rooms.presence``), whose heartbeat the tracker keeps refreshing while the
+process holds sockets. Senders look the recipients up in one query and skip
+the channel-layer sends of users who aren't connected: they will read the
+notification from their inbox, or have it replayed on reconnect. A worker
+that dies takes its rows with it once its heartbeat goes stale.
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from rooms.presence import presence, presence_option
+
+from .models import NotificationSocket
+
+
+def socket_opened(user_id, channel_name):
+    """
+    List the socket as online. Returns whether the worker's row had to be
+    created again (see ``PresenceTracker.worker_recreated``).
+    """
+    # The row is written right away (not on the next tick): a notification
+    # created in between must not be skipped
+    worker, recreated = presence.heartbeat()
+    NotificationSocket.objects.update_or_create(
+        channel_name=channel_name, defaults={'worker': worker, 'user_id': user_id},
+    )
+    return recreated
+
+
+def socket_closed(channel_name):
+    NotificationSocket.objects.filter(channel_name=channel_name).delete()
+
+
+def online_user_ids(user_ids, now=None):
+    """The ids of ``user_ids`` with a notification socket on a live worker."""
+    now = now or timezone.now()
+    stale_after = timedelta(seconds=presence_option('STALE_AFTER'))
+    return set(
+        NotificationSocket.objects.filter(user_id__in=user_ids, worker__seen_at__gte=now - stale_after)
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
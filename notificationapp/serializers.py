@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+from .models import Notification
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    sender = serializers.CharField(source="sender.username", default=None)
+    # Per user for broadcasts (NotificationQuerySet.with_read_state)
+    is_read = serializers.BooleanField(source="read", read_only=True)
+
+    class Meta:
+        model = Notification
+        fields = ["id", "category", "content", "sender", "is_read", "created_at"]
@@ -2,119 +2,113 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
-from main.models import Auction, AuctionResult, Bid 
+from main.models import Auction, AuctionResult, Bid, Item
+from main.outbox import enqueue
 from notificationapp.models import Notification, NotificationCategories
+from notificationapp.fanout import create_fanout_job, schedule_fanout
+from notificationapp.broadcasts import create_broadcast
+from notificationapp.batch import create_notifications, notification_context, publish_notifications, realtime_event
+from notificationapp.unread import add_personal, broadcast_sent
 
 User = get_user_model()
 
+@receiver(post_save, sender=Notification)
+def count_unread(sender, instance, created, **kwargs):
+    # Keeps the badge counters current (see notificationapp.unread)
+    if not created:
+        return
+    if instance.user_id is None:
+        broadcast_sent()
+    elif not instance.is_read:
+        add_personal([instance.user_id], 1)
+
+
 @receiver(post_save, sender=Auction)
 def notify_all_users_on_auction_create(sender, instance, created, **kwargs):
     if not created:
         return
 
-    channel_layer = get_channel_layer()
-    auction_ct = ContentType.objects.get_for_model(Auction)
-    all_users = User.objects.all()
-
-    for user in all_users:
-        # --------------------------------------
-        # 1) Create notification for this user
-        # --------------------------------------
-        notif = Notification.objects.create(
-            user=user,
-            sender=instance.created_by,
-            category=NotificationCategories.AUCTION_CREATED,
-            content_type=auction_ct,
-            object_id=instance.id,
-        )
-        # content auto-generated in model.save()
-
-        # --------------------------------------
-        # 2) Send WebSocket message to this user
-        # --------------------------------------
-        async_to_sync(channel_layer.group_send)(
-            f"user_notifications_{user.id}",
-            {
-                "type": "send_notification",
-                "message": notif.content,  # use the generated message
-                "data": {
-                    "notification_id": notif.id,
-                    "auction_id": instance.id,
-                    "title": instance.title,
-                    "sender": instance.created_by.username,
-                    "category": notif.category,
-                    "created_at": notif.created_at.isoformat(),
-                }
-            }
-        )
+    category = NotificationCategories.AUCTION_CREATED
+    payload = {
+        "auction_id": instance.id,
+        "title": instance.title,
+    }
+
+    # Fan-out on read: a single shared row, no per-user work at all
+    if category.is_broadcast():
+        create_broadcast(category, content_object=instance, sender=instance.created_by, payload=payload)
+        return
+
+    # Rendered once and delivered to every user in batches by a background
+    # thread after commit (see notificationapp.fanout), not in this request.
+    job = create_fanout_job(
+        category,
+        content_object=instance,
+        sender=instance.created_by,
+        payload=payload,
+    )
+    schedule_fanout(job)
 
 
 @receiver(post_save, sender=AuctionResult)
 def handle_auction_result(sender, instance, created, **kwargs):
     """
     Handles actions after an AuctionResult is created (i.e., an item is finalized).
-    It sends notifications to all participants (winner and losers).
+    It sends notifications to all participants (winner and losers): a fixed
+    number of queries, however many they are (see notificationapp.batch).
     """
     if not created:
         # Only run this logic when the AuctionResult is first created, not on update.
         return
 
-    # 1. Gather all participants and the item details
+    # 1. Gather all participants and the item details, resolved once for every notification
     result = instance
-    item = result.item
-    winner = result.winner
-    
+    item = Item.objects.filter(pk=result.item_id).values(
+        'title', 'slug', 'auction__created_by_id', 'auction__created_by__username',
+    ).get()
+    context = notification_context(
+        title=item['title'], slug=item['slug'], sender_name=item['auction__created_by__username'],
+    )
+
     # Get all unique users who placed a bid on this item
-    participant_ids = Bid.objects.filter(item=item).values_list('created_by', flat=True).distinct()
-    
-    participants = list(participant_ids)
-    
-    # Send a separate notification and real-time alert to each participant
+    participants = Bid.objects.filter(item_id=result.item_id).values_list('created_by', flat=True).distinct()
+
+    # A separate notification for each participant
+    item_type = ContentType.objects.get_for_model(Item)
+    notifications = []
     for user_id in participants:
-        is_winner = (user_id == winner.id)
-        
-        if is_winner:
+        if user_id == result.winner_id:
             category = NotificationCategories.AUCTION_WON
-            message_content = f"🎉 **Congratulations!** You won the bid for **{item.title}**!"
+            message_content = f"🎉 **Congratulations!** You won the bid for **{item['title']}**!"
         else:
             category = NotificationCategories.AUCTION_OUTBID # Re-using OUTBID for simplicity, or add a new 'AUCTION_LOST'
-            message_content = f"😔 You did not win the bid for **{item.title}**."
+            message_content = f"😔 You did not win the bid for **{item['title']}**."
 
-        # 2. Create the Notification object in the database
-        notif = Notification.objects.create(
+        notifications.append(Notification(
             user_id=user_id,
-            sender=item.auction.created_by, # The user who created the auction (or leave null)
+            sender_id=item['auction__created_by_id'], # The user who created the auction
             category=category,
             content=message_content,
-            # Use Generic Foreign Key to link to the Item
-            content_object=item 
-        )
+            # Generic Foreign Key to the Item
+            content_type=item_type,
+            object_id=result.item_id,
+        ))
 
-        # 3. Send real-time alert via Channels
-        send_realtime_notification(user_id, notif)
+    # 2. Create the Notification objects in the database, 3. real-time alerts via Channels
+    create_notifications(notifications, context)
+    publish_notifications(notifications, context)
 
 
-def send_realtime_notification(user_id, notification_instance: Notification):
+def send_realtime_notification(user_id, notification_instance: Notification, context=None):
     """
     Helper function to send a message to the user's private Channels group.
+    Pass ``context`` (``notification_context``) to spare the related object lookup.
     """
-    channel_layer = get_channel_layer()
+    if context is None:
+        context = notification_instance.render_context()
     group_name = f'user_notifications_{user_id}'
 
-    # Use async_to_sync since signals run synchronously
-    async_to_sync(channel_layer.group_send)(
-        group_name,
-        {
-            # IMPORTANT: 'type' must match the consumer's handler method name (send_notification)
-            'type': 'send_notification', 
-            'message': notification_instance.content,
-            'data': {
-                'id': notification_instance.id,
-                'category': notification_instance.category,
-                'item_slug': notification_instance.content_object.slug if notification_instance.content_object else None
-            }
-        }
-    )
\ No newline at end of file
+    # Through the outbox: sent by its dispatcher once the transaction commits,
+    # not from the saving request's thread
+    enqueue(group_name, realtime_event(notification_instance, context))
@@ -1,3 +1,409 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from main.benchmarking import seed_auction, seed_users
+from main.models import Auction, AuctionResult, Bid, Category, OutboxMessage
+from rooms.presence import presence
+from .broadcasts import fold_into_broadcasts
+from .consumers import replay_since
+from . import fanout
+from .fanout import run_fanout
+from .models import (
+    BroadcastReceipt, FanOutJob, Notification, NotificationCategories, NotificationSocket, UnreadCounter,
+    _add_read_receipts,
+)
+from .presence import online_user_ids
+from .routing import websocket_urlpatterns
+from .unread import recount
+
+User = get_user_model()
+
+
+def create_auction(owner, title="Vintage cars"):
+    now = timezone.now()
+    category, _ = Category.objects.get_or_create(name="Cars", defaults={"slug": "cars"})
+    return Auction.objects.create(
+        title=title,
+        entry_fee=Decimal("0.00"),
+        start_date=now,
+        end_date=now + timedelta(days=1),
+        created_by=owner,
+        category=category,
+    )
+
+
+class AuctionCreatedFanOutTests(TestCase):
+    def setUp(self):
+        User.objects.bulk_create([User(username=f"user_{i}") for i in range(25)])
+        self.owner = User.objects.first()
+
+    def create_job(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            create_auction(self.owner)
+        # The fan-out, and the list cache bumps of the new category and auction (main.signals)
+        self.assertEqual(len(callbacks), 3)
+        return FanOutJob.objects.get()
+
+    def test_auction_save_only_records_a_job(self):
+        job = self.create_job()
+        self.assertEqual(Notification.objects.count(), 0)
+        self.assertEqual(job.status, FanOutJob.Status.PENDING)
+        self.assertEqual(job.content, "**Vintage cars** has been created!")
+
+    def test_delivers_to_every_user_once(self):
+        job = self.create_job()
+        run_fanout(job.pk, batch_size=10)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, FanOutJob.Status.DONE)
+        self.assertEqual(job.delivered, 25)
+        self.assertEqual(
+            sorted(Notification.objects.values_list("user_id", flat=True)),
+            sorted(User.objects.values_list("pk", flat=True)),
+        )
+        self.assertFalse(Notification.objects.exclude(category=NotificationCategories.AUCTION_CREATED).exists())
+
+    def test_resume_after_interruption(self):
+        job = self.create_job()
+        batches = []
+
+        def enqueue_many(messages):
+            batches.append(messages)
+            if len(batches) == 3:
+                raise RuntimeError("database gone")
+
+        with mock.patch("notificationapp.fanout.enqueue_many", side_effect=enqueue_many):
+            with self.assertRaises(RuntimeError):
+                run_fanout(job.pk, batch_size=10)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, FanOutJob.Status.FAILED)
+        self.assertEqual(job.delivered, 20)
+
+        run_fanout(job.pk, batch_size=10)
+        job.refresh_from_db()
+        self.assertEqual(job.status, FanOutJob.Status.DONE)
+        self.assertEqual(Notification.objects.count(), 25)
+        self.assertEqual(Notification.objects.values("user_id").distinct().count(), 25)
+
+    def test_locked_batch_is_retried(self):
+        job = self.create_job()
+        deliver_batch = fanout._deliver_batch
+        calls = []
+
+        def locked_once(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise OperationalError("database is locked")
+            return deliver_batch(*args)
+
+        with mock.patch("notificationapp.fanout._deliver_batch", side_effect=locked_once), \
+                mock.patch("notificationapp.fanout.LOCKED_DELAY", 0):
+            run_fanout(job.pk, batch_size=10)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.delivered, len(calls)), (FanOutJob.Status.DONE, 25, 4))
+
+    def test_locked_reads_are_retried(self):
+        job = self.create_job()
+        start_job, next_recipients = fanout._start_job, fanout._next_recipients
+        locked = []
+
+        def locked_once(read):
+            def call(*args):
+                if read not in locked:
+                    locked.append(read)
+                    raise OperationalError("database table is locked: notificationapp_fanoutjob")
+                return read(*args)
+            return call
+
+        with mock.patch("notificationapp.fanout._start_job", side_effect=locked_once(start_job)), \
+                mock.patch("notificationapp.fanout._next_recipients", side_effect=locked_once(next_recipients)), \
+                mock.patch("notificationapp.fanout.LOCKED_DELAY", 0):
+            run_fanout(job.pk, batch_size=10)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.delivered, job.total), (FanOutJob.Status.DONE, 25, 25))
+        self.assertEqual(locked, [start_job, next_recipients])
+
+    def test_failed_job_is_run_again(self):
+        job = self.create_job()
+        runs = []
+
+        def fails_once(job_id):
+            runs.append(job_id)
+            if len(runs) == 1:
+                FanOutJob.objects.filter(pk=job_id).update(status=FanOutJob.Status.FAILED)
+                raise OperationalError("database table is locked")
+            return run_fanout(job_id)
+
+        with mock.patch("notificationapp.fanout.run_fanout", side_effect=fails_once), \
+                mock.patch("notificationapp.fanout.REQUEUE_DELAY", 0), \
+                mock.patch("notificationapp.fanout.connection"), \
+                self.assertLogs("notificationapp.fanout", "ERROR") as logs:
+            fanout._run_in_thread(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, len(runs)), (FanOutJob.Status.DONE, 2))
+        self.assertIn(f"Fan-out job {job.pk} failed, run again", logs.output[0])
+
+
+@override_settings(NOTIFICATION_DELIVERY_MODES={"AUCTION_CREATED": "read"})
+class FanOutOnReadTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.alice = User.objects.create(username="alice")
+        self.bob = User.objects.create(username="bob")
+
+    def test_broadcast_stores_a_single_row(self):
+        create_auction(self.owner)
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertTrue(Notification.objects.get().is_broadcast)
+        self.assertFalse(FanOutJob.objects.exists())
+
+    def test_unread_merges_personal_and_broadcast_rows(self):
+        create_auction(self.owner)
+        Notification.objects.create(user=self.alice, category=NotificationCategories.AUCTION_WON)
+
+        self.assertEqual(Notification.objects.unread(self.alice).count(), 2)
+        self.assertEqual(Notification.objects.unread(self.bob).count(), 1)
+
+        self.assertEqual(Notification.objects.mark_all_as_read(self.alice), 2)
+        self.assertEqual(Notification.objects.unread(self.alice).count(), 0)
+        self.assertEqual(Notification.objects.unread(self.bob).count(), 1)
+
+        create_auction(self.owner, title="Later auction")
+        self.assertEqual(Notification.objects.unread(self.alice).count(), 1)
+
+    def test_read_and_dismiss_single_broadcasts(self):
+        create_auction(self.owner)
+        create_auction(self.owner, title="Second")
+        first = Notification.objects.broadcasts().order_by("created_at").first()
+
+        Notification.objects.filter(pk=first.pk).mark_as_read(self.alice)
+        self.assertEqual(Notification.objects.unread(self.alice).count(), 1)
+
+        Notification.objects.filter(pk=first.pk).dismiss(self.bob)
+        self.assertEqual(Notification.objects.for_user(self.bob).count(), 1)
+        self.assertEqual(Notification.objects.for_user(self.alice).count(), 2)
+
+    def test_only_receipts_actually_added_are_counted(self):
+        create_auction(self.owner)
+        create_auction(self.owner, title="Second")
+        first = Notification.objects.broadcasts().order_by("created_at").first()
+        # Stored by a concurrent read of the same broadcast
+        BroadcastReceipt.objects.create(user=self.alice, notification=first)
+
+        self.assertEqual(_add_read_receipts(Notification.objects.broadcasts(), self.alice), 1)
+        self.assertEqual(BroadcastReceipt.objects.filter(user=self.alice).count(), 2)
+        self.assertEqual(_add_read_receipts(Notification.objects.broadcasts(), self.alice), 0)
+
+    def test_users_joining_later_do_not_inherit_old_broadcasts(self):
+        create_auction(self.owner)
+        newcomer = User.objects.create(username="newcomer")
+        self.assertEqual(Notification.objects.unread(newcomer).count(), 0)
+
+
+class FoldIntoBroadcastsTests(TestCase):
+    def test_fold_keeps_read_state(self):
+        owner = User.objects.create(username="owner")
+        readers = [User.objects.create(username=f"reader_{i}") for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=False):
+            auction = create_auction(owner)
+        for i, user in enumerate([owner] + readers):
+            Notification.objects.create(
+                user=user,
+                category=NotificationCategories.AUCTION_CREATED,
+                content_object=auction,
+                is_read=i % 2 == 1,
+            )
+
+        removed = fold_into_broadcasts(NotificationCategories.AUCTION_CREATED)
+
+        self.assertEqual(removed, 4)
+        broadcast = Notification.objects.get()
+        self.assertTrue(broadcast.is_broadcast)
+        self.assertEqual(BroadcastReceipt.objects.filter(notification=broadcast).count(), 2)
+        self.assertEqual(Notification.objects.unread(readers[0]).count(), 0)
+        self.assertEqual(Notification.objects.unread(readers[1]).count(), 1)
+
+    def test_rows_without_an_object_fold_by_content(self):
+        users = [User.objects.create(username=f"user_{i}") for i in range(2)]
+        for content in ("Maintenance tonight", "New fees from May"):
+            for user in users:
+                Notification.objects.create(user=user, category=NotificationCategories.AUCTION_CREATED, content=content)
+
+        removed = fold_into_broadcasts(NotificationCategories.AUCTION_CREATED)
+
+        self.assertEqual(removed, 4)
+        self.assertEqual(
+            sorted(Notification.objects.broadcasts().values_list("content", flat=True)),
+            ["Maintenance tonight", "New fees from May"],
+        )
+
+
+@override_settings(NOTIFICATION_DELIVERY_MODES={"AUCTION_CREATED": "read"})
+class InboxTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.alice = User.objects.create(username="alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def badge(self):
+        return self.client.get("/api/notifications/unread_count/").json()["unread"]
+
+    def test_counter_follows_creates_and_reads(self):
+        self.assertEqual(self.badge(), 0)  # first read counts and stores the counter
+        create_auction(self.owner)
+        won = Notification.objects.create(user=self.alice, category=NotificationCategories.AUCTION_WON)
+        Notification.objects.create(user=self.alice, category=NotificationCategories.AUCTION_WON)
+        self.assertEqual(self.badge(), 3)
+
+        response = self.client.get("/api/notifications/")
+        self.assertEqual([n["is_read"] for n in response.json()["results"]], [False] * 3)
+
+        self.assertEqual(self.client.post(f"/api/notifications/{won.pk}/read/").json(), {"unread": 2})
+        broadcast = Notification.objects.broadcasts().get()
+        Notification.objects.filter(pk=broadcast.pk).mark_as_read(self.alice)
+        self.assertEqual(self.badge(), 1)
+        response = self.client.get("/api/notifications/")
+        self.assertEqual(sorted(n["is_read"] for n in response.json()["results"]), [False, True, True])
+
+        self.assertEqual(self.client.post("/api/notifications/read_all/").json(), {"unread": 0})
+        create_auction(self.owner, title="Later auction")
+        self.assertEqual(self.badge(), 1)
+        self.assertEqual(self.badge(), recount(self.alice))
+
+    def test_recount_counts_in_its_update(self):
+        create_auction(self.owner)
+        Notification.objects.create(user=self.alice, category=NotificationCategories.AUCTION_WON)
+        self.assertEqual(self.badge(), 2)
+        # Drifted, e.g. by an increment lost to a read-then-write recount
+        UnreadCounter.objects.filter(user=self.alice).update(personal=5)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(recount(self.alice), 2)
+        counts = [query["sql"] for query in ctx.captured_queries if "COUNT(" in query["sql"]]
+        # No count read ahead of the write: it is computed by the UPDATE
+        self.assertEqual(len(counts), 1)
+        self.assertTrue(counts[0].startswith("UPDATE"))
+
+    def test_badge_scans_no_table(self):
+        create_auction(self.owner)
+        self.badge()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.badge(), 1)
+        for query in ctx.captured_queries:
+            self.assertNotIn("notificationapp_notification\"", query["sql"])
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+            self.assertNotIn("SCAN", plan)
+
+
+class ReconnectReplayTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username="alice")
+        self.bob = User.objects.create(username="bob")
+
+    def connect(self, query=""):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/notifications/{query}")
+        communicator.scope["user"] = self.alice
+        return communicator
+
+    def test_replays_what_was_missed_then_goes_live(self):
+        seen = Notification.objects.create(user=self.alice, category=NotificationCategories.AUCTION_WON)
+        missed = [
+            Notification.objects.create(user=self.alice, category=NotificationCategories.AUCTION_OUTBID)
+            for _ in range(3)
+        ]
+        Notification.objects.create(user=self.bob, category=NotificationCategories.AUCTION_WON)
+
+        async def scenario():
+            communicator = self.connect(f"?since={seen.pk}")
+            self.assertTrue((await communicator.connect())[0])
+            replayed = [await communicator.receive_json_from() for _ in range(3)]
+            self.assertEqual([m["data"]["notification_id"] for m in replayed], [n.pk for n in missed])
+            self.assertTrue(all(m["replayed"] for m in replayed))
+            self.assertEqual(await communicator.receive_json_from(), {
+                "type": "replay_done", "cursor": missed[-1].pk, "more": False,
+            })
+            self.assertEqual((await communicator.receive_json_from())["count"], 4)
+            self.assertEqual(await database_sync_to_async(online_user_ids)([self.alice.pk, self.bob.pk]), {self.alice.pk})
+
+            # Live from here on; sends of replayed rows are dropped
+            channel_layer = get_channel_layer()
+            for notification_id in (missed[0].pk, missed[-1].pk, missed[-1].pk + 100):
+                await channel_layer.group_send(f"user_notifications_{self.alice.pk}", {
+                    "type": "send_notification", "message": "", "data": {"notification_id": notification_id},
+                })
+            self.assertEqual((await communicator.receive_json_from())["unread_count"], 5)
+            self.assertTrue(await communicator.receive_nothing(0.05))
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertFalse(NotificationSocket.objects.exists())
+        self.assertEqual(online_user_ids([self.alice.pk]), set())
+
+    def test_replay_is_one_range_read(self):
+        for _ in range(5):
+            Notification.objects.create(user=self.alice, category=NotificationCategories.AUCTION_WON)
+        first = Notification.objects.filter(user=self.alice).order_by("pk").first()
+        with self.assertNumQueries(1):
+            notifications, more = replay_since(self.alice, first.pk, limit=3)
+        self.assertEqual(len(notifications), 3)
+        self.assertTrue(more)
+
+    def test_fanout_skips_users_without_a_socket(self):
+        job = FanOutJob.objects.create(category=NotificationCategories.AUCTION_CREATED, content="New")
+        NotificationSocket.objects.create(
+            worker=presence.heartbeat()[0], user=self.bob, channel_name="test.bob",
+        )
+        run_fanout(job.pk)
+        self.assertEqual(
+            list(OutboxMessage.objects.values_list("group", flat=True)), [f"user_notifications_{self.bob.pk}"]
+        )
+        self.assertEqual(Notification.objects.filter(category=NotificationCategories.AUCTION_CREATED).count(), 2)
+
+
+class AuctionResultNotificationTests(TestCase):
+    def finalize(self, participants):
+        """Finalize an item with ``participants`` bidders; returns the queries it took."""
+        users = seed_users(participants + 1, prefix=f"bidder{participants}")
+        owner, bidders = users[0], users[1:]
+        item, = seed_auction(owner)
+        Bid.objects.bulk_create([
+            Bid(item=item, created_by=user, amount=Decimal(10 + n)) for n, user in enumerate(bidders)
+        ])
+        top = Bid.objects.filter(item=item).order_by("-amount").first()
+        with CaptureQueriesContext(connection) as ctx:
+            AuctionResult.objects.create(item=item, winner=top.created_by, winning_bid=top)
+        self.item, self.winner = item, top.created_by
+        return len(ctx.captured_queries)
+
+    def test_queries_do_not_grow_with_participants(self):
+        self.finalize(2)  # warms the ContentType cache
+        few = self.finalize(3)
+        self.assertEqual(self.finalize(40), few)
+
+        notifications = Notification.objects.filter(object_id=self.item.pk)
+        self.assertEqual(notifications.count(), 40)
+        won = notifications.get(category=NotificationCategories.AUCTION_WON)
+        self.assertEqual(won.user, self.winner)
+        self.assertEqual(won.content, f"🎉 **Congratulations!** You won the bid for **{self.item.title}**!")
+        self.assertEqual(won.content_object, self.item)
+        self.assertEqual(recount(self.winner), 1)
@@ -0,0 +1,105 @@
+"""
+Unread counts without counting.
+
+Each user's badge is an ``UnreadCounter`` row, moved by every write that
+changes it: a personal notification created (post_save, or the fan-out's
+bulk_create), a broadcast sent (``BroadcastCounter``), read or dismissed
+(``NotificationQuerySet``). Reading it is a primary-key lookup. A user
+without a row gets one counted exactly on first read (``recount``), which is
+also how the counters are repaired should they ever drift. The recount is a
+single UPDATE whose counts are subqueries, so an increment committed
+meanwhile is either in the count or applied after it, never lost.
+
+Connected clients are told the new count (``unread_count`` events to their
+``NotificationConsumer``, through the outbox) once the change commits; new
+notifications are counted by the consumer itself.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Func, Subquery
+from django.db.models.functions import Coalesce
+
+from main.outbox import enqueue
+
+from .models import BroadcastCounter, Notification, UnreadCounter
+from .presence import online_user_ids
+
+
+def add_personal(user_ids, delta):
+    """Add ``delta`` unread personal notifications to each of ``user_ids``."""
+    if delta:
+        UnreadCounter.objects.filter(user_id__in=user_ids).update(personal=F('personal') + delta)
+
+
+def see_broadcasts(user_id, count):
+    """``count`` more broadcasts were read or dismissed by ``user_id``."""
+    if count:
+        UnreadCounter.objects.filter(user_id=user_id).update(broadcasts_seen=F('broadcasts_seen') + count)
+
+
+def see_all_broadcasts(user_id):
+    UnreadCounter.objects.filter(user_id=user_id).update(
+        personal=0, broadcasts_seen=Coalesce(Subquery(BroadcastCounter.objects.filter(pk=1).values('sent')), 0),
+    )
+
+
+def broadcast_sent():
+    if not BroadcastCounter.objects.filter(pk=1).update(sent=F('sent') + 1):
+        # First one: the count includes it
+        broadcasts_sent()
+
+
+def broadcasts_sent():
+    sent = BroadcastCounter.objects.filter(pk=1).values_list('sent', flat=True).first()
+    if sent is None:
+        sent = Notification.objects.broadcasts().count()
+        try:
+            with transaction.atomic():
+                BroadcastCounter.objects.create(pk=1, sent=sent)
+        except IntegrityError:
+            # Created meanwhile
+            sent = BroadcastCounter.objects.values_list('sent', flat=True).get(pk=1)
+    return sent
+
+
+def unread_count(user):
+    """The user's unread notifications, personal and broadcast: one indexed lookup."""
+    row = (
+        UnreadCounter.objects.filter(user=user)
+        .annotate(sent=Subquery(BroadcastCounter.objects.filter(pk=1).values('sent')))
+        .values_list('personal', 'broadcasts_seen', 'sent')
+        .first()
+    )
+    if row is None:
+        return recount(user)
+    personal, seen, sent = row
+    return personal + max(0, (sent or 0) - seen)
+
+
+def count_of(queryset):
+    """``SELECT COUNT(*)`` of ``queryset``, as an expression."""
+    return Subquery(queryset.order_by().annotate(count=Func(F('pk'), function='COUNT')).values('count'))
+
+
+def recount(user):
+    """Count the user's unread notifications into their counter. Returns the count."""
+    with transaction.atomic():
+        # The counter row, and the BroadcastCounter one the subquery reads
+        broadcasts_sent()
+        UnreadCounter.objects.get_or_create(user=user)
+        UnreadCounter.objects.filter(user=user).update(
+            personal=count_of(Notification.objects.filter(user=user, is_read=False)),
+            broadcasts_seen=Subquery(BroadcastCounter.objects.filter(pk=1).values('sent'))
+            - count_of(Notification.objects.unread(user).filter(user__isnull=True)),
+        )
+        return unread_count(user)
+
+
+def reset_counters():
+    """Forget every counter; each is recounted on its next read."""
+    UnreadCounter.objects.all().delete()
+
+
+def publish_unread(user):
+    """Push the user's unread count to their sockets once the transaction commits (``main.outbox``)."""
+    if user.pk in online_user_ids([user.pk]):
+        enqueue(f'user_notifications_{user.pk}', {'type': 'unread_count', 'count': unread_count(user)})
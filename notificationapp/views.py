@@ -1,3 +1,49 @@
-from django.shortcuts import render
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
-# Create your views here.
+from main.pagination import CreatedAtPagination
+from .models import Notification
+from .serializers import NotificationSerializer
+from .unread import unread_count
+
+
+class NotificationPagination(CreatedAtPagination):
+    page_size = 20
+    max_page_size = 50
+
+
+class NotificationViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    The user's inbox: personal notifications and broadcasts, newest first.
+    The read actions answer with the new unread count, which is also pushed
+    to the user's sockets.
+    """
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+
+    def get_queryset(self):
+        user = self.request.user
+        return Notification.objects.for_user(user).with_read_state(user).select_related("sender")
+
+    @action(detail=True, methods=["post"])
+    def read(self, request, pk=None):
+        notifications = Notification.objects.for_user(request.user).filter(pk=pk)
+        if not notifications.mark_as_read(request.user) and not notifications.exists():
+            return Response({"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"unread": unread_count(request.user)})
+
+    @action(detail=False, methods=["post"])
+    def read_all(self, request):
+        Notification.objects.mark_all_as_read(request.user)
+        return Response({"unread": unread_count(request.user)})
+
+    @action(detail=False)
+    def unread_count(self, request):
+        """The badge: a lookup of the user's counter, never a COUNT(*)."""
+        return Response({"unread": unread_count(request.user)})
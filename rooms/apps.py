@@ -4,3 +4,5 @@ from django.apps import AppConfig
 class RoomsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rooms'
+    def ready(self):
+        import rooms.signals
@@ -0,0 +1,115 @@
+"""
+Coalesced bid broadcasts for the bidding rooms.
+
+Accepted bids are not sent to the room one by one. Each room of a process has
+a ``RoomBroadcaster`` that collects the bids accepted during a short window
+(``BID_BROADCAST_WINDOW``, in seconds) and sends them as a single frame::
+
+    {"bid": <latest bid>, "bids": [<every bid of the window, oldest first>]}
+
+The frame is JSON-encoded once, by the broadcaster, and every consumer of the
+room writes the same string to its socket. ``Outbox`` keeps a consumer from
+queueing frames it can't write fast enough. Only the newest pending frame is
+kept: it carries the latest price, so a slow client skips intermediate
+updates but never ends up behind.
+"""
+import asyncio
+import json
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+DEFAULT_WINDOW = 0.01
+
+
+def broadcast_window():
+    return getattr(settings, "BID_BROADCAST_WINDOW", DEFAULT_WINDOW)
+
+
+class RoomBroadcaster:
+    """Collects the bids accepted in one room and flushes them once per window."""
+
+    def __init__(self, group_name, window=None, channel_layer=None):
+        self.group_name = group_name
+        self.window = broadcast_window() if window is None else window
+        self.channel_layer = channel_layer
+        self.pending = []
+        self.flushing = None
+        self.frames_sent = 0
+        self.bids_sent = 0
+        # Sockets of this room connected to this process
+        self.watchers = 0
+
+    def publish(self, bid):
+        """Queue a serialized bid; the next flush includes it."""
+        self.pending.append(bid)
+        if self.flushing is None:
+            self.flushing = asyncio.ensure_future(self._flush_later())
+        return self.flushing
+
+    async def _flush_later(self):
+        try:
+            # Bids published while a frame is being sent wait for the next
+            # window of the same task; publish() only starts one when idle.
+            while self.pending:
+                if self.window:
+                    await asyncio.sleep(self.window)
+                else:
+                    await asyncio.sleep(0)
+                await self.flush()
+        finally:
+            self.flushing = None
+
+    async def flush(self):
+        bids, self.pending = self.pending, []
+        if not bids:
+            return
+        # Encoded once here, written as-is by every consumer of the room
+        text = json.dumps({"bid": bids[-1], "bids": bids})
+        channel_layer = self.channel_layer or get_channel_layer()
+        await channel_layer.group_send(self.group_name, {"type": "broadcast_frame", "text": text})
+        self.frames_sent += 1
+        self.bids_sent += len(bids)
+
+
+class Outbox:
+    """
+    One-slot send buffer of a consumer. While a frame is being written, a newer
+    one replaces the pending one instead of queueing behind it.
+    """
+
+    def __init__(self, send):
+        self.send = send
+        self.pending = None
+        self.writer = None
+        self.dropped = 0
+
+    def offer(self, text):
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = text
+        if self.writer is None:
+            self.writer = asyncio.ensure_future(self._drain())
+
+    async def _drain(self):
+        try:
+            while self.pending is not None:
+                text, self.pending = self.pending, None
+                await self.send(text_data=text)
+        finally:
+            self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.cancel()
+
+
+# group name -> RoomBroadcaster of this process
+_broadcasters = {}
+
+
+def get_broadcaster(group_name):
+    broadcaster = _broadcasters.get(group_name)
+    if broadcaster is None:
+        broadcaster = _broadcasters[group_name] = RoomBroadcaster(group_name)
+    return broadcaster
@@ -1,10 +1,15 @@
-from datetime import datetime
 from decimal import Decimal, InvalidOperation
 import json
-from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from main.models import Item, Bid , AuctionResult
-from main.serializers import BidSerializer,BidBasicSerializer
+from django.utils.dateparse import parse_datetime
+from main.serializers import BidBasicSerializer
+from main.bidding import BidRejected
+from main.outbox import attach_loop
+from dashboard.metrics import SOCKETS, metrics
+from .broadcaster import Outbox, get_broadcaster
+from .throttling import TokenBucket, acquire_attempt, record_rejection, release_attempt
+from .order_book import get_order_book
+from .presence import presence
 
 class BidConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -17,173 +22,142 @@ class BidConsumer(AsyncWebsocketConsumer):
             print("Anonymous user not allowed")
             return
         
-        item = await self.get_item(id=self.item_id)
+        # Loaded from the database only by the first connection to this room
+        self.order_book = await get_order_book(self.item_id)
 
         # If item obj not found
-        if item is None:
+        if self.order_book is None:
             await self.accept()
             await self.close(code=4001, reason="Item not found")
             print("Item not found")
             return
         
         # If item obj already ended not accept any connection
-        if item.end_at is not None:
+        if self.order_book.ended:
             await self.accept()
             await self.close(code=4001, reason="Item was ended")
             print("Item was ended")
             return
 
+        # Bids reach the room in coalesced, pre-encoded frames (see rooms.broadcaster)
+        self.broadcaster = get_broadcaster(self.group_name)
+        self.broadcaster.watchers += 1
+        self.count_socket(1)
+        self.outbox = Outbox(self.send)
+        self.bucket = TokenBucket()
+
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
+        # Outbox messages for the room are sent on this loop (main.outbox)
+        attach_loop()
 
         await self.accept()
-        
-        # Send a notification to all existing users in the room
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                'type': 'broadcast_room_notification',
-                'message': f'{user.username} has joined the bidding!',
-                'notification_type': 'user_joined',
-                'sender_channel': self.channel_name # Don't notify self
-            }
-        )
+
+        # Counted in the room's next presence frame (rooms.presence), not announced
+        presence.join(self.order_book.item_id, self.channel_name, user.id)
+
+    def count_socket(self, delta):
+        metrics.record(SOCKETS, delta, rollup=False)
+        metrics.record(SOCKETS, delta, key=str(self.item_id), rollup=False)
 
     async def disconnect(self, close_code):
         print(f"Disconnected with code: {close_code}")
+        if hasattr(self, 'outbox'):
+            self.outbox.close()
+            self.broadcaster.watchers -= 1
+            self.count_socket(-1)
+            presence.leave(self.order_book.item_id, self.channel_name)
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
-        user = self.scope['user']
-        if close_code == 1000:
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'broadcast_room_notification',
-                    'message': f'{user.username} has leave the bidding!',
-                    'notification_type': 'user_leave',
-                    'sender_channel': self.channel_name # Don't notify self
-                }
-            )
 
     async def receive(self, text_data):
         # load the bid amount
         try:
             data = json.loads(text_data)
             bid_amount = Decimal(str(data.get('amount')))
+            if not bid_amount.is_finite():
+                raise InvalidOperation
         except (json.JSONDecodeError, InvalidOperation, TypeError):
             await self.send(text_data=json.dumps({
                 'error': 'Invalid bid format'
             }))
             return
 
-        item = await self.get_item(id=self.item_id)
-        if item is None:
-            await self.send(text_data=json.dumps({
-                'error': 'Item not found'
-            }))
-            return
-
-        if not item.is_active:
-            await self.send(text_data=json.dumps({
-                'error': 'Item is inactive'
-            }))
+        user = self.scope['user']
+        if not self.bucket.take():
+            await self.reject('rate_limited', f'Too many bids, retry in {self.bucket.retry_after:.1f}s')
             return
-
-        min_inc = item.min_increment
-        last_bid = await self.last_bid(itemId=self.item_id)
-        current_price = last_bid.amount if last_bid else item.start_price
-        min_acceptable_bid = current_price + min_inc
-
-        print(f"Minimum acceptable bid: {min_acceptable_bid}")
-
-        if bid_amount < min_acceptable_bid:
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'broadcast_bid',
-                    'error': True,
-                    'message': json.dumps({
-                        'error': f'Bid must be at least {min_acceptable_bid:.2f}'
-                    })
-                }
-            )
+        if not acquire_attempt(user.id, self.order_book.item_id):
+            await self.reject('too_many_outstanding', 'Your previous bid is still being processed')
             return
 
+        # Rejected from memory when it can't win, otherwise accepted by a
+        # single conditional UPDATE (see main.bidding.accept_bid) in one
+        # thread hop to the bid-accept pool; the rest of a bid is async
         try:
+            bid_obj = await self.order_book.place(user, bid_amount)
+        except BidRejected as e:
+            await self.reject(e.code, e.message, e.min_acceptable_bid)
+            return
+        finally:
+            release_attempt(user.id, self.order_book.item_id)
 
-            bid_obj = await database_sync_to_async(Bid.objects.create)(
-                item=item,
-                amount=bid_amount,
-                created_by=self.scope['user']
-            )
+        # Built from the saved instance and the connected user, no query needed
+        serialized_bid = BidBasicSerializer(bid_obj).data
 
-            serialized_bid = await database_sync_to_async(lambda: BidBasicSerializer(bid_obj).data)()
-            
-            # Close auction if reserve price is met
-            # await self.close_auction(item, self.scope['user'], bid_amount)
+        # Sent with the other bids of the same few milliseconds
+        self.broadcaster.publish(serialized_bid)
 
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'broadcast_bid',
-                    'bid': serialized_bid
-                }
-            )
+        # Soft close: the bid pushed the item's deadline out
+        if bid_obj.extended:
+            await self.channel_layer.group_send(self.group_name, {
+                'type': 'deadline_changed',
+                'closes_at': self.order_book.closes_at.isoformat(),
+            })
 
-        except Exception as e:
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'broadcast_bid',
-                    'error': True,
-                    'message': json.dumps({
-                        'error': 'Failed to place bid',
-                        'details': str(e)
-                    })
-                }
-            )
+    async def reject(self, code, message, min_acceptable_bid=None):
+        # Only the sender hears about its rejected bid, never the whole room
+        record_rejection(code, self.broadcaster.watchers)
+        await self.send(text_data=json.dumps({
+            'error': message,
+            'code': code,
+            'min_acceptable_bid': str(min_acceptable_bid) if min_acceptable_bid is not None else None,
+        }))
 
     async def broadcast_bid(self, event):
-        if event.get('error'):
-            await self.send(text_data=event['message'])
-        else:
-            await self.send(text_data=json.dumps({
-                'bid': event['bid']
-            }))
+        # A single, not yet encoded bid (rooms.broadcaster sends broadcast_frame)
+        await self.send(text_data=json.dumps({
+            'bid': event['bid']
+        }))
 
-    async def get_item(self, id):
-        try:
-            return await database_sync_to_async(Item.objects.get)(id=id)
-        except Item.DoesNotExist:
-            return None
-
-    async def last_bid(self, itemId):
-        return await database_sync_to_async(
-            lambda: Bid.objects.filter(item_id=itemId).order_by('-created_at').first()
-        )()
-        
-    async def close_auction(self, item, winner, winning_bid):
-        item.is_active = False
-        item.end_at = datetime.now()
-        await database_sync_to_async(item.save)()
-        await database_sync_to_async(AuctionResult.objects.create)(
-            item=item,
-            winner=winner,
-            winning_bid=winning_bid
-        )
+    async def broadcast_frame(self, event):
+        # Already encoded by the room's broadcaster; a slow socket only keeps the newest
+        self.outbox.offer(event['text'])
 
-    # Handler for room notifications sent by other consumers
-    async def broadcast_room_notification(self, event):
-        # Prevent the user who just joined from getting their own 'joined' notification
-        if event.get('sender_channel') == self.channel_name:
-            return
-            
+
+    async def deadline_changed(self, event):
+        self.order_book.extend(parse_datetime(event['closes_at']))
         await self.send(text_data=json.dumps({
-            'type': event.get('notification_type', 'info'),
-            'message': event['message']
+            'type': 'deadline_changed',
+            'closes_at': event['closes_at'],
         }))
+
+    async def auction_closed(self, event):
+        # Sent by the close scheduler (main.scheduler) once the item is finalized
+        self.order_book.end_at = parse_datetime(event['ended_at'])
+        self.order_book.is_active = False
+        await self.send(text_data=json.dumps({
+            'type': 'auction_closed',
+            'item_id': event['item_id'],
+            'winner': event['winner'],
+            'amount': event['amount'],
+        }))
+
+    async def presence_update(self, event):
+        # Watcher count of the room, encoded once by rooms.presence
+        await self.send(text_data=event['text'])
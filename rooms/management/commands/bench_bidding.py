@@ -0,0 +1,249 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authen.middleware.token_auth import TokenAuthMiddlewareStack
+from main.benchmarking import Stopwatch, percentile, scratch_database, seed_auction, seed_users
+from main.journal import get_journal, start_journal, stop_journal
+from main.models import Bid
+from rooms.order_book import accept_executor, accept_workers, forget_order_book
+from rooms.routing import websocket_urlpatterns
+from rooms.throttling import bid_counters, counters
+
+
+class QueryCounter:
+    """``connection.execute_wrapper`` hook counting the statements of one thread."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Client:
+    """One bidder socket: sends its own bids, watches every broadcast of the room."""
+
+    def __init__(self, application, user, item, bench):
+        token = AccessToken.for_user(user)
+        self.communicator = WebsocketCommunicator(application, f"/ws/place-bid/{item.id}/?token={token}")
+        self.user = user
+        self.item = item
+        self.bench = bench
+        self.answered = asyncio.Event()
+        self.waiting_for = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise RuntimeError(f"{self.user} couldn't connect to item {self.item.id}")
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        # Straight from the output queue: receive_output's timeout would kill the consumer
+        while True:
+            message = await self.communicator.output_queue.get()
+            if message["type"] != "websocket.send":
+                continue
+            arrived = time.perf_counter()
+            frame = json.loads(message["text"])
+            if "bid" in frame:
+                # Coalesced frames list every bid of their window
+                for bid in frame.get("bids", [frame["bid"]]):
+                    amount = Decimal(bid["amount"])
+                    self.bench.acknowledged.add((self.item.id, amount))
+                    sent = self.bench.sent_at.get((self.item.id, amount))
+                    if sent is not None:
+                        self.bench.latencies.append(arrived - sent)
+                    if amount == self.waiting_for:
+                        self.answered.set()
+            elif "error" in frame:
+                # Rejections are only ever sent to their bidder
+                self.bench.errors += 1
+                self.answered.set()
+
+    async def bid(self, amount, timeout):
+        self.answered.clear()
+        self.waiting_for = amount
+        self.bench.sent_at[(self.item.id, amount)] = time.perf_counter()
+        await self.communicator.send_to(text_data=json.dumps({"amount": str(amount)}))
+        try:
+            await asyncio.wait_for(self.answered.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.bench.timeouts += 1
+
+    async def close(self):
+        self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive N concurrent in-process WebSocket clients against BidConsumer and "
+        "report accepted bids/sec, bid-to-broadcast latency, queries per bid and "
+        "memory per connection as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=100)
+        parser.add_argument("--items", type=int, default=1, help="Rooms the clients are spread over")
+        parser.add_argument("--bids", type=int, default=20, help="Bids sent by every client")
+        parser.add_argument("--timeout", type=float, default=5, help="Seconds to wait for a bid's answer")
+        parser.add_argument(
+            "--throttle", action="store_true",
+            help="Keep the BID_THROTTLE rate limit (by default the clients aren't rate limited)",
+        )
+        parser.add_argument(
+            "--journal", action="store_true",
+            help="Accept bids through the write-behind bid journal (main.journal)",
+        )
+        parser.add_argument(
+            "--crash", action="store_true",
+            help="With --journal: drop the process state without flushing, replay the journal "
+                 "and count the acknowledged bids that made it to the database",
+        )
+        parser.add_argument("--label", default="", help="Free text stored with the results (e.g. a git ref)")
+        parser.add_argument("--output", help="Also write the JSON results to this file")
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            users = seed_users(options["clients"], prefix="bench_bidder")
+            items = seed_auction(users[0], items=options["items"], min_increment=Decimal("1.00"))
+            for item in items:
+                # The scratch database reuses ids; never start from another run's book
+                forget_order_book(item.id)
+            throttle = {} if options["throttle"] else {"RATE": 10 ** 9, "BURST": 10 ** 9}
+            journal_dir = tempfile.mkdtemp(prefix="auction-journal-") if options["journal"] else None
+            # Nothing gets flushed before the "crash"
+            journal = {"FLUSH_INTERVAL": 3600} if options["crash"] else {}
+            # Keep the consumers' prints out of the JSON
+            with redirect_stdout(io.StringIO()), override_settings(BID_THROTTLE=throttle, BID_JOURNAL=journal):
+                if journal_dir:
+                    start_journal(os.path.join(journal_dir, "bids.journal"))
+                results = asyncio.run(self.run(users, items, options))
+                if journal_dir:
+                    results["journal"] = self.finish_journal(options)
+                    shutil.rmtree(journal_dir)
+            results["stored"] = Bid.objects.count()
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        self.stdout.write(output)
+
+    def finish_journal(self, options):
+        journal = get_journal()
+        stats = dict(journal.stats)
+        if options["crash"]:
+            # Whatever wasn't flushed yet only exists in the journal file now
+            unflushed = len(journal.unflushed)
+            stop_journal(flush=False)
+            replayed = start_journal(journal.path)
+            stats.update(unflushed_at_crash=unflushed, replayed=replayed.stats["replayed"])
+        stop_journal()
+        stats["records_per_fsync"] = round(stats.get("appends", 0) / max(stats.get("fsyncs", 0), 1), 1)
+        return stats
+
+    async def on_accept_threads(self, func):
+        """Run ``func`` once in every thread of the bid-accept pool."""
+        workers = accept_workers()
+        barrier = threading.Barrier(workers)
+
+        def call():
+            func()
+            barrier.wait()
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(accept_executor(), call) for _ in range(workers)))
+
+    async def run(self, users, items, options):
+        self.sent_at, self.latencies, self.acknowledged = {}, [], set()
+        counters.clear()
+        self.errors = self.timeouts = 0
+        application = TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        clients = [Client(application, user, items[i % len(items)], self) for i, user in enumerate(users)]
+
+        # The consumers' ORM calls run in the thread-sensitive executor thread
+        # (connects) and in the bid-accept pool
+        counter = QueryCounter()
+        await sync_to_async(lambda: connection.execute_wrappers.append(counter))()
+        await self.on_accept_threads(lambda: connection.execute_wrappers.append(counter))
+
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        for client in clients:
+            await client.connect()
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        connect_queries = counter.count
+
+        # Every client bids on a shared, rising price per room; racing bids lose
+        prices = {item.id: item.start_price for item in items}
+
+        async def bidder(client):
+            for _ in range(options["bids"]):
+                prices[client.item.id] += client.item.min_increment
+                await client.bid(prices[client.item.id], options["timeout"])
+
+        with Stopwatch() as sw:
+            await asyncio.gather(*(bidder(client) for client in clients))
+        # Let the last broadcasts reach every watcher
+        await asyncio.sleep(0.2)
+        bid_queries = counter.count - connect_queries
+
+        await asyncio.gather(*(client.close() for client in clients))
+        await sync_to_async(lambda: connection.execute_wrappers.remove(counter))()
+        await self.on_accept_threads(lambda: connection.execute_wrappers.remove(counter))
+        stats = {}
+        channel_layer = get_channel_layer()
+        if hasattr(channel_layer, "stats"):
+            stats = await channel_layer.stats()
+
+        # Broadcast to the room: in the database, or on disk in the journal
+        accepted = len(self.acknowledged)
+        latencies = [sample * 1000 for sample in self.latencies]
+        bids_sent = len(clients) * options["bids"]
+        return {
+            "label": options["label"],
+            "clients": len(clients),
+            "rooms": len(items),
+            "accept_workers": accept_workers(),
+            "bids_sent": bids_sent,
+            "accepted": accepted,
+            "duration_s": round(sw.elapsed, 3),
+            "accepted_bids_per_sec": round(accepted / sw.elapsed, 1),
+            "sent_bids_per_sec": round(bids_sent / sw.elapsed, 1),
+            "errors_received": self.errors,
+            "timeouts": self.timeouts,
+            "broadcasts_received": len(latencies),
+            "bid_to_broadcast_ms": {
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+            },
+            "queries_per_bid": round(bid_queries / bids_sent, 2),
+            "queries_per_accepted_bid": round(bid_queries / max(accepted, 1), 2),
+            "connect_queries": connect_queries,
+            "memory_per_connection_kb": round((after - before) / len(clients) / 1024, 1),
+            "rejections": bid_counters(),
+            "channel_layer": stats,
+        }
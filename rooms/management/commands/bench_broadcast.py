@@ -0,0 +1,149 @@
+import asyncio
+import json
+import time
+from decimal import Decimal
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from main.benchmarking import Stopwatch
+from rooms.broadcaster import Outbox, RoomBroadcaster
+from rooms.consumers import BidConsumer
+
+GROUP = "auction_item_1"
+
+
+class BenchChannelLayer(InMemoryChannelLayer):
+    """
+    The in-memory layer sweeps every channel for expired messages on each
+    receive, which is O(watchers) per message on its own; sweep once a second
+    so the numbers show the broadcast path rather than the sweep.
+    """
+
+    swept_at = 0
+
+    def _clean_expired(self):
+        if time.monotonic() - self.swept_at >= 1:
+            self.swept_at = time.monotonic()
+            super()._clean_expired()
+
+
+class Watcher:
+    """A BidConsumer without a socket: what it writes is only counted."""
+
+    def __init__(self, layer, final_marker, done):
+        self.layer = layer
+        self.final_marker = final_marker
+        self.done = done
+        self.consumer = BidConsumer()
+        self.consumer.channel_layer = layer
+        self.consumer.base_send = self.write
+        self.consumer.outbox = Outbox(self.consumer.send)
+        self.frames = 0
+
+    async def write(self, message):
+        self.frames += 1
+        if self.final_marker in message["text"]:
+            self.done()
+
+    async def join(self):
+        self.consumer.channel_name = await self.layer.new_channel()
+        await self.layer.group_add(GROUP, self.consumer.channel_name)
+        self.task = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        # The consumer's own handlers (broadcast_bid / broadcast_frame)
+        while True:
+            message = await self.layer.receive(self.consumer.channel_name)
+            await getattr(self.consumer, message["type"])(message)
+
+
+class Command(BaseCommand):
+    help = (
+        "Broadcast a burst of accepted bids to a room of N watchers, one group_send "
+        "per bid against the coalesced broadcaster, and report messages/sec and CPU per bid."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--watchers", type=int, nargs="+", default=[1000, 10000])
+        parser.add_argument("--bids", type=int, default=100)
+        parser.add_argument("--rate", type=float, default=2000, help="Accepted bids per second (sniping rush)")
+        parser.add_argument("--window", type=float, default=None, help="Coalescing window in seconds")
+
+    def handle(self, *args, **options):
+        for watchers in options["watchers"]:
+            legacy = asyncio.run(self.run("per-bid", watchers, options))
+            coalesced = asyncio.run(self.run("coalesced", watchers, options))
+            self.stdout.write(f"{watchers} watchers, {options['bids']} bids at {options['rate']:.0f}/s")
+            for result in (legacy, coalesced):
+                self.stdout.write(
+                    f"  {result['mode']:10} {result['frames']:9} socket frames "
+                    f"{result['group_sends']:5} group_sends  "
+                    f"{result['msgs_per_sec']:9.0f} msgs/sec "
+                    f"{result['deliveries_per_sec']:10.0f} bid deliveries/sec  "
+                    f"{result['cpu_ms_per_bid']:8.2f} ms CPU/bid  "
+                    f"done in {result['elapsed']:.2f}s"
+                )
+            self.stdout.write(
+                f"  CPU per bid: {legacy['cpu_ms_per_bid'] / coalesced['cpu_ms_per_bid']:.1f}x less "
+                f"when coalesced"
+            )
+
+    async def run(self, mode, watchers, options):
+        bids = options["bids"]
+        # Large enough that the per-bid mode isn't measured by what it drops:
+        # at 10k watchers its backlog outlives the default 60s expiry
+        layer = BenchChannelLayer(capacity=bids + 10, expiry=3600)
+        finished = asyncio.Event()
+        remaining = watchers
+
+        def done():
+            nonlocal remaining
+            remaining -= 1
+            if not remaining:
+                finished.set()
+
+        payloads = [
+            {
+                "id": i,
+                "amount": str(Decimal(100 + i)),
+                "created_at": "2026-01-01T12:00:00Z",
+                "created_by": f"bidder_{i % 50}",
+            }
+            for i in range(bids)
+        ]
+        final_marker = json.dumps(payloads[-1]["amount"])
+        room = [Watcher(layer, final_marker, done) for _ in range(watchers)]
+        for watcher in room:
+            await watcher.join()
+
+        broadcaster = RoomBroadcaster(GROUP, window=options["window"], channel_layer=layer)
+        group_sends = 0
+        per_tick = max(1, int(options["rate"] / 1000))
+
+        cpu = time.process_time()
+        with Stopwatch() as sw:
+            for start in range(0, bids, per_tick):
+                for bid in payloads[start:start + per_tick]:
+                    if mode == "per-bid":
+                        # What BidConsumer.receive used to do for every accepted bid
+                        await layer.group_send(GROUP, {"type": "broadcast_bid", "bid": bid})
+                        group_sends += 1
+                    else:
+                        broadcaster.publish(bid)
+                await asyncio.sleep(0.001)
+            await finished.wait()
+        cpu = time.process_time() - cpu
+
+        for watcher in room:
+            watcher.task.cancel()
+        frames = sum(watcher.frames for watcher in room)
+        return {
+            "mode": mode,
+            "frames": frames,
+            "group_sends": group_sends if mode == "per-bid" else broadcaster.frames_sent,
+            "msgs_per_sec": frames / sw.elapsed,
+            "deliveries_per_sec": watchers * bids / sw.elapsed,
+            "cpu_ms_per_bid": cpu * 1000 / bids,
+            "elapsed": sw.elapsed,
+        }
@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from main.bidding import BidRejected
+from main.benchmarking import Stopwatch, scratch_database, seed_auction, seed_users
+from main.models import Bid, Item
+from main.serializers import BidBasicSerializer
+from rooms.order_book import OrderBook, forget_order_book, reset_accept_executor
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare bids/sec for one room: the per-message database path "
+        "(get item, last bid, Bid.clean's aggregate, insert) against the order book "
+        "with the atomic accept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bids", type=int, default=2000)
+        parser.add_argument("--bidders", type=int, default=20)
+        parser.add_argument(
+            "--stale-ratio", type=float, default=0.5,
+            help="Share of messages that repeat an already beaten amount (sniping rush).",
+        )
+
+    def handle(self, *args, **options):
+        bids = options["bids"]
+        self.stale_ratio = options["stale_ratio"]
+        with scratch_database():
+            users = seed_users(options["bidders"])
+            legacy_item, book_item = seed_auction(users[0], items=2)
+            # Nothing of an earlier run in this process (books, accept threads
+            # connected to its scratch database) may be reused
+            forget_order_book(book_item.id)
+            reset_accept_executor()
+            try:
+                with Stopwatch() as legacy:
+                    self.run_legacy(legacy_item, users, bids)
+                with Stopwatch() as order_book:
+                    # Not asyncio.run: the async ORM's thread-sensitive calls
+                    # then run on this thread, connected to the scratch database
+                    async_to_sync(self.run_order_book)(book_item, users, bids)
+
+                expected = Bid.objects.filter(item=legacy_item).count()
+                stored = Bid.objects.filter(item=book_item).count()
+            finally:
+                forget_order_book(book_item.id)
+                reset_accept_executor()
+
+        legacy_rate = bids / legacy.elapsed
+        book_rate = bids / order_book.elapsed
+        self.stdout.write(f"messages per room:  {bids} ({self.stale_ratio:.0%} too low)")
+        self.stdout.write(f"database path:      {legacy_rate:10.0f} msgs/sec")
+        self.stdout.write(f"order book path:    {book_rate:10.0f} msgs/sec")
+        self.stdout.write(f"speed-up:           {book_rate / legacy_rate:10.1f}x")
+        self.stdout.write(f"order book stored:  {stored} (database path stored {expected})")
+        if stored != expected:
+            raise CommandError(f"The order book stored {stored} bids, the database path {expected}: results are void.")
+
+    def amounts(self, item, count):
+        amounts, price, stale = [], item.start_price, 0.0
+        for _ in range(count):
+            stale += self.stale_ratio
+            if stale >= 1 and amounts:
+                stale -= 1
+                amounts.append(price)
+                continue
+            price += item.min_increment
+            amounts.append(price)
+        return amounts
+
+    def run_legacy(self, item, users, bids):
+        # Replays the queries BidConsumer.receive + Bid.clean used to issue per message
+        for i, amount in enumerate(self.amounts(item, bids)):
+            current = Item.objects.get(id=item.id)
+            last_bid = Bid.objects.filter(item_id=item.id).order_by("-created_at").first()
+            current_price = last_bid.amount if last_bid else current.start_price
+            if amount < current_price + current.min_increment:
+                continue
+            Item.objects.select_related("auction").get(id=item.id).auction.end_date
+            Bid.objects.filter(item=current).aggregate(Max("amount"))
+            bid = Bid(item=current, amount=amount, created_by=users[i % len(users)])
+            Bid.objects.bulk_create([bid])
+            BidBasicSerializer(bid).data
+
+    async def run_order_book(self, item, users, bids):
+        book = await OrderBook.load(item.id)
+        for i, amount in enumerate(self.amounts(item, bids)):
+            try:
+                bid = await book.place(users[i % len(users)], Decimal(amount))
+            except BidRejected:
+                continue
+            BidBasicSerializer(bid).data
@@ -1,3 +1,35 @@
+from django.contrib.auth import get_user_model
 from django.db import models
 
-# Create your models here.
+from main.models import Item
+
+User = get_user_model()
+
+
+class PresenceWorker(models.Model):
+    """A process serving bidding rooms, with its last presence heartbeat (``rooms.presence``)."""
+
+    name = models.CharField(max_length=255, unique=True)
+    seen_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.seen_at}"
+
+
+class RoomWatcher(models.Model):
+    """A user watching an item's room through a socket of ``worker``."""
+
+    worker = models.ForeignKey(PresenceWorker, on_delete=models.CASCADE, related_name="watchers")
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name="watchers")
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["worker", "item", "user"], name="room_watcher_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["item", "user"], name="room_watcher_item_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} watching {self.item_id}"
@@ -0,0 +1,305 @@
+"""
+In-memory order books for the bidding rooms.
+
+An ``OrderBook`` is loaded once per item, on the first connect to its room,
+and mirrors the item's bidding state (high bid, increment, reserve,
+deadline). Bids that can't win are rejected from memory without touching the
+database; the rest go to ``main.bidding.accept_bid``, whose conditional
+UPDATE decides races between consumers and processes.
+
+Books are loaded with the async ORM. An accept is the one remaining sync
+call of a bid (it needs a transaction): a single thread hop, made on a pool
+of its own (``BID_ACCEPT_WORKERS`` threads) rather than on the one
+thread-sensitive executor every other sync call of the process queues on.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from main.bidding import BidRejected, accept_bid, check_bid, minimum_bid, normalize_amount
+from main.journal import get_journal
+from main.models import Bid, Item
+from main.scheduler import get_scheduler
+
+
+class OrderBook:
+    """The live state of one item's bidding: high bid, increment, reserve."""
+
+    def __init__(self, item_id, start_price, min_increment, reserve_price=None,
+                 auction_id=None, closes_at=None, is_active=True, end_at=None,
+                 current_price=None, current_winner_id=None, bid_count=0,
+                 soft_close_window=None, soft_close_extension=None, extensions=0):
+        self.item_id = item_id
+        self.start_price = start_price
+        self.min_increment = min_increment
+        self.reserve_price = reserve_price
+        self.auction_id = auction_id
+        self.closes_at = closes_at
+        self.soft_close_window = soft_close_window
+        self.soft_close_extension = soft_close_extension
+        self.extensions = extensions
+        self.is_active = is_active
+        self.end_at = end_at
+        self.current_price = current_price
+        self.current_winner_id = current_winner_id
+        self.bid_count = bid_count
+        # Journal mode: (amount, closes_at, extensions) of the bids whose
+        # append is still being synced, oldest first
+        self.journaling = []
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            item_id=item.id,
+            start_price=item.start_price,
+            min_increment=item.min_increment,
+            reserve_price=item.reserve_price,
+            auction_id=item.auction_id,
+            closes_at=item.closes_at,
+            is_active=item.is_active,
+            end_at=item.end_at,
+            current_price=item.current_price,
+            current_winner_id=item.current_winner_id,
+            bid_count=item.bid_count,
+            soft_close_window=item.soft_close_window,
+            soft_close_extension=item.soft_close_extension,
+            extensions=item.extensions,
+        )
+
+    @classmethod
+    async def load(cls, item_id):
+        """Build a book from the database (one query). Returns None if the item is missing."""
+        try:
+            item = await Item.objects.aget(pk=item_id)
+        except Item.DoesNotExist:
+            return None
+        return cls.from_item(item)
+
+    @property
+    def ended(self):
+        return self.end_at is not None
+
+    @property
+    def min_acceptable_bid(self):
+        if self.journaling:
+            return self.journaling[-1][0] + self.min_increment
+        return minimum_bid(self)
+
+    @property
+    def reserve_met(self):
+        return self.reserve_price is None or (
+            self.current_price is not None and self.current_price >= self.reserve_price
+        )
+
+    def check(self, amount: Decimal):
+        """Reject from memory a bid that can't beat the last known state."""
+        check_bid(self, amount, closes_at=self.closes_at)
+        if self.journaling:
+            # Bids still being journaled raise the bar as if already placed
+            required = self.min_acceptable_bid
+            if amount < required:
+                raise BidRejected(
+                    f"Bid must be at least {required:.2f}", BidRejected.TOO_LOW, min_acceptable_bid=required
+                )
+
+    def in_soft_close(self, now, closes_at=None):
+        """Whether a bid at ``now`` may extend the deadline (``closes_at``, the book's by default)."""
+        closes_at = closes_at or self.closes_at
+        return (
+            self.soft_close_window is not None
+            and closes_at is not None
+            and closes_at - now <= self.soft_close_window
+        )
+
+    async def place(self, user, amount: Decimal):
+        """
+        Place a bid: memory check first, then the atomic database accept.
+
+        Nothing is locked while the accept is awaited; concurrent bids on the
+        same item are ordered by the conditional UPDATE. Returns the saved
+        ``Bid`` or raises ``BidRejected``; ``bid.extended`` tells whether the
+        bid moved this book's deadline (then ``closes_at`` is the new one).
+        """
+        self.check(amount)
+        journal = get_journal()
+        if journal is not None:
+            return await self.journal_bid(journal, user, amount)
+
+        # The database deadline is never earlier than the book's, so a bid
+        # outside the book's soft-close window can't extend the item.
+        soft_close = self.in_soft_close(timezone.now())
+        try:
+            bid = await database_sync_to_async(accept_bid, thread_sensitive=False, executor=accept_executor())(
+                self.item_id, user, amount, soft_close=soft_close, read_deadline=soft_close
+            )
+        except BidRejected as e:
+            self.resync(e)
+            raise
+        self.advance(bid.amount, user.id)
+        bid.extended = bid.closes_at is not None and self.extend(bid.closes_at)
+        return bid
+
+    async def journal_bid(self, journal, user, amount):
+        """
+        Journal mode (``main.journal``): the book decides, and the bid is
+        acknowledged once the journal has it on disk. Only then does the book
+        advance; until then the bid is in ``journaling``. A failed append
+        is rejected as ``UNAVAILABLE`` and leaves the book as it was.
+        """
+        amount = normalize_amount(amount)
+        now = timezone.now()
+        # Decided without an await since the check, so in order with every
+        # other bid of this process
+        _, closes_at, extensions = self.journaling[-1] if self.journaling else (None, self.closes_at, self.extensions)
+        extended = False
+        if self.in_soft_close(now, closes_at) and closes_at < now + self.soft_close_extension:
+            closes_at, extensions, extended = now + self.soft_close_extension, extensions + 1, True
+        entry = (amount, closes_at, extensions)
+        self.journaling.append(entry)
+        try:
+            await journal.append({
+                "item": self.item_id,
+                "user": user.id,
+                "amount": str(amount),
+                "closes_at": closes_at.isoformat() if closes_at else None,
+                "extensions": extensions,
+                "created_at": now.isoformat(),
+            })
+        except OSError as e:
+            raise BidRejected("The bid could not be recorded, please retry", BidRejected.UNAVAILABLE) from e
+        finally:
+            self.journaling.remove(entry)
+        self.advance(amount, user.id)
+        extended = extended and self.extend(closes_at)
+        bid = Bid(item_id=self.item_id, created_by=user, amount=amount, created_at=now)
+        bid.closes_at = self.closes_at if extended else None
+        bid.extended = extended
+        return bid
+
+    def advance(self, amount, user_id):
+        # Bids may come back from the database out of order; only ever move up.
+        if self.bid_count and self.current_price is not None and amount <= self.current_price:
+            self.bid_count += 1
+            return
+        self.current_price = amount
+        self.current_winner_id = user_id
+        self.bid_count += 1
+
+    def extend(self, closes_at):
+        """Adopt a later deadline; returns whether it moved."""
+        if self.closes_at is not None and closes_at <= self.closes_at:
+            return False
+        self.closes_at = closes_at
+        self.extensions += 1
+        scheduler = get_scheduler()
+        if scheduler is not None:
+            scheduler.schedule(self.item_id, closes_at)
+        return True
+
+    def follow_auction_end(self, end_date):
+        # Same rule as main.signals.sync_item_deadlines
+        if not self.extensions or self.closes_at is None or self.closes_at < end_date:
+            self.closes_at = end_date
+
+    def resync(self, rejection):
+        """Adopt the database state reported with a rejection."""
+        if rejection.code == BidRejected.TOO_LOW and rejection.bid_count is not None:
+            if rejection.bid_count >= self.bid_count:
+                self.current_price = rejection.current_price
+                self.bid_count = rejection.bid_count
+        elif rejection.code in (BidRejected.INACTIVE, BidRejected.NOT_FOUND):
+            self.is_active = False
+
+    def refresh_item(self, item):
+        """Pick up admin edits to the item."""
+        self.start_price = item.start_price
+        self.min_increment = item.min_increment
+        self.reserve_price = item.reserve_price
+        self.soft_close_window = item.soft_close_window
+        self.soft_close_extension = item.soft_close_extension
+        self.is_active = item.is_active
+        self.end_at = item.end_at
+        if item.closes_at is not None and (self.closes_at is None or item.closes_at > self.closes_at):
+            self.closes_at = item.closes_at
+        self.extensions = max(self.extensions, item.extensions)
+        if item.bid_count >= self.bid_count:
+            self.current_price = item.current_price
+            self.current_winner_id = item.current_winner_id
+            self.bid_count = item.bid_count
+
+
+_executor = None
+
+
+def accept_workers():
+    # SQLite has a single writer: more threads would only wait for its lock
+    default = 1 if connection.vendor == "sqlite" else 8
+    return getattr(settings, "BID_ACCEPT_WORKERS", None) or default
+
+
+def accept_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=accept_workers(), thread_name_prefix="bid-accept")
+    return _executor
+
+
+def reset_accept_executor():
+    """
+    Shut the accept pool down; the next accept starts a new one. Its threads
+    keep the connection they opened, so this is needed when the database
+    changes under them (benchmarks on a scratch database).
+    """
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+# item_id -> OrderBook, shared by every consumer of this process
+_books = {}
+_loading = {}
+
+
+async def get_order_book(item_id):
+    """
+    Return the book for ``item_id``, loading it on first use.
+
+    Concurrent first connects share a single load instead of each querying.
+    """
+    item_id = int(item_id)
+    book = _books.get(item_id)
+    if book is not None:
+        return book
+
+    loading = _loading.get(item_id)
+    if loading is None:
+        loading = asyncio.ensure_future(OrderBook.load(item_id))
+        _loading[item_id] = loading
+        try:
+            book = await loading
+        finally:
+            _loading.pop(item_id, None)
+        if book is not None:
+            _books[item_id] = book
+        return book
+
+    return await asyncio.shield(loading)
+
+
+def cached_order_book(item_id):
+    """The already loaded book for ``item_id`` or None (never queries)."""
+    return _books.get(int(item_id))
+
+
+def order_books_for_auction(auction_id):
+    return [book for book in list(_books.values()) if book.auction_id == auction_id]
+
+
+def forget_order_book(item_id):
+    _books.pop(int(item_id), None)
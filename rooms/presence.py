@@ -0,0 +1,201 @@
+"""
+Who is watching the bidding rooms.
+
+Joins and leaves are not announced to the room one by one (a room filling
+up would cost O(N²) messages). The ``PresenceTracker`` of a process keeps
+the watcher set of each room it serves, in memory, and every ``INTERVAL``
+seconds:
+
+- writes what changed to ``RoomWatcher`` (one row per worker, room and
+  user) and refreshes the process's ``PresenceWorker`` heartbeat;
+- sends the rooms whose watchers changed a single ``presence`` frame with
+  the room's watcher count (distinct users, across processes) and its
+  change since the count this process announced last.
+
+A worker that dies takes its sockets with it without any disconnect: its
+heartbeat stops, and once older than ``STALE_AFTER`` its rows are left out
+of the counts, then deleted by the next process to sync, which announces the
+new counts of its rooms (bulk disconnect). Settings::
+
+    ROOM_PRESENCE = {"INTERVAL": 2, "STALE_AFTER": 30}
+"""
+import asyncio
+import json
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import PresenceWorker, RoomWatcher
+
+DEFAULTS = {"INTERVAL": 2, "STALE_AFTER": 30}
+
+# Names this process in the presence tables
+WORKER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def presence_option(name):
+    return getattr(settings, "ROOM_PRESENCE", {}).get(name, DEFAULTS[name])
+
+
+def live_watchers(now=None):
+    """The ``RoomWatcher`` rows of the workers whose heartbeat isn't stale."""
+    now = now or timezone.now()
+    stale_after = timedelta(seconds=presence_option("STALE_AFTER"))
+    return RoomWatcher.objects.filter(worker__seen_at__gte=now - stale_after)
+
+
+def watcher_counts(item_ids=None, now=None):
+    """``{item_id: watchers}`` of the watched items (of ``item_ids``), live workers only."""
+    watchers = live_watchers(now)
+    if item_ids is not None:
+        watchers = watchers.filter(item_id__in=item_ids)
+    return dict(watchers.order_by().values_list("item_id").annotate(count=Count("user_id", distinct=True)))
+
+
+def reap_workers(now=None):
+    """Forget the workers whose heartbeat is stale; returns the items they watched."""
+    now = now or timezone.now()
+    stale = PresenceWorker.objects.filter(seen_at__lt=now - timedelta(seconds=presence_option("STALE_AFTER")))
+    items = set(RoomWatcher.objects.filter(worker__in=stale).values_list("item_id", flat=True).distinct())
+    # Their RoomWatcher rows go with them
+    stale.delete()
+    return items
+
+
+class PresenceTracker:
+    def __init__(self, worker=WORKER, interval=None, channel_layer=None, clock=timezone.now):
+        self.worker = worker
+        self.interval = interval
+        self.channel_layer = channel_layer
+        self.clock = clock
+        # item_id -> {channel_name: user_id}, the sockets of this process
+        self.rooms = {}
+        # item_id -> user ids written to RoomWatcher
+        self.synced = {}
+        self.dirty = set()
+        # item_id -> watcher count sent to the room last
+        self.announced = {}
+        self.task = None
+        self.loop = None
+        # Sockets of other subsystems with rows under this worker, which
+        # need the heartbeat too (notificationapp.presence)
+        self.held = 0
+
+    def hold(self):
+        self.held += 1
+        self._ensure_running()
+
+    def release(self):
+        self.held -= 1
+
+    def join(self, item_id, channel_name, user_id):
+        self.rooms.setdefault(item_id, {})[channel_name] = user_id
+        self.dirty.add(item_id)
+        self._ensure_running()
+
+    def leave(self, item_id, channel_name):
+        room = self.rooms.get(item_id)
+        if room is None or room.pop(channel_name, None) is None:
+            return
+        if not room:
+            del self.rooms[item_id]
+        self.dirty.add(item_id)
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.loop is not loop:
+            self.loop = loop
+            self.task = loop.create_task(self._run())
+
+    async def _run(self):
+        interval = presence_option("INTERVAL") if self.interval is None else self.interval
+        # Until every room of the process is empty and synced
+        while self.rooms or self.dirty or self.held:
+            await asyncio.sleep(interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Room presence error: {e}")
+
+    def pending_changes(self):
+        """``{item_id: user ids}`` of the rooms changed since the last sync."""
+        dirty, self.dirty = self.dirty, set()
+        return {item_id: set(self.rooms.get(item_id, {}).values()) for item_id in dirty}
+
+    async def tick(self):
+        changes = self.pending_changes()
+        try:
+            counts, recreated = await database_sync_to_async(self.sync, thread_sensitive=False)(changes)
+        except Exception:
+            self.dirty |= set(changes)
+            raise
+        if recreated:
+            self.worker_recreated(rewritten=changes)
+        await self.announce(counts)
+
+    def worker_recreated(self, rewritten=()):
+        """
+        The worker's row was created again (reaped while alive, e.g. a
+        stalled loop), and its RoomWatcher rows went with the old one: every
+        room but those ``rewritten`` since is written again on the next tick.
+        On the loop only, like ``join`` and ``leave``.
+        """
+        for item_id in set(self.synced) - set(rewritten):
+            del self.synced[item_id]
+        self.dirty |= set(self.rooms) - set(rewritten)
+
+    def heartbeat(self, now=None):
+        """Refresh (or create) this worker's row; returns it and whether it was created. Sync."""
+        return PresenceWorker.objects.update_or_create(name=self.worker, defaults={"seen_at": now or self.clock()})
+
+    def sync(self, changes):
+        """
+        Write ``changes`` and the heartbeat, reap dead workers. Sync; returns
+        the watcher counts of the rooms that changed, and whether the
+        worker's row was created again (see ``worker_recreated``).
+        """
+        now = self.clock()
+        with transaction.atomic():
+            worker, recreated = self.heartbeat(now)
+            for item_id, users in changes.items():
+                # Rows written under a reaped row are gone
+                before = set() if recreated else self.synced.get(item_id, set())
+                RoomWatcher.objects.bulk_create(
+                    [RoomWatcher(worker=worker, item_id=item_id, user_id=user_id) for user_id in users - before],
+                    ignore_conflicts=True,
+                )
+                if before - users:
+                    RoomWatcher.objects.filter(worker=worker, item_id=item_id, user_id__in=before - users).delete()
+                if users:
+                    self.synced[item_id] = users
+                else:
+                    self.synced.pop(item_id, None)
+            affected = set(changes) | reap_workers(now)
+        counts = watcher_counts(affected, now)
+        return {item_id: counts.get(item_id, 0) for item_id in affected}, recreated
+
+    async def announce(self, counts):
+        channel_layer = self.channel_layer or get_channel_layer()
+        sends = []
+        for item_id, count in counts.items():
+            delta = count - self.announced.get(item_id, 0)
+            if not delta:
+                continue
+            if count:
+                self.announced[item_id] = count
+            else:
+                self.announced.pop(item_id, None)
+            text = json.dumps({"type": "presence", "item_id": item_id, "watchers": count, "delta": delta})
+            sends.append(channel_layer.group_send(f"auction_item_{item_id}", {"type": "presence_update", "text": text}))
+        await asyncio.gather(*sends)
+
+
+presence = PresenceTracker()
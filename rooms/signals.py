@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from main.models import Auction, Item
+from .order_book import cached_order_book, order_books_for_auction
+
+
+@receiver(post_save, sender=Item)
+def refresh_order_book_on_item_save(sender, instance, **kwargs):
+    # Keep already loaded books in line with edits made through the admin/API
+    book = cached_order_book(instance.id)
+    if book is not None:
+        book.refresh_item(instance)
+
+
+@receiver(post_save, sender=Auction)
+def refresh_order_books_on_auction_save(sender, instance, created, **kwargs):
+    if created:
+        return
+    for book in order_books_for_auction(instance.id):
+        book.follow_auction_end(instance.end_date)
@@ -1,3 +1,321 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.benchmarking import seed_auction, seed_users
+from main.bidding import BidRejected, accept_bid
+from main.models import Bid, Item
+from .broadcaster import Outbox, RoomBroadcaster
+from .models import PresenceWorker
+from .order_book import OrderBook, forget_order_book
+from .presence import PresenceTracker, watcher_counts
+from .routing import websocket_urlpatterns
+from .throttling import TokenBucket, acquire_attempt, counters, release_attempt
+
+
+class RoomBroadcasterTests(SimpleTestCase):
+    async def test_bids_of_one_window_share_a_frame(self):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add("auction_item_1", channel)
+        broadcaster = RoomBroadcaster("auction_item_1", window=0.01, channel_layer=layer)
+
+        for amount in ("10.00", "11.00", "12.00"):
+            broadcaster.publish({"amount": amount})
+        await broadcaster.flushing
+
+        message = await layer.receive(channel)
+        frame = json.loads(message["text"])
+        self.assertEqual(frame["bid"], {"amount": "12.00"})
+        self.assertEqual([b["amount"] for b in frame["bids"]], ["10.00", "11.00", "12.00"])
+        self.assertEqual(broadcaster.frames_sent, 1)
+
+        broadcaster.publish({"amount": "13.00"})
+        await broadcaster.flushing
+        frame = json.loads((await layer.receive(channel))["text"])
+        self.assertEqual(frame["bids"], [{"amount": "13.00"}])
+
+    async def test_bid_published_during_a_send_gets_its_own_frame(self):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add("auction_item_1", channel)
+        broadcaster = RoomBroadcaster("auction_item_1", window=0.01, channel_layer=layer)
+        group_send = layer.group_send
+
+        async def slow_group_send(group, message):
+            if broadcaster.frames_sent == 0:
+                broadcaster.publish({"amount": "11.00"})
+            await group_send(group, message)
+
+        layer.group_send = slow_group_send
+        broadcaster.publish({"amount": "10.00"})
+        await broadcaster.flushing
+
+        frames = [json.loads((await asyncio.wait_for(layer.receive(channel), 1))["text"]) for _ in range(2)]
+        self.assertEqual([f["bids"] for f in frames], [[{"amount": "10.00"}], [{"amount": "11.00"}]])
+        self.assertEqual(broadcaster.pending, [])
+        self.assertIsNone(broadcaster.flushing)
+
+
+class OutboxTests(SimpleTestCase):
+    async def test_slow_socket_only_keeps_the_newest_frame(self):
+        written, release = [], asyncio.Event()
+
+        async def slow_send(text_data):
+            written.append(text_data)
+            await release.wait()
+
+        outbox = Outbox(slow_send)
+        outbox.offer("a")
+        await asyncio.sleep(0)  # "a" is being written
+        for text in ("b", "c", "d"):
+            outbox.offer(text)
+        release.set()
+        await outbox.writer
+
+        self.assertEqual(written, ["a", "d"])
+        self.assertEqual(outbox.dropped, 2)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_refills_at_rate_up_to_burst(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+        self.assertAlmostEqual(bucket.retry_after, 0.5)
+
+        now[0] = 0.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+        now[0] = 100
+        self.assertEqual(sum(bucket.take() for _ in range(10)), 3)
+
+
+class OutstandingAttemptsTests(SimpleTestCase):
+    @override_settings(BID_THROTTLE={"MAX_OUTSTANDING": 1})
+    def test_one_attempt_per_user_and_item_in_flight(self):
+        self.assertTrue(acquire_attempt(1, 7))
+        self.assertFalse(acquire_attempt(1, 7))
+        self.assertTrue(acquire_attempt(1, 8))
+        self.assertTrue(acquire_attempt(2, 7))
+        release_attempt(1, 7)
+        self.assertTrue(acquire_attempt(1, 7))
+        for key in ((1, 7), (1, 8), (2, 7)):
+            release_attempt(*key)
+
+
+class RoomMixin:
+    def setUp(self):
+        counters.clear()
+        self.bidder, self.watcher = seed_users(2)
+        self.item, = seed_auction(self.bidder, start_price=Decimal("10.00"))
+        forget_order_book(self.item.id)
+
+    def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/place-bid/{self.item.id}/")
+        communicator.scope["user"] = user
+        return communicator
+
+    async def open_room(self):
+        bidder, watcher = self.connect(self.bidder), self.connect(self.watcher)
+        self.assertTrue((await watcher.connect())[0])
+        self.assertTrue((await bidder.connect())[0])
+        return bidder, watcher
+
+
+class BidRejectionTests(RoomMixin, TransactionTestCase):
+    def test_rejection_only_reaches_the_sender(self):
+        async def scenario():
+            bidder, watcher = await self.open_room()
+            await bidder.send_json_to({"amount": "5.00"})
+            reply = await bidder.receive_json_from()
+            self.assertEqual(reply["code"], "too_low")
+            self.assertEqual(reply["min_acceptable_bid"], "10.00")
+            self.assertTrue(await watcher.receive_nothing(0.1))
+            await bidder.disconnect()
+            await watcher.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(counters["too_low"], 1)
+        self.assertEqual(counters["fan_out_avoided"], 1)
+
+    @override_settings(BID_THROTTLE={"RATE": 1, "BURST": 2})
+    def test_rate_limited_per_connection(self):
+        async def scenario():
+            bidder, watcher = await self.open_room()
+            codes = []
+            for _ in range(3):
+                await bidder.send_json_to({"amount": "1.00"})
+                codes.append((await bidder.receive_json_from())["code"])
+            self.assertEqual(codes, ["too_low", "too_low", "rate_limited"])
+            await bidder.disconnect()
+            await watcher.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(counters["rate_limited"], 1)
+
+
+class SoftCloseRoomTests(RoomMixin, TransactionTestCase):
+    def test_extension_is_pushed_to_the_room(self):
+        closes_at = timezone.now() + timedelta(seconds=5)
+        Item.objects.filter(pk=self.item.pk).update(
+            closes_at=closes_at,
+            soft_close_window=timedelta(seconds=30),
+            soft_close_extension=timedelta(seconds=60),
+        )
+
+        async def scenario():
+            bidder, watcher = await self.open_room()
+            await bidder.send_json_to({"amount": "10.00"})
+            frames = [await watcher.receive_json_from() for _ in range(2)]
+            event = next(frame for frame in frames if frame.get("type") == "deadline_changed")
+            await bidder.disconnect()
+            await watcher.disconnect()
+            return parse_datetime(event["closes_at"])
+
+        extended_to = async_to_sync(scenario)()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.closes_at, extended_to)
+        self.assertGreater(extended_to, closes_at + timedelta(seconds=50))
+        self.assertEqual(self.item.extensions, 1)
+
+
+class PresenceTrackerTests(TestCase):
+    def setUp(self):
+        self.first, self.second = seed_users(2)
+        self.item, = seed_auction(self.first)
+
+    def test_counts_distinct_users_across_workers(self):
+        one, two = PresenceTracker(worker="one"), PresenceTracker(worker="two")
+        one.rooms = {self.item.id: {"a": self.first.id, "b": self.first.id}}
+        one.dirty = {self.item.id}
+        two.rooms = {self.item.id: {"c": self.second.id}}
+        two.dirty = {self.item.id}
+
+        self.assertEqual(one.sync(one.pending_changes()), ({self.item.id: 1}, True))
+        self.assertEqual(two.sync(two.pending_changes()), ({self.item.id: 2}, True))
+
+        one.leave(self.item.id, "a")
+        self.assertEqual(one.pending_changes(), {self.item.id: {self.first.id}})
+        one.leave(self.item.id, "b")
+        self.assertEqual(one.sync(one.pending_changes()), ({self.item.id: 1}, False))
+
+    def test_dead_worker_is_reaped(self):
+        dead, alive = PresenceTracker(worker="dead"), PresenceTracker(worker="alive")
+        dead.rooms = {self.item.id: {"a": self.first.id}}
+        dead.dirty = {self.item.id}
+        dead.sync(dead.pending_changes())
+        self.assertEqual(watcher_counts(), {self.item.id: 1})
+
+        PresenceWorker.objects.filter(name="dead").update(seen_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(watcher_counts(), {})
+        # The next sync of any worker announces the room's new count
+        self.assertEqual(alive.sync({})[0], {self.item.id: 0})
+        self.assertFalse(PresenceWorker.objects.filter(name="dead").exists())
+
+    def test_reaped_worker_writes_its_rooms_again(self):
+        other, = seed_auction(self.first)
+        tracker = PresenceTracker(worker="slow")
+        tracker.rooms = {self.item.id: {"a": self.first.id}}
+        tracker.dirty = {self.item.id}
+        tracker.sync(tracker.pending_changes())
+
+        # Reaped by another worker while its loop was stalled
+        PresenceWorker.objects.filter(name="slow").delete()
+        tracker.rooms[other.id] = {"b": self.second.id}
+        tracker.dirty = {other.id}
+        changes = tracker.pending_changes()
+        self.assertEqual(tracker.sync(changes), ({other.id: 1}, True))
+
+        # Back on the loop: the room left out of that sync is written again
+        tracker.worker_recreated(rewritten=changes)
+        self.assertEqual(set(tracker.synced), {other.id})
+        self.assertEqual(tracker.dirty, {self.item.id})
+        self.assertEqual(tracker.sync(tracker.pending_changes()), ({self.item.id: 1}, False))
+
+
+class PresenceRoomTests(RoomMixin, TransactionTestCase):
+    @override_settings(ROOM_PRESENCE={"INTERVAL": 0.05, "STALE_AFTER": 30})
+    def test_joins_are_coalesced_into_one_count(self):
+        async def scenario():
+            bidder, watcher = await self.open_room()
+            frame = await watcher.receive_json_from(timeout=2)
+            self.assertEqual(frame, {"type": "presence", "item_id": self.item.id, "watchers": 2, "delta": 2})
+            self.assertTrue(await watcher.receive_nothing(0.2))
+
+            await bidder.disconnect()
+            frame = await watcher.receive_json_from(timeout=2)
+            self.assertEqual((frame["watchers"], frame["delta"]), (1, -1))
+            await watcher.disconnect()
+            await asyncio.sleep(0.2)
+
+        async_to_sync(scenario)()
+        self.assertEqual(watcher_counts(), {})
+
+        response = self.client.get("/api/rooms/watchers/", {"items": str(self.item.id)})
+        self.assertEqual(response.json(), {"watchers": {str(self.item.id): 0}})
+
+
+class OrderBookTests(TransactionTestCase):
+    def setUp(self):
+        self.bidder, self.rival = seed_users(2)
+        self.item, = seed_auction(self.bidder, start_price=Decimal("10.00"))
+        self.book = async_to_sync(OrderBook.load)(self.item.id)
+
+    def place(self, amount, user=None):
+        return async_to_sync(self.book.place)(user or self.bidder, Decimal(amount))
+
+    def test_bids_are_stored_before_they_are_acknowledged(self):
+        for amount in ("10.00", "11.00"):
+            self.assertIsNotNone(self.place(amount).pk)
+        with self.assertRaises(BidRejected) as rejected:
+            self.place("11.50")
+        self.assertEqual(rejected.exception.code, BidRejected.TOO_LOW)
+        self.assertEqual(list(Bid.objects.order_by("amount").values_list("amount", flat=True)),
+                         [Decimal("10.00"), Decimal("11.00")])
+        self.assertEqual((self.book.current_price, self.book.bid_count), (Decimal("11.00"), 2))
+
+    def test_stale_book_resyncs_from_the_rejection(self):
+        # Accepted by another process: this book still has the start price
+        accept_bid(self.item.id, self.rival, Decimal("20.00"))
+        with self.assertRaises(BidRejected):
+            self.place("11.00")
+        self.assertEqual((self.book.current_price, self.book.bid_count), (Decimal("20.00"), 1))
+        self.assertEqual(Bid.objects.count(), 1)
+
+    def test_journaled_bid_advances_the_book_once_on_disk(self):
+        synced = asyncio.Event()
+
+        class Journal:
+            async def append(self, record):
+                await synced.wait()
+                if record["amount"] == "12.00":
+                    raise OSError("disk full")
+
+        async def scenario():
+            first = asyncio.ensure_future(self.book.journal_bid(Journal(), self.bidder, Decimal("10.00")))
+            await asyncio.sleep(0)
+            # Not on disk yet: the book is unchanged, but the bar is raised
+            self.assertEqual((self.book.current_price, self.book.bid_count), (None, 0))
+            with self.assertRaises(BidRejected):
+                self.book.check(Decimal("10.50"))
+            synced.set()
+            await first
+            with self.assertRaises(BidRejected) as failed:
+                await self.book.journal_bid(Journal(), self.rival, Decimal("12.00"))
+            self.assertEqual(failed.exception.code, BidRejected.UNAVAILABLE)
+
+        async_to_sync(scenario)()
+        self.assertEqual((self.book.current_price, self.book.bid_count), (Decimal("10.00"), 1))
+        self.assertEqual(self.book.current_winner_id, self.bidder.id)
+        self.assertEqual(self.book.journaling, [])
@@ -0,0 +1,78 @@
+"""
+Limits on bid attempts, and the counters of the private rejection path.
+
+Rejected bids are answered to their sender only. Each connection also gets
+a token bucket (``RATE`` attempts per second, bursts of ``BURST``). Each user
+may have at most ``MAX_OUTSTANDING`` attempts on one item in flight in this
+process at a time. Settings::
+
+    BID_THROTTLE = {"RATE": 5, "BURST": 10, "MAX_OUTSTANDING": 2}
+"""
+import time
+from collections import Counter
+
+from django.conf import settings
+
+DEFAULTS = {"RATE": 5, "BURST": 10, "MAX_OUTSTANDING": 2}
+
+
+def throttle_option(name):
+    return getattr(settings, "BID_THROTTLE", {}).get(name, DEFAULTS[name])
+
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=None, clock=time.monotonic):
+        self.rate = rate or throttle_option("RATE")
+        self.burst = burst or throttle_option("BURST")
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated_at = clock()
+
+    def take(self):
+        """Spend one token; False when the bucket is empty."""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    @property
+    def retry_after(self):
+        """Seconds until the next token."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+# (user_id, item_id) -> attempts awaiting their answer, in this process
+_outstanding = Counter()
+
+
+def acquire_attempt(user_id, item_id):
+    key = (user_id, item_id)
+    if _outstanding[key] >= throttle_option("MAX_OUTSTANDING"):
+        return False
+    _outstanding[key] += 1
+    return True
+
+
+def release_attempt(user_id, item_id):
+    key = (user_id, item_id)
+    _outstanding[key] -= 1
+    if _outstanding[key] <= 0:
+        del _outstanding[key]
+
+
+# rejected: answered to the sender only; rate_limited / too_many_outstanding:
+# refused before reaching the order book; fan_out_avoided: room messages a
+# rejection would have cost when it was broadcast to every watcher
+counters = Counter()
+
+
+def record_rejection(reason, room_size):
+    counters[reason] += 1
+    counters["fan_out_avoided"] += max(room_size - 1, 0)
+
+
+def bid_counters():
+    return dict(counters)
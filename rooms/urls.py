@@ -1,3 +1,7 @@
+from django.urls import path
+
+from .views import WatchersView
+
 urlpatterns = [
-    
+    path("rooms/watchers/", WatchersView.as_view(), name="room-watchers"),
 ]
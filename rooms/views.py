@@ -1,3 +1,23 @@
-from django.shortcuts import render
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from .presence import watcher_counts
+
+
+class WatchersView(APIView):
+    """
+    Current watchers of the bidding rooms: ?items=1,2,3 for those items
+    (0 when nobody watches), otherwise every watched item.
+    """
+
+    def get(self, request):
+        items = request.query_params.get("items")
+        if not items:
+            return Response({"watchers": watcher_counts()})
+        try:
+            item_ids = [int(item_id) for item_id in items.split(",")]
+        except ValueError:
+            return Response({"error": "items must be comma separated ids"}, status=status.HTTP_400_BAD_REQUEST)
+        counts = watcher_counts(item_ids)
+        return Response({"watchers": {item_id: counts.get(item_id, 0) for item_id in item_ids}})